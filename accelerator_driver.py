@@ -2,7 +2,7 @@
 File: accelerator_driver.py
 Author: Dr. Michael Hall, Professor CSE 462M, Washington University
 """
-from pynq import Overlay, DefaultIP, allocate
+from pynq_backend import Overlay, DefaultIP, allocate
 from enum import IntEnum
 from itertools import chain
 import numpy as np
@@ -26,18 +26,124 @@ class AcceleratorDriver(DefaultIP):
     OARG_LENGTH_REG_BASE_ADDR = 0x0200
     OARG_TDEST_REG_BASE_ADDR = 0x0240
 
+    # STATUS register bits.
+    STATUS_START = 1 << 0
+    STATUS_DONE = 1 << 1
+    STATUS_IDLE = 1 << 2
+    STATUS_READY = 1 << 3
+
+    # Configuration registers that only software writes. Their last written value is kept in a shadow copy, so
+    # reading them costs no bus access and rewriting an unchanged value is skipped. CTRL is shadowed for reads
+    # only: writing it is an action (soft reset), so those writes are always issued.
+    CONFIG_REG_ADDRS = frozenset(chain(
+        (IARG_RQT_EN_REG_ADDR, OARG_RQT_EN_REG_ADDR, OARG_LENGTH_MODE_REG_ADDR,
+         ISCALAR_RQT_EN_REG_ADDR, OSCALAR_RQT_EN_REG_ADDR),
+        range(OARG_LENGTH_REG_BASE_ADDR, OARG_LENGTH_REG_BASE_ADDR + (8 << 2), 4),
+        range(OARG_TDEST_REG_BASE_ADDR, OARG_TDEST_REG_BASE_ADDR + (8 << 2), 4)))
+
+    # (first register index, count) of the contiguous blocks read by dump_registers, and the subset needed by
+    # dump_debug_info. The debug subset leaves out the scalar data registers, whose reads pop the scalar FIFOs.
+    REGISTER_BLOCKS = ((0, 2), (4, 2), (10, 1), (15, 5), (32, 24), (64, 8), (80, 8), (96, 40), (144, 8))
+    DEBUG_REGISTER_BLOCKS = ((0, 2), (4, 2), (15, 1), (64, 8), (80, 8), (96, 24))
+    # Blocks holding every configuration register, read back into the shadow after a soft reset.
+    CONFIG_REGISTER_BLOCKS = ((4, 2), (15, 5), (128, 8), (144, 8))
+
     class OutputArgumentLengthModeEnum(IntEnum):
         Hardware: int = 0
         Software: int = 1
 
     def __init__(self, description):
         super().__init__(description=description)
+        self._shadow = {}
+        self.mmio_reads = 0
+        self.mmio_writes = 0
+        self.mmio_skipped_writes = 0
+        self.mmio_shadow_hits = 0
+        self.mmio_block_reads = 0
+        self.mmio_block_words = 0
 
     bindto = ["xilinx.com:ip:axis_accelerator_adapter:2.1"]
 
     def _compute_indexed_offset(self, base_addr: int, index: int):
         return base_addr + (index << 2)
 
+    def read(self, offset=0):
+        """ Register read. Shadowed registers are answered from the shadow copy without a bus access. """
+        value = self._shadow.get(offset)
+        if value is not None:
+            self.mmio_shadow_hits += 1
+            return value
+        self.mmio_reads += 1
+        return super().read(offset)
+
+    def write(self, offset, value):
+        """ Register write. A configuration register already holding `value` is not written again. """
+        value = int(value) & 0xFFFFFFFF
+        if offset in self.CONFIG_REG_ADDRS:
+            if self._shadow.get(offset) == value:
+                self.mmio_skipped_writes += 1
+                return
+            self._shadow[offset] = value
+        elif offset == self.CTRL_REG_ADDR:
+            self._shadow[offset] = value
+        self.mmio_writes += 1
+        super().write(offset, value)
+
+    def invalidate_shadow(self):
+        """ Forget every shadowed value, so the next reads go to the hardware and the next writes are issued. """
+        self._shadow.clear()
+
+    def apply_config(self, config):
+        """
+        Write a whole configuration as one ordered sequence, skipping configuration registers that already hold
+        the requested value. Non-configuration registers in the sequence (e.g. commands) are always written.
+
+        Parameters:
+        - config (iterable of (int, int)): (offset, value) pairs, written in order
+
+        Returns:
+        - int: Number of writes actually issued
+        """
+        issued = self.mmio_writes
+        for offset, value in config:
+            self.write(offset, value)
+        return self.mmio_writes - issued
+
+    def read_block(self, offset: int, count: int) -> np.ndarray:
+        """
+        Read `count` consecutive 32-bit registers starting at `offset` in one pass over the MMIO array.
+
+        Returns:
+        - np.ndarray: Copy of the registers as uint32
+        """
+        self.mmio_block_reads += 1
+        self.mmio_block_words += count
+        start = offset >> 2
+        return np.array(self.mmio.array[start:start + count], dtype=np.uint32)
+
+    def snapshot(self, blocks=REGISTER_BLOCKS) -> np.ndarray:
+        """
+        Read the given (first register index, count) blocks with one bulk read each.
+
+        Returns:
+        - np.ndarray: uint32 array indexed by register index; registers outside the blocks read as 0
+        """
+        registers = np.zeros(max(first + count for first, count in blocks), dtype=np.uint32)
+        for first, count in blocks:
+            registers[first:first + count] = self.read_block(first << 2, count)
+        return registers
+
+    def mmio_stats(self):
+        """ Control-path bus traffic since the driver was created. """
+        return {
+            "reads": self.mmio_reads,
+            "writes": self.mmio_writes,
+            "skipped_writes": self.mmio_skipped_writes,
+            "shadow_hits": self.mmio_shadow_hits,
+            "block_reads": self.mmio_block_reads,
+            "block_words": self.mmio_block_words,
+        }
+
     @property
     def ctrl_reg(self):
         """ Control Register (CTRL). Provides soft reset option for the Accelerator Adapter core. """
@@ -57,6 +163,10 @@ class AcceleratorDriver(DefaultIP):
     def status_reg(self, value):
         self.write(self.STATUS_REG_ADDR, value)
 
+    def is_done_or_idle(self):
+        """ True when the STATUS register reports done or idle. Costs a single MMIO read. """
+        return bool(self.status_reg & (self.STATUS_DONE | self.STATUS_IDLE))
+
     @property
     def iarg_rqt_en_reg(self):
         """ Input Argument Request Enable Register (IARG_RQT_EN).
@@ -125,10 +235,20 @@ class AcceleratorDriver(DefaultIP):
         self.write(self.OSCALAR_RQT_EN_REG_ADDR, value)
 
     def soft_reset(self):
-        """ Soft Reset. Resets adapter core logic. """
+        """
+        Soft Reset. Resets adapter core logic, then reloads the shadowed configuration registers from the hardware,
+        so values the reset kept are not rewritten by the next configuration and values it cleared are.
+        """
         saved = self.ctrl_reg
         self.ctrl_reg = saved | 0x1
         self.ctrl_reg = saved & ~0x1
+        self.reload_shadow()
+
+    def reload_shadow(self):
+        """ Replace the shadowed configuration registers with their hardware values, in a few bulk reads. """
+        registers = self.snapshot(self.CONFIG_REGISTER_BLOCKS)
+        for offset in self.CONFIG_REG_ADDRS:
+            self._shadow[offset] = int(registers[offset >> 2])
 
     def set_iscalar_data(self, n, data):
         """ Input Scalar Write Data Register (ISCALARn_DATA) """
@@ -171,11 +291,10 @@ class AcceleratorDriver(DefaultIP):
     def dump_registers(self):
         """ Dump all registers. """
         print("Register Dump:")
-        for ri in chain(range(2), range(4, 6), range(10, 11), range(15, 20),
-                        range(32, 56), range(64, 72),
-                        range(80, 88), range(96, 136), range(144, 152)):
+        registers = self.snapshot(self.REGISTER_BLOCKS)
+        for ri in chain.from_iterable(range(first, first + count) for first, count in self.REGISTER_BLOCKS):
             offset = ri << 2
-            value = self.read(offset)
+            value = int(registers[ri])
             print(
                 f"{ri:4d} (offset:0x{offset:04x}): value = {value:10d} (0x{value:08x}) ({bin(value)})")
 
@@ -188,32 +307,38 @@ class AcceleratorDriver(DefaultIP):
         def bslice(value, bhi, bli):
             return (value >> bli) & ((1 << (bhi - bli + 1)) - 1)
 
+        # One bulk read per block instead of a read per register; the values below are decoded from it.
+        registers = self.snapshot(self.DEBUG_REGISTER_BLOCKS)
+
+        def reg(offset):
+            return int(registers[offset >> 2])
+
         print("Debug Dump:")
-        control_reg_value = self.ctrl_reg
+        control_reg_value = reg(self.CTRL_REG_ADDR)
         print(f"0x{self.CTRL_REG_ADDR:04x} (Control register):")
         print(f"   rst:{b(control_reg_value, 0)} gie:{b(control_reg_value, 1)}")
-        status_reg_value = self.status_reg
+        status_reg_value = reg(self.STATUS_REG_ADDR)
         print(f"0x{self.STATUS_REG_ADDR:04x} (Status register):")
         print(
             f"   start:{b(status_reg_value, 0)} done:{b(status_reg_value, 1)}"
             f" idle:{b(status_reg_value, 2)} ready:{b(status_reg_value, 3)}"
         )
 
-        iarg_rqt_en_reg_value = self.iarg_rqt_en_reg
+        iarg_rqt_en_reg_value = reg(self.IARG_RQT_EN_REG_ADDR)
         print(
             f"0x{self.IARG_RQT_EN_REG_ADDR:04x} (Input argument request enable register): 0x{iarg_rqt_en_reg_value:08x}")
         for i in range(8):
             if not b(iarg_rqt_en_reg_value, i): continue
             print(f"   iarg{i}_en = {b(iarg_rqt_en_reg_value, i)}")
 
-        oarg_rqt_en_reg_value = self.oarg_rqt_en_reg
+        oarg_rqt_en_reg_value = reg(self.OARG_RQT_EN_REG_ADDR)
         print(
             f"0x{self.OARG_RQT_EN_REG_ADDR:04x} (Output argument request enable register): 0x{oarg_rqt_en_reg_value:08x}")
         for i in range(8):
             if not b(oarg_rqt_en_reg_value, i): continue
             print(f"   oarg{i}_en = {b(oarg_rqt_en_reg_value, i)}")
 
-        oarg_length_mode_reg_value = self.oarg_length_mode_reg
+        oarg_length_mode_reg_value = reg(self.OARG_LENGTH_MODE_REG_ADDR)
         print(
             f"0x{self.OARG_LENGTH_MODE_REG_ADDR:04x} (Output argument length mode register): 0x{oarg_length_mode_reg_value:08x}")
         for i in range(8):
@@ -224,28 +349,28 @@ class AcceleratorDriver(DefaultIP):
         print(f"0x{self.IARG_STATUS_REG_BASE_ADDR:04x} (Input buffer status register):")
         for i in range(8):
             if not b(iarg_rqt_en_reg_value, i): continue
-            iarg_status_reg_value = self.get_iarg_status_reg(i)
+            iarg_status_reg_value = reg(self._compute_indexed_offset(self.IARG_STATUS_REG_BASE_ADDR, i))
             print(
                 f"   iarg{i}_status = used_buf:{bslice(iarg_status_reg_value, 3, 0)}, empty:{b(iarg_status_reg_value, 4)}, full:{b(iarg_status_reg_value, 5)}")
 
         print(f"0x{self.OARG_STATUS_REG_BASE_ADDR:04x} (Output buffer status register):")
         for i in range(8):
             if not b(oarg_rqt_en_reg_value, i): continue
-            oarg_status_reg_value = self.get_oarg_status_reg(i)
+            oarg_status_reg_value = reg(self._compute_indexed_offset(self.OARG_STATUS_REG_BASE_ADDR, i))
             print(
                 f"   oarg{i}_status = used_buf:{bslice(oarg_status_reg_value, 3, 0)}, empty:{b(oarg_status_reg_value, 4)}, full:{b(oarg_status_reg_value, 5)}")
 
         print(
             f"0x{self.ISCALAR_STATUS_REG_BASE_ADDR:04x} (Input scalar status register):")
         for i in range(8):
-            iscalar_status_reg_value = self.get_iscalar_status_reg(i)
+            iscalar_status_reg_value = reg(self._compute_indexed_offset(self.ISCALAR_STATUS_REG_BASE_ADDR, i))
             print(
                 f"   iscalar{i}_status = used_buf:{bslice(iscalar_status_reg_value, 3, 0)}, empty:{b(iscalar_status_reg_value, 4)}, full:{b(iscalar_status_reg_value, 5)}")
 
         print(
             f"0x{self.OSCALAR_STATUS_REG_BASE_ADDR:04x} (Output scalar status register):")
         for i in range(8):
-            oscalar_status_reg_value = self.get_oscalar_status_reg(i)
+            oscalar_status_reg_value = reg(self._compute_indexed_offset(self.OSCALAR_STATUS_REG_BASE_ADDR, i))
             print(
                 f"   oscalar{i}_status = used_buf:{bslice(oscalar_status_reg_value, 3, 0)}, empty:{b(oscalar_status_reg_value, 4)}, full:{b(oscalar_status_reg_value, 5)}")
 
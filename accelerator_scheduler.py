@@ -0,0 +1,235 @@
+"""
+File: accelerator_scheduler.py
+Authors: B. Ko, C. Okoye, S. Xiao
+"""
+
+import itertools
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Optional, Sequence
+import numpy as np
+from tracing import NULL_TRACE, Trace
+
+# ######################################################################################################################
+
+class QueueFullError(RuntimeError):
+    """ Raised by AcceleratorScheduler.submit when the request queue is at capacity. """
+
+    def __init__(self, retry_after: int):
+        super().__init__("Accelerator queue is full")
+        self.retry_after = retry_after
+
+
+class _Job:
+    __slots__ = ("frame", "trace", "plane", "future", "enqueued", "cache_key")
+
+    def __init__(self, frame: np.ndarray, trace: Trace, plane: int = 0, cache_key: Optional[tuple] = None):
+        self.frame = frame
+        self.trace = trace
+        self.plane = plane
+        self.cache_key = cache_key
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+
+
+# ######################################################################################################################
+
+class AcceleratorScheduler:
+    """
+    Single worker thread that owns an Application and is the only caller of the DMA engine and adaptor.
+
+    Request handlers submit frames to a bounded priority queue and get futures back. The worker drains up to
+    `max_batch` queued frames at a time and pushes them through Application.convolve_stream as one pipelined burst.
+
+    Parameters:
+    - application (Application): Accelerator front end owned by this scheduler
+    - max_queue (int): Maximum number of queued frames before submit() raises QueueFullError
+    - max_batch (int): Maximum number of frames coalesced into one burst
+    - depth (int): Buffer sets in flight within a burst, see Application.convolve_stream
+    """
+
+    # Number of recent queue wait times kept for percentile reporting.
+    WAIT_WINDOW = 1024
+
+    # Seconds between attempts of an idle worker to reconfigure a faulted accelerator, so it is ready again before
+    # the next request rather than out of rotation until one arrives.
+    RECOVERY_INTERVAL = 1.0
+
+    def __init__(self, application, max_queue: int = 32, max_batch: int = 6, depth: int = 2):
+        self.application = application
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.depth = depth
+
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._worker: Optional[threading.Thread] = None
+        self._stopping = False
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cache_hits = 0
+        self.batches = 0
+        self.max_depth_seen = 0
+        self._wait_times = deque(maxlen=self.WAIT_WINDOW)
+        self._service_time = 0.0  # exponentially weighted seconds per frame
+
+    def start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._stopping = False
+                self._worker = threading.Thread(target=self._run, name="accelerator-worker", daemon=True)
+                self._worker.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """ Finish the queued frames, then stop the worker. """
+        with self._lock:
+            self._stopping = True
+            worker = self._worker
+        # Sorts after every real job, so the worker drains the queue before it sees this.
+        self._queue.put((math.inf, next(self._sequence), None))
+        if worker is not None:
+            worker.join(timeout)
+
+    def retry_after(self) -> int:
+        """ Seconds a rejected client should wait, estimated from the queue depth and service time. """
+        return max(1, math.ceil(self._pending * self._service_time))
+
+    def submit(self, frame: np.ndarray, priority: int = 0, trace: Trace = NULL_TRACE) -> Future:
+        """ Queue one frame. Lower priority values run first. """
+        return self.submit_many([frame], priority, trace)[0]
+
+    def submit_many(self, frames: Sequence[np.ndarray], priority: int = 0, trace: Trace = NULL_TRACE) -> List[Future]:
+        """
+        Queue several frames atomically, e.g. the channels of one image, so they are accepted or rejected together.
+        Time spent queued and in the accelerator is recorded on `trace`, and each frame's position in `frames` is
+        its plane number for the result sink.
+
+        Frames found in the application's result cache are answered at once, in the caller's thread, and never
+        queued.
+        """
+        futures = []
+        jobs = []
+        for plane, frame in enumerate(frames):
+            key, cached = self.application.lookup_cached(frame, trace, plane)
+            if cached is not None:
+                future = Future()
+                future.set_result(cached)
+                futures.append(future)
+            else:
+                job = _Job(frame, trace, plane, key)
+                jobs.append(job)
+                futures.append(job.future)
+        if not jobs:
+            with self._lock:
+                self.cache_hits += len(futures)
+            return futures
+
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError("Scheduler is stopped")
+            if self._pending + len(jobs) > self.max_queue:
+                self.rejected += len(jobs)
+                raise QueueFullError(self.retry_after())
+            self._pending += len(jobs)
+            self.submitted += len(jobs)
+            self.cache_hits += len(futures) - len(jobs)
+            self.max_depth_seen = max(self.max_depth_seen, self._pending)
+            for job in jobs:
+                self._queue.put((priority, next(self._sequence), job))
+        return futures
+
+    def _next_batch(self) -> Optional[List[_Job]]:
+        while True:
+            try:
+                _, _, job = self._queue.get(timeout=self.RECOVERY_INTERVAL)
+                break
+            except queue.Empty:
+                if getattr(self.application, "is_faulted", False):
+                    self.application.recover()
+        if job is None:
+            return None
+        batch = [job]
+        while len(batch) < self.max_batch:
+            try:
+                _, _, job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # Put the stop marker back so it is seen after this burst.
+                self._queue.put((math.inf, next(self._sequence), None))
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            now = time.monotonic()
+            with self._lock:
+                self._pending -= len(batch)
+                self._wait_times.extend(now - job.enqueued for job in batch)
+            for job in batch:
+                job.trace.add("queue_wait", now - job.enqueued)
+            # Skip frames whose caller already gave up.
+            batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start = time.monotonic()
+            done = 0
+            try:
+                results = self.application.convolve_stream((job.frame for job in batch), depth=self.depth,
+                                                           traces=(job.trace for job in batch),
+                                                           planes=(job.plane for job in batch))
+                for job, result in zip(batch, results):
+                    self.application.store_cached(job.cache_key, result)
+                    job.future.set_result(result)
+                    done += 1
+            except Exception as e:
+                for job in batch[done:]:
+                    job.future.set_exception(e)
+            elapsed = time.monotonic() - start
+
+            with self._lock:
+                self.batches += 1
+                self.completed += done
+                self.failed += len(batch) - done
+                per_frame = elapsed / len(batch)
+                if self._service_time == 0:
+                    self._service_time = per_frame
+                else:
+                    self._service_time = 0.8 * self._service_time + 0.2 * per_frame
+
+    def stats(self) -> dict:
+        """ Queue depth and wait-time metrics. """
+        with self._lock:
+            waits = np.fromiter(self._wait_times, dtype=np.float64)
+            stats = {
+                "queue_depth": self._pending,
+                "max_queue": self.max_queue,
+                "max_depth_seen": self.max_depth_seen,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "cache_hits": self.cache_hits,
+                "batches": self.batches,
+                "service_time_s": self._service_time,
+            }
+        if waits.size:
+            p50, p95, p99 = np.percentile(waits, [50, 95, 99])
+            stats.update(wait_p50_s=float(p50), wait_p95_s=float(p95), wait_p99_s=float(p99),
+                         wait_max_s=float(waits.max()))
+        return stats
@@ -0,0 +1,145 @@
+"""
+File: accelerator_service.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+The accelerator as the web front end sees it: an Application, the AcceleratorScheduler that is its only caller and
+the AcceleratorMonitor sampling it, configured from the environment.
+
+LocalAccelerator runs all of this in the current process (`python app.py`). serve.py runs one LocalAccelerator in a
+dedicated owner process and gives each web worker a RemoteAccelerator with the same interface: submit_many(),
+stats(), is_ready, wait_ready(), is_warm, wait_warm() and backend.
+
+Starting a LocalAccelerator warms it up in the background (Application.warm_up) before its scheduler takes frames;
+the time of each phase is reported under "startup" in stats().
+
+Environment:
+- CNN_BACKEND: "fpga" (default), "software" (bit-exact NumPy model) or "auto" (model until the PL is ready)
+- CNN_CAPTURE_PATH: capture mode, every result is appended to <path>.bin / <path>.idx.jsonl
+- CNN_CACHE_MB: in-memory result cache size (default 64, 0 turns it off); CNN_CACHE_DIR adds an on-disk tier
+- CNN_MAX_QUEUE: frames that may wait for the accelerator before requests are rejected (default 32)
+"""
+
+import os
+import threading
+from typing import Optional
+from accelerator_scheduler import AcceleratorScheduler
+from convolver_dma import Application
+from pynq_backend import SIMULATED
+from metrics import AcceleratorMonitor
+from result_cache import ResultCache
+from result_sink import CaptureSink
+from tracing import NULL_TRACE, Trace
+
+# ######################################################################################################################
+
+BIT_FILE = "full_cnn.bit"
+
+
+class LocalAccelerator:
+    """
+    Application, scheduler and monitor in this process.
+
+    Parameters:
+    - application (Application): Accelerator front end
+    - max_queue (int): See AcceleratorScheduler
+    """
+
+    def __init__(self, application: Application, max_queue: int = 32):
+        self.application = application
+        self.scheduler = AcceleratorScheduler(application, max_queue=max_queue)
+        self.monitor = AcceleratorMonitor(application)
+        self.startup = Trace("startup")
+        self.startup_error: Optional[str] = None
+        self._warm = threading.Event()
+        self._warm_up_done = threading.Event()
+
+    @classmethod
+    def from_env(cls, bit_file: str = BIT_FILE):
+        capture_path = os.environ.get("CNN_CAPTURE_PATH")
+        cache_mb = int(os.environ.get("CNN_CACHE_MB", 64))
+        application = Application(
+            bit_file, backend=os.environ.get("CNN_BACKEND", "fpga"),
+            result_sink=CaptureSink(capture_path) if capture_path else None,
+            result_cache=ResultCache(cache_mb << 20, os.environ.get("CNN_CACHE_DIR")) if cache_mb else None)
+        return cls(application, max_queue=int(os.environ.get("CNN_MAX_QUEUE", 32)))
+
+    def start(self, warm_up: bool = True):
+        """
+        Program the PL in the background and start the scheduler and monitor threads. With warm_up the scheduler
+        only starts once Application.warm_up has run, so frames submitted meanwhile wait in its queue. The auto
+        backend serves from the software model while the PL is programmed, so there the scheduler starts at once
+        and the warm-up skips the blank frame, which would race it for the DMA engine.
+        """
+        self.monitor.start()
+        if not warm_up:
+            self.application.start()
+        if not warm_up or self.application.backend == "auto":
+            self.scheduler.start()
+            self._warm.set()
+        if warm_up:
+            threading.Thread(target=self._warm_up, name="accelerator-warm-up", daemon=True).start()
+        else:
+            self._warm_up_done.set()
+        return self
+
+    def _warm_up(self):
+        auto = self.application.backend == "auto"
+        try:
+            self.application.warm_up(self.startup, buffer_sets=self.scheduler.depth, dummy_frame=not auto)
+            self._warm.set()
+        except Exception as e:
+            self.startup_error = f"{type(e).__name__}: {e}"
+            print(f"Accelerator warm-up failed: {self.startup_error}")
+        finally:
+            if not auto:
+                self.scheduler.start()
+            self._warm_up_done.set()
+
+    def close(self):
+        self.scheduler.stop(timeout=5)
+        self.monitor.stop()
+        self.application.close()
+
+    @property
+    def backend(self) -> str:
+        return self.application.backend
+
+    @property
+    def is_ready(self) -> bool:
+        return self.application.is_ready
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self.application.wait_ready(timeout)
+
+    @property
+    def is_warm(self) -> bool:
+        """ True once warm-up finished and frames are being processed. """
+        return self._warm.is_set()
+
+    def wait_warm(self, timeout: Optional[float] = None) -> bool:
+        """ Block until the accelerator is warm, warm-up failed or the timeout expires. Returns is_warm. """
+        if not self._warm.is_set():
+            self._warm_up_done.wait(timeout)
+        return self.is_warm
+
+    def submit_many(self, frames, priority: int = 0, trace: Trace = NULL_TRACE):
+        """ See AcceleratorScheduler.submit_many. """
+        return self.scheduler.submit_many(frames, priority, trace)
+
+    def stats(self) -> dict:
+        """ Counters of every component, as consumed by metrics.accelerator_families(). Plain data, picklable. """
+        application = self.application
+        acc = application.acc
+        return {
+            "backend": application.backend,
+            "ready": application.is_ready,
+            "faulted": application.is_faulted,
+            "simulated": SIMULATED,
+            "application": application.counters(),
+            "buffer_pool": application.buffer_pool.stats(),
+            "mmio": acc.mmio_stats() if acc is not None else None,
+            "result_cache": application.result_cache.stats() if application.result_cache is not None else None,
+            "scheduler": self.scheduler.stats(),
+            "monitor": self.monitor.stats(),
+            "startup": {"warm": self.is_warm, "phases": dict(self.startup.stages), "error": self.startup_error},
+        }
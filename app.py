@@ -3,14 +3,273 @@ File: app.py
 Authors: B. Ko, C. Okoye, S. Xiao
 """
 
-from flask import Flask, jsonify, request, render_template, redirect, url_for
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, Request, Response, jsonify, request, render_template, redirect, url_for, stream_with_context
 import base64
+import io
+import json
+import os
+import threading
+import uuid
+from typing import Optional
 import numpy as np
-import cv2
-from convolver_dma import Application
+from accelerator_scheduler import QueueFullError
+from result_cache import LRUCache, content_key
+from tracing import NULL_TRACE, Trace
+import metrics
+
+# The pynq stack (accelerator_service), OpenCV (ingest, face_detection, preview), the gallery and the video pipeline
+# are imported where they are first used: web workers under serve.py never load pynq, and /healthz answers before
+# OpenCV and the cascade are loaded, which warm_up() does in the background.
+
+
+class InMemoryRequest(Request):
+    """ Keeps uploaded files in memory; werkzeug would otherwise spool large uploads to a temporary file. """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
 
 app = Flask(__name__)
-accel_app = Application("full_cnn.bit")
+app.request_class = InMemoryRequest
+# Uploads are held in memory, so bound their size.
+app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
+
+# Importing this module does not touch the FPGA. The accelerator is either attached by serve.py (a RemoteAccelerator
+# talking to the single process that owns the overlay) or created in this process by warm_up() or on first use; see
+# accelerator_service.py for the CNN_BACKEND, CNN_CACHE_* and CNN_MAX_QUEUE settings.
+accelerator = None
+_accelerator_lock = threading.Lock()
+
+
+def use_accelerator(instance):
+    """ Attach the accelerator this web process submits frames to. """
+    global accelerator
+    accelerator = instance
+
+
+def init_accelerator():
+    """
+    Create and start a LocalAccelerator unless one is attached, and start this process's warm-up. Programming the PL
+    continues in the background.
+    """
+    global accelerator
+    with _accelerator_lock:
+        if accelerator is None:
+            from accelerator_service import LocalAccelerator
+            accelerator = LocalAccelerator.from_env().start()
+        current = accelerator
+    start_warm_up()
+    return current
+
+
+def get_accelerator():
+    return accelerator if accelerator is not None else init_accelerator()
+
+
+# CNN_UPLOAD_CACHE_MB bounds the cache of decoded, cropped uploads keyed on the raw upload bytes.
+upload_cache_mb = int(os.environ.get("CNN_UPLOAD_CACHE_MB", 32))
+upload_cache = LRUCache(upload_cache_mb << 20) if upload_cache_mb else None
+
+# Face detection, preview encoding and the preview store need OpenCV and are created on first use (or by warm_up).
+face_detector = None
+preview_encoder = None
+preview_store = None
+_opencv_lock = threading.Lock()
+
+
+def get_face_detector():
+    """ Face detector on its own bounded pool, see face_detection.py for the CNN_DETECT_* knobs. """
+    global face_detector
+    if face_detector is None:
+        with _opencv_lock:
+            if face_detector is None:
+                from face_detection import FaceDetector
+                face_detector = FaceDetector.from_env()
+    return face_detector
+
+
+def get_preview_encoder():
+    """
+    Channel previews: CNN_PREVIEW_MODE (combined, planes or channels), CNN_PREVIEW_CODEC (png, jpeg or webp) and
+    CNN_PREVIEW_QUALITY set the defaults, which a request may override (see preview_options).
+    """
+    global preview_encoder
+    if preview_encoder is None:
+        with _opencv_lock:
+            if preview_encoder is None:
+                from preview import PreviewEncoder
+                quality = os.environ.get("CNN_PREVIEW_QUALITY")
+                preview_encoder = PreviewEncoder(mode=os.environ.get("CNN_PREVIEW_MODE", "combined"),
+                                                 codec=os.environ.get("CNN_PREVIEW_CODEC", "png"),
+                                                 quality=int(quality) if quality else None)
+    return preview_encoder
+
+
+def get_preview_store():
+    """
+    Encoded previews served by /preview when a request asks for delivery=url instead of inline data. With
+    CNN_PREVIEW_DIR (set by serve.py) they are files every web worker can read, as the follow-up request for a
+    preview may reach another worker; otherwise they stay in this process's memory.
+    """
+    global preview_store
+    if preview_store is None:
+        with _opencv_lock:
+            if preview_store is None:
+                from preview import PreviewDirectory
+                max_bytes = int(os.environ.get("CNN_PREVIEW_STORE_MB", 16)) << 20
+                preview_store = (PreviewDirectory(os.environ["CNN_PREVIEW_DIR"], max_bytes)
+                                 if os.environ.get("CNN_PREVIEW_DIR") else LRUCache(max_bytes))
+    return preview_store
+
+# Enrolled faces for /enroll and /identify, in CNN_GALLERY_DIR. CNN_GALLERY_DTYPE (float32, float16 or int8) sets the
+# storage type of a new gallery. Opened on first use.
+gallery = None
+_gallery_lock = threading.Lock()
+
+
+def get_gallery():
+    global gallery
+    with _gallery_lock:
+        if gallery is None:
+            from face_gallery import FaceGallery
+            gallery = FaceGallery(os.environ.get("CNN_GALLERY_DIR", "gallery"),
+                                  dtype=os.environ.get("CNN_GALLERY_DTYPE"))
+        return gallery
+
+
+# Video sources /stream may open, as CNN_STREAM_SOURCES="name=spec,..." where spec is a camera index, a video file
+# or an MJPEG/RTSP URL. Clients pick a source by name and never pass a path or URL themselves.
+STREAM_SOURCES = dict(entry.split("=", 1) for entry in os.environ.get("CNN_STREAM_SOURCES", "camera=0").split(",")
+                      if "=" in entry)
+
+# Seconds a request waits for its frames to come back from the accelerator.
+REQUEST_TIMEOUT_SECONDS = 30
+
+# Seconds a client should wait before retrying while the accelerator is still being programmed.
+RETRY_AFTER_SECONDS = 5
+
+# Requests slower than this are logged with their trace id, stage breakdown and accelerator state.
+SLOW_REQUEST_SECONDS = float(os.environ.get("CNN_SLOW_REQUEST_SECONDS", 1.0))
+
+registry = metrics.Registry()
+REQUESTS = registry.counter("cnn_requests_total", "Upload requests by endpoint and HTTP status.")
+STAGE_SECONDS = registry.histogram("cnn_stage_seconds", "Time spent in each pipeline stage.")
+REQUEST_SECONDS = registry.histogram("cnn_request_seconds", "End-to-end latency of upload requests.")
+FACE_DETECTIONS = registry.counter("cnn_face_detections_total", "Face detection outcomes (hit or miss).")
+
+
+
+def collect_pipeline_metrics():
+    caches = {}
+    if accelerator is not None:
+        stats = accelerator.stats()
+        yield from metrics.accelerator_families(stats)
+        if stats["result_cache"] is not None:
+            caches["result"] = stats["result_cache"]
+    if upload_cache is not None:
+        caches["upload"] = upload_cache.stats()
+    if caches:
+        yield from metrics.cache_families(caches)
+    if gallery is not None:
+        yield ("cnn_gallery_entries", "gauge", "Embeddings enrolled in the face gallery.",
+               [({}, gallery.stats()["entries"])])
+
+
+registry.add_collector(collect_pipeline_metrics)
+
+
+def record_trace(trace: Trace, status: int):
+    """ Feed a finished upload request into the metrics and log it if it was slow. """
+    elapsed = trace.elapsed()
+    REQUESTS.inc(status=status, endpoint=request.endpoint)
+    REQUEST_SECONDS.observe(elapsed)
+    for stage, seconds in trace.stages.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    if elapsed > SLOW_REQUEST_SECONDS:
+        stages = ", ".join(f"{stage}={seconds * 1e3:.1f}ms" for stage, seconds in trace.stages.items())
+        stats = accelerator.stats() if accelerator is not None else None
+        state = (f"queue_depth={stats['scheduler']['queue_depth']} acc_status={stats['monitor']['last_status']}"
+                 if stats is not None else "no accelerator")
+        print(f"Slow request {trace.trace_id}: {elapsed * 1e3:.1f}ms ({stages}); {state}")
+
+
+# Startup phases of this process, reported by /readyz. warm_up() does the work the first request would otherwise
+# wait for; load balancers should only route traffic here once /readyz answers 200.
+STARTUP = Trace("startup")
+STARTUP.add("import", time.perf_counter() - _IMPORT_STARTED)
+_STARTED = time.monotonic()
+_warm = threading.Event()
+_warm_up_started = False
+_warm_up_lock = threading.Lock()
+
+
+def warm_up():
+    """ Load the cascade in every detector thread, load the preview codecs and wait for the accelerator warm-up. """
+    current = get_accelerator()
+    with STARTUP.stage("load_cascade"):
+        get_face_detector().warm_up()
+    with STARTUP.stage("load_codecs"):
+        get_preview_encoder().encode(np.zeros((8, 8, 3), dtype=np.uint8))
+        get_preview_store()
+    with STARTUP.stage("accelerator"):
+        warm = current.wait_warm()
+    if not warm:
+        print("Accelerator warm-up failed; not ready.")
+        return
+    _warm.set()
+    phases = ", ".join(f"{phase}={seconds * 1e3:.0f}ms" for phase, seconds in STARTUP.stages.items())
+    print(f"Ready {time.monotonic() - _STARTED:.2f}s after import ({phases})")
+
+
+def start_warm_up():
+    """
+    Run warm_up() in the background, once per process; /healthz answers meanwhile and /readyz reports the progress.
+    Called by serve.py and `python app.py` at launch; under any other WSGI host the first use of the accelerator or
+    the first /readyz probe starts it.
+    """
+    global _warm_up_started
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+@app.route("/healthz")
+def healthz():
+    """ Liveness: the process is serving HTTP. Never waits on the accelerator. """
+    return jsonify({"status": "alive", "uptime_s": time.monotonic() - _STARTED})
+
+
+@app.route("/readyz")
+def readyz():
+    """
+    Readiness: 200 once warm_up() finished and the accelerator is not faulted, else 503. Reports the startup phases
+    in milliseconds.
+    """
+    ready = _warm.is_set()
+    if not ready:
+        start_warm_up()
+    body = {"phases_ms": {phase: seconds * 1e3 for phase, seconds in STARTUP.stages.items()}}
+    if accelerator is not None:
+        try:
+            stats = accelerator.stats()
+            startup = stats["startup"]
+            body["accelerator"] = dict(startup, faulted=stats["faulted"], simulated=stats["simulated"],
+                                       phases={phase: seconds * 1e3 for phase, seconds in startup["phases"].items()})
+            # A failed transfer leaves the adaptor unconfigured until the scheduler reconfigures it.
+            ready = ready and not stats["faulted"]
+        except Exception as e:
+            body["accelerator"] = {"error": f"{type(e).__name__}: {e}"}
+    body["ready"] = ready
+    if ready:
+        return jsonify(body)
+    response = jsonify(body)
+    response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response, 503
 
 
 @app.route("/")
@@ -18,16 +277,151 @@ def home():
     return render_template("demo_website.html")
 
 
-def encode_image_tobase64(image):
-    # Convert RGB to BGR for OpenCV encoding
-    image_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-    _, buffer = cv2.imencode(".png", image_bgr)
-    img_base64 = base64.b64encode(buffer).decode("utf-8")
-    return img_base64
+def preview_options(values) -> dict:
+    """ Preview layout, codec and quality requested with `preview`, `codec` and `quality` form or query fields. """
+    encoder = get_preview_encoder()
+    mode = values.get("preview", encoder.mode)
+    codec = values.get("codec", encoder.codec)
+    quality = values.get("quality", type=int)
+    try:
+        encoder.validate(mode, codec, quality)
+    except ValueError as e:
+        raise PipelineError(str(e))
+    return {"mode": mode, "codec": codec, "quality": quality}
 
 
-@app.route("/submit", methods=["POST"])
-def submit():
+def preview_sources(previews, delivery: str) -> list:
+    """
+    Image sources for the template, one per distinct encoded image: inline base64 data URLs, or /preview URLs
+    served from the preview store.
+    """
+    sources = {}
+    preview_id = uuid.uuid4().hex
+    for preview in previews:
+        if preview.name in sources:
+            continue
+        if delivery == "url":
+            get_preview_store().put(f"{preview_id}/{preview.name}", (preview.data, preview.mime))
+            src = url_for("show_preview", preview_id=preview_id, name=preview.name)
+        else:
+            src = f"data:{preview.mime};base64,{base64.b64encode(preview.data).decode('ascii')}"
+        sources[preview.name] = src
+    return [{"name": name, "src": src} for name, src in sources.items()]
+
+
+class PipelineError(Exception):
+    """ A request that cannot be processed, with the HTTP status to report it as. """
+
+    def __init__(self, message: str, status: int = 400, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def process_upload(data, trace: Trace = NULL_TRACE, fallback_center: bool = False,
+                   preview: Optional[dict] = None) -> dict:
+    """
+    Run the /submit pipeline on an encoded image: decode, face detection, crop/resize, accelerator convolution of
+    the three planes, decoding of the results and encoding of the channel previews. Each stage is timed on `trace`.
+
+    Parameters:
+    - data (bytes-like): Encoded image
+    - trace (Trace): Per-stage timing record
+    - fallback_center (bool): Use a centred square crop when no face is found instead of failing (benchmarking)
+    - preview (dict): Options for PreviewEncoder.encode (mode, codec, quality); defaults when None
+
+    Returns:
+    - dict: Encoded previews (list of preview.Preview) and the decoded output maps (outputs)
+    """
+    resized, output_values = convolve_upload(data, trace, fallback_center)
+
+    with trace.stage("encode"):
+        # The page tints the previews, so no zero-filled colour images are built here
+        previews = get_preview_encoder().encode(resized, **(preview or {}))
+
+    return {"previews": previews, "outputs": output_values}
+
+
+def convolve_upload(data, trace: Trace = NULL_TRACE, fallback_center: bool = False):
+    """
+    Decode, detect, crop and convolve an encoded image (see process_upload).
+
+    Returns:
+    - tuple: The 480x480 BGR face crop and the real-valued R, G and B output maps
+    """
+    # A repeated upload skips decode, detection and cropping.
+    upload_key = None
+    resized = None
+    if upload_cache is not None:
+        with trace.stage("cache_lookup"):
+            upload_key = content_key(data) + ("-center" if fallback_center else "")
+            resized = upload_cache.get(upload_key)
+    if resized is None:
+        resized = prepare_upload(data, trace, fallback_center)
+        if upload_key is not None:
+            upload_cache.put(upload_key, resized)
+    # Channel views of the BGR image; the accelerator worker widens them straight into its DMA buffers
+    from ingest import split_planes
+    r_channel, g_channel, b_channel = split_planes(resized)
+
+    # FPGA convolution of all three planes. The scheduler pipelines them as one burst and answers cached planes.
+    try:
+        futures = get_accelerator().submit_many((r_channel, g_channel, b_channel), trace=trace)
+        outputs = [future.result(REQUEST_TIMEOUT_SECONDS) for future in futures]
+    except QueueFullError as e:
+        raise PipelineError("Accelerator is busy", 503, e.retry_after)
+    # get_accelerator().application.convolve_image_timed(b_channel) # If timing is desired (single process).
+
+    with trace.stage("decode_results"):
+        output_values = [output.values for output in outputs]
+    return resized, output_values
+
+
+def prepare_upload(data, trace: Trace, fallback_center: bool) -> np.ndarray:
+    """ Decode an upload, find the face and return it resized to 480x480 BGR (read-only, as it may be cached). """
+    from ingest import crop_and_resize, decode_image
+    # Decode straight from the request body, no temporary file
+    with trace.stage("decode"):
+        bgr_img = decode_image(data)
+
+    if bgr_img is None:
+        raise PipelineError("Invalid image file")
+
+    print("Parsed Image.")
+
+    # Face detection like the testbench, on a downscaled copy in the detector pool
+    with trace.stage("detect"):
+        faces = get_face_detector().submit(bgr_img).result(REQUEST_TIMEOUT_SECONDS)
+
+    FACE_DETECTIONS.inc(result="hit" if len(faces) else "miss")
+    if len(faces) == 0:
+        if not fallback_center:
+            raise PipelineError("No face detected")
+        h, w = bgr_img.shape[:2]
+        side = min(h, w)
+        faces = [((w - side) // 2, (h - side) // 2, side, side)]
+
+    # Crop face (first one) and resize to 480×480
+    FIXED_IMAGE_SIZE = (480, 480)
+    with trace.stage("crop_resize"):
+        resized = crop_and_resize(bgr_img, faces[0], FIXED_IMAGE_SIZE)
+    resized.flags.writeable = False
+    return resized
+
+
+def error_response(message: str, status: int, retry_after: Optional[int] = None):
+    response = jsonify({"error": message})
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    return response, status
+
+
+def handle_upload(handler):
+    """
+    Shared handling of the endpoints taking an `image` upload: request checks, accelerator readiness, the trace
+    (clients may pass their own X-Trace-Id to correlate with their logs; it is echoed back), error responses and
+    metrics. `handler(data, trace)` returns the response body for status 200 or raises PipelineError.
+    """
     if "image" not in request.files:
         return jsonify({"error": "No image part in the request"}), 400
 
@@ -35,68 +429,161 @@ def submit():
     if file.filename == "":
         return jsonify({"error": "No selected file"}), 400
 
-    try:
-        import tempfile
-
-        # Save to disk and load with cv2.imread like testbench
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-            file.save(tmp.name)
-            bgr_img = cv2.imread(tmp.name)
-
-        if bgr_img is None:
-            return jsonify({"error": "Invalid image file"}), 400
-
-        print("Parsed Image.")
-
-        # Face detection exactly like testbench
-        gray = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2GRAY)
-        face_cascade = cv2.CascadeClassifier(
-            "/usr/share/opencv4/haarcascades/haarcascade_frontalface_default.xml"   
-        )
-        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-
-        if len(faces) == 0:
-            return jsonify({"error": "No face detected"}), 400
-
-        # Crop face (first one)
-        x, y, w, h = faces[0]
-        cropped = bgr_img[y:y+h, x:x+w]
-
-        # Resize to 480×480
-        FIXED_IMAGE_SIZE = (480, 480)
-        resized = cv2.resize(cropped, FIXED_IMAGE_SIZE)
-
-        # Red channel from BGR
-        r_channel = resized[:, :, 2]
-        g_channel = resized[:, :, 1]
-        b_channel = resized[:, :, 0]
-
-        # FPGA convolution
-        accel_app.create_overlay()
-        print("Overlay created.")
-        accel_app.setup_accelerator_adaptor_core()
-        print("Done with acc adaptor core setup.")
-        accel_app.convolve_image(b_channel)
-        # accel_app.convolve_image_timed(b_channel) # If timing is desired.
-
-        # Stack for visualization
-        r_img = np.stack((r_channel, np.zeros_like(r_channel), np.zeros_like(r_channel)), axis=-1)
-        g_img = np.stack((np.zeros_like(g_channel), g_channel, np.zeros_like(g_channel)), axis=-1)
-        b_img = np.stack((np.zeros_like(b_channel), np.zeros_like(b_channel), b_channel), axis=-1)
-
-        r_base64 = encode_image_tobase64(r_img.astype(np.uint8))
-        g_base64 = encode_image_tobase64(g_img.astype(np.uint8))
-        b_base64 = encode_image_tobase64(b_img.astype(np.uint8))
-
-        return render_template(
-            "number.html",
-            r_img=r_base64,
-            g_img=g_base64,
-            b_img=b_base64
-        )
+    current = get_accelerator()
+    # Only until the first warm-up: after a fault the accelerator reconfigures itself on the next frame.
+    if current.backend == "fpga" and not current.is_warm:
+        REQUESTS.inc(status=503, endpoint=request.endpoint)
+        return error_response("Accelerator is not ready yet", 503, RETRY_AFTER_SECONDS)
 
+    from ingest import upload_bytes
+    trace = Trace(request.headers.get("X-Trace-Id") or uuid.uuid4().hex)
+    try:
+        response, status = handler(upload_bytes(file), trace), 200
+    except PipelineError as e:
+        response, status = error_response(str(e), e.status, e.retry_after)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        response, status = jsonify({"error": str(e)}), 500
+
+    record_trace(trace, status)
+    response = app.make_response((response, status))
+    response.headers["X-Trace-Id"] = trace.trace_id
+    return response
+
+
+@app.route("/submit", methods=["POST"])
+def submit():
+    def render(data, trace):
+        # delivery=url serves the previews from /preview instead of inlining them as base64 data
+        delivery = request.values.get("delivery", "inline")
+        if delivery not in ("inline", "url"):
+            raise PipelineError("delivery must be inline or url")
+        result = process_upload(data, trace, preview=preview_options(request.values))
+        with trace.stage("render"):
+            return render_template("number.html", previews=result["previews"],
+                                   sources=preview_sources(result["previews"], delivery))
+
+    return handle_upload(render)
+
+
+@app.route("/enroll", methods=["POST"])
+def enroll():
+    """ Add the face in `image` to the gallery under `name`. """
+    name = request.values.get("name", "").strip()
+    if not name:
+        return jsonify({"error": "A name is required"}), 400
+
+    def add(data, trace):
+        from face_gallery import embed
+        _, outputs = convolve_upload(data, trace)
+        with trace.stage("gallery"):
+            entries = get_gallery().add(name, embed(outputs))
+        return jsonify({"name": name, "entries": entries})
+
+    return handle_upload(add)
+
+
+@app.route("/identify", methods=["POST"])
+def identify():
+    """ The `k` (default 5) enrolled faces closest to the face in `image`, best first. """
+    k = request.values.get("k", default=5, type=int)
+    if not 1 <= k <= 100:
+        return jsonify({"error": "k must be between 1 and 100"}), 400
+
+    def search(data, trace):
+        from face_gallery import embed
+        _, outputs = convolve_upload(data, trace)
+        with trace.stage("gallery"):
+            matches = get_gallery().search(embed(outputs), k)[0]
+        return jsonify({"matches": [{"name": label, "score": score} for label, score in matches]})
+
+    return handle_upload(search)
+
+
+@app.route("/gallery", methods=["GET"])
+def list_gallery():
+    return jsonify({"names": get_gallery().labels(), **get_gallery().stats()})
+
+
+@app.route("/gallery/<name>", methods=["DELETE"])
+def remove_from_gallery(name):
+    removed = get_gallery().remove(name)
+    if not removed:
+        return jsonify({"error": f"{name!r} is not enrolled"}), 404
+    return jsonify({"name": name, "removed": removed})
+
+
+@app.route("/preview/<preview_id>/<name>")
+def show_preview(preview_id, name):
+    entry = get_preview_store().get(f"{preview_id}/{name}")
+    if entry is None:
+        return jsonify({"error": "Preview expired"}), 404
+    data, mime = entry
+    return Response(data.tobytes(), mimetype=mime, headers={"Cache-Control": "private, max-age=300"})
+
+
+def stream_event(event: dict, include_maps: bool) -> dict:
+    """ JSON form of a VideoPipeline event: per-channel mean and max, and with maps=1 the outputs as base64 int32. """
+    outputs = event.pop("outputs", None)
+    if outputs is None:
+        return event
+    event["channels"] = []
+    for name, output in zip(("red", "green", "blue"), outputs):
+        values = output.values
+        channel = {"name": name, "mean": float(values.mean()), "max": float(values.max())}
+        if include_maps:
+            channel.update(shape=list(output.shape), raw=base64.b64encode(output.raw.tobytes()).decode("ascii"))
+        event["channels"].append(channel)
+    return event
+
+
+@app.route("/stream")
+def stream():
+    """
+    Server-sent events for a video source: a "frame" event per processed frame (face box, whether it was detected or
+    tracked, latency and the CNN outputs) and a "stats" event with sustained FPS and latency percentiles about once a
+    second. Query: source (a CNN_STREAM_SOURCES name), detect_every (frames per face detection) and maps=1.
+    """
+    name = request.args.get("source", "camera")
+    if name not in STREAM_SOURCES:
+        return jsonify({"error": f"Unknown source {name!r}"}), 404
+    spec = STREAM_SOURCES[name]
+    detect_every = request.args.get("detect_every", default=5, type=int)
+    if detect_every < 1:
+        return jsonify({"error": "detect_every must be at least 1"}), 400
+    include_maps = request.args.get("maps") == "1"
+
+    current = get_accelerator()
+    # Only until the first warm-up: after a fault the accelerator reconfigures itself on the next frame.
+    if current.backend == "fpga" and not current.is_warm:
+        return error_response("Accelerator is not ready yet", 503, RETRY_AFTER_SECONDS)
+
+    from video_stream import FrameSource, VideoPipeline
+    pipeline = VideoPipeline(FrameSource(int(spec) if spec.isdigit() else spec), current, get_face_detector(),
+                             detect_every=detect_every, timeout=REQUEST_TIMEOUT_SECONDS)
+
+    def events():
+        last_stats = 0.0
+        try:
+            for event in pipeline.run():
+                for stage, seconds in event.pop("stages", {}).items():
+                    STAGE_SECONDS.observe(seconds, stage=stage)
+                yield f"event: frame\ndata: {json.dumps(stream_event(event, include_maps))}\n\n"
+                now = time.monotonic()
+                if now - last_stats >= 1.0:
+                    last_stats = now
+                    yield f"event: stats\ndata: {json.dumps(pipeline.counters())}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        yield f"event: end\ndata: {json.dumps(pipeline.counters())}\n\n"
+
+    # Closing the connection closes the generator, which stops the capture thread.
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return registry.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
 
 @app.route("/number/<filename>")
 def show_processed_image(filename):
@@ -104,4 +591,8 @@ def show_processed_image(filename):
 
 
 if __name__ == "__main__":
+    # Development server. The reloader runs this block in a watcher process too, which never serves requests, so
+    # only the serving child programs the PL. Use serve.py for several worker processes.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_warm_up()
     app.run(debug=True, host="0.0.0.0")
\ No newline at end of file
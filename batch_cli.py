@@ -0,0 +1,284 @@
+"""
+File: batch_cli.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Offline batch processing of an image directory or manifest, without the web front end.
+
+Decoding, face detection and cropping run in a process pool (each worker keeps its own cascade). Prepared faces go
+through a bounded queue to a single consumer that owns the Application and streams the R, G and B planes of every
+image back to back through the accelerator (convolve_stream), so the DMA pipeline never drains between images.
+
+Outputs, in the output directory:
+- outputs.npy: (images, 3, 60, 60) uint32 output words (as ConvolutionResult.words) in manifest order, preallocated
+  and written through a memory map; rows of images that failed stay zero
+- index.jsonl: one line per finished image: row, path, status (ok, no_face, unreadable or error) and face box
+- sources.json: the image list the rows refer to
+
+The index is appended only after the rows it describes have been flushed, so an interrupted run can be resumed by
+running the same command again: images already in the index are skipped, except those recorded as error (a failed
+worker, e.g. out of memory on a huge photo), which are retried. If a worker process dies the pool cannot take new
+images, so the run records the rest as errors, finishes the images already prepared and exits with status 1.
+
+Usage:
+    python batch_cli.py SOURCE OUTPUT_DIR [--workers N] [--queue 64] [--backend fpga|software|auto]
+                        [--fallback-center] [--overwrite]
+
+SOURCE is a directory (searched recursively for images) or a manifest file with one image path per line, relative
+to the manifest's directory unless absolute.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Optional
+import numpy as np
+from ingest import crop_and_resize, split_planes
+from software_cnn import INPUT_SIZE, get_output_size
+
+# ######################################################################################################################
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+PLANES = 3
+
+# Rows written between flushes of outputs.npy and index.jsonl, and the seconds between progress lines.
+FLUSH_ROWS = 256
+PROGRESS_SECONDS = 2.0
+
+
+def find_images(source: str) -> List[str]:
+    """ Image paths of a directory (recursive, sorted) or a manifest file. """
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, names in os.walk(source):
+            dirs.sort()
+            paths.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(IMAGE_EXTENSIONS))
+        return paths
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        lines = (line.strip() for line in f)
+        return [line if os.path.isabs(line) else os.path.join(base, line)
+                for line in lines if line and not line.startswith("#")]
+
+
+# ######################################################################################################################
+
+_detector = None
+
+
+def _init_worker():
+    global _detector
+    from face_detection import FaceDetector
+    # One detection at a time per process; the pool provides the parallelism.
+    _detector = FaceDetector.from_env()
+
+
+def prepare(row: int, path: str, fallback_center: bool):
+    """
+    Worker task: decode, detect and crop one image.
+
+    Returns:
+    - tuple: (row, status, face box or None, 480x480 BGR face or None)
+    """
+    import cv2
+
+    bgr_img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if bgr_img is None:
+        return row, "unreadable", None, None
+    faces = _detector.detect(bgr_img)
+    if len(faces) == 0:
+        if not fallback_center:
+            return row, "no_face", None, None
+        h, w = bgr_img.shape[:2]
+        side = min(h, w)
+        faces = [((w - side) // 2, (h - side) // 2, side, side)]
+    box = [int(v) for v in faces[0]]
+    return row, "ok", box, crop_and_resize(bgr_img, box, (INPUT_SIZE, INPUT_SIZE))
+
+
+# ######################################################################################################################
+
+class BatchOutput:
+    """
+    outputs.npy, index.jsonl and sources.json of an output directory, created or reopened for resuming.
+
+    Parameters:
+    - directory (str): Output directory
+    - paths (list of str): Images, one output row each
+    - overwrite (bool): Start over even if the directory holds a run over other images
+    """
+
+    def __init__(self, directory: str, paths: List[str], overwrite: bool = False):
+        os.makedirs(directory, exist_ok=True)
+        self.paths = paths
+        self.outputs_path = os.path.join(directory, "outputs.npy")
+        self.index_path = os.path.join(directory, "index.jsonl")
+        sources_path = os.path.join(directory, "sources.json")
+        side = get_output_size(INPUT_SIZE)
+        shape = (len(paths), PLANES, side, side)
+
+        self.done = set()
+        if not overwrite and os.path.exists(sources_path):
+            with open(sources_path) as f:
+                if json.load(f) != paths:
+                    raise SystemExit(f"{directory} holds a run over other images; use --overwrite or another directory")
+            self.outputs = np.lib.format.open_memmap(self.outputs_path, mode="r+")
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as f:
+                    status = {}
+                    for line in f:
+                        if line.endswith("\n"):
+                            entry = json.loads(line)
+                            status[entry["row"]] = entry["status"]
+                # Errors are retried; a later line of the same row records the retry.
+                self.done = {row for row, last in status.items() if last != "error"}
+        else:
+            self.outputs = np.lib.format.open_memmap(self.outputs_path, mode="w+", dtype=np.uint32, shape=shape)
+            with open(self.index_path, "w"):
+                pass
+            with open(sources_path, "w") as f:
+                json.dump(paths, f)
+        self._pending: List[str] = []
+
+    def record(self, row: int, status: str, box: Optional[list]):
+        self._pending.append(json.dumps({"row": row, "path": self.paths[row], "status": status, "box": box}) + "\n")
+        if len(self._pending) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        """ Make the recorded rows durable, then list them in the index. """
+        self.outputs.flush()
+        with open(self.index_path, "a") as f:
+            f.writelines(self._pending)
+        self._pending.clear()
+
+
+def run(application, output: BatchOutput, workers: int, queue_size: int, fallback_center: bool) -> dict:
+    """ Process every image of `output` not done yet. Returns counts by status, images and seconds. """
+    todo = [row for row in range(len(output.paths)) if row not in output.done]
+    counts = {"ok": 0, "no_face": 0, "unreadable": 0, "error": 0}
+    if not todo:
+        return {"images": 0, "seconds": 0.0, **counts}
+
+    # The semaphore bounds the images in the pool or the queue, so decoded faces cannot pile up in memory.
+    slots = threading.Semaphore(queue_size)
+    prepared = queue.Queue()
+    # spawn: the workers must not inherit the Application's threads or the PL mapping.
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker)
+    stop = threading.Event()
+
+    def produce():
+        for position, row in enumerate(todo):
+            slots.acquire()
+            if stop.is_set():
+                return
+            try:
+                future = pool.submit(prepare, row, output.paths[row], fallback_center)
+            except Exception as e:
+                # A worker died and broke the pool: fail this and every later image so frames() does not wait on
+                # them forever.
+                print(f"Worker pool failed: {type(e).__name__}: {e}", file=sys.stderr)
+                for remaining in todo[position:]:
+                    failed = Future()
+                    failed.set_exception(e)
+                    prepared.put((remaining, failed))
+                return
+            future.add_done_callback(lambda f, row=row: prepared.put((row, f)))
+
+    in_flight = deque()
+    finished = 0
+
+    def frames():
+        """ Planes of the prepared faces in the order they finish, as the single accelerator consumer takes them. """
+        nonlocal finished
+        for _ in todo:
+            row, future = prepared.get()
+            slots.release()
+            try:
+                row, status, box, face = future.result()
+            except Exception as e:
+                print(f"{output.paths[row]}: {type(e).__name__}: {e}", file=sys.stderr)
+                status, box, face = "error", None, None
+            if face is None:
+                counts[status] += 1
+                finished += 1
+                output.record(row, status, box)
+                continue
+            in_flight.append((row, box))
+            yield from split_planes(face)
+
+    producer = threading.Thread(target=produce, name="batch-producer", daemon=True)
+    start = time.perf_counter()
+    last_report = start
+    producer.start()
+    try:
+        for index, result in enumerate(application.convolve_stream(frames(), planes=itertools.cycle(range(PLANES)))):
+            row, box = in_flight[0]
+            output.outputs[row, index % PLANES] = result.words
+            if index % PLANES == PLANES - 1:
+                in_flight.popleft()
+                counts["ok"] += 1
+                finished += 1
+                output.record(row, "ok", box)
+
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_SECONDS:
+                last_report = now
+                print(f"{finished}/{len(todo)} images, {finished / (now - start):.1f} images/s", file=sys.stderr)
+    finally:
+        stop.set()
+        slots.release()
+        output.flush()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    seconds = time.perf_counter() - start
+    return {"images": finished, "seconds": seconds, "images_per_second": finished / seconds if seconds else 0.0,
+            **counts}
+
+
+# ######################################################################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the face crop and CNN over a directory or manifest of images.")
+    parser.add_argument("source", help="Image directory or manifest file")
+    parser.add_argument("output", help="Output directory (outputs.npy, index.jsonl, sources.json)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Decode/detect processes")
+    parser.add_argument("--queue", type=int, default=64, help="Images prepared ahead of the accelerator")
+    parser.add_argument("--backend", choices=("fpga", "software", "auto"), help="Overrides CNN_BACKEND")
+    parser.add_argument("--fallback-center", action="store_true", help="Use a centred crop when no face is found")
+    parser.add_argument("--overwrite", action="store_true", help="Start over instead of resuming")
+    args = parser.parse_args()
+
+    paths = find_images(args.source)
+    if not paths:
+        raise SystemExit(f"No images found in {args.source}")
+    output = BatchOutput(args.output, paths, args.overwrite)
+    print(f"{len(paths)} images, {len(output.done)} already done.", file=sys.stderr)
+
+    from accelerator_service import BIT_FILE
+    from convolver_dma import Application
+
+    application = Application(BIT_FILE, backend=args.backend or os.environ.get("CNN_BACKEND", "fpga"))
+    application.start()
+    try:
+        application.ensure_ready()
+        summary = run(application, output, args.workers, args.queue, args.fallback_center)
+    except KeyboardInterrupt:
+        raise SystemExit("Interrupted; run the same command again to resume.")
+    finally:
+        application.close()
+    print(json.dumps(summary, indent=2))
+    if summary["error"]:
+        raise SystemExit(f"{summary['error']} images failed; run the same command again to retry them.")
+
+
+if __name__ == "__main__":
+    main()
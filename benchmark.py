@@ -0,0 +1,238 @@
+"""
+File: benchmark.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+End-to-end latency benchmark of Application and the /submit pipeline with a per-stage breakdown.
+
+Every run reports p50/p95/p99 latencies in milliseconds, throughput and the memory high-water mark as JSON.
+Without --corpus a synthetic corpus is generated; since synthetic images contain no faces, the pipeline uses a
+centred crop when detection misses so the later stages are still exercised. The corpus repeats, so the upload and
+result caches are turned off unless --cache is given.
+
+Usage:
+    python benchmark.py [--corpus DIR] [--sizes 640x480,1280x720,1920x1080] [--concurrency 1,2,4]
+                        [--requests 30] [--warmup 3] [--backend fpga|software|auto] [--cache]
+                        [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import numpy as np
+
+# ######################################################################################################################
+
+PERCENTILES = (50, 95, 99)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def summarize(samples) -> dict:
+    """ p50/p95/p99/mean/max of a list of durations in seconds, reported in milliseconds. """
+    values = np.asarray(samples, dtype=np.float64) * 1e3
+    if values.size == 0:
+        return {}
+    summary = {f"p{p}_ms": float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+    summary.update(mean_ms=float(values.mean()), max_ms=float(values.max()), count=int(values.size))
+    return summary
+
+
+def summarize_traces(traces) -> Dict[str, dict]:
+    stages: Dict[str, List[float]] = {}
+    for trace in traces:
+        for stage, seconds in trace.stages.items():
+            stages.setdefault(stage, []).append(seconds)
+    return {stage: summarize(samples) for stage, samples in stages.items()}
+
+
+def max_rss_kb() -> int:
+    """ Peak resident set size of this process (kilobytes on Linux). """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def parse_sizes(text: str):
+    sizes = []
+    for item in text.split(","):
+        w, h = item.lower().split("x")
+        sizes.append((int(w), int(h)))
+    return sizes
+
+
+def load_corpus(corpus_dir, sizes, per_size: int = 8) -> Dict[str, List[bytes]]:
+    """ Encoded JPEGs for each size, resized from the corpus images or generated synthetically. """
+    import cv2
+
+    if corpus_dir:
+        sources = []
+        for name in sorted(os.listdir(corpus_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                image = cv2.imread(os.path.join(corpus_dir, name))
+                if image is not None:
+                    sources.append(image)
+        if not sources:
+            raise SystemExit(f"No images found in {corpus_dir}")
+    else:
+        rng = np.random.default_rng(462)
+        yy, xx = np.mgrid[0:720, 0:960]
+        sources = []
+        for _ in range(per_size):
+            # Smooth gradients plus noise compress and decode like photographs rather than like pure noise.
+            base = (np.sin(xx / rng.uniform(20, 80)) + np.cos(yy / rng.uniform(20, 80))) * 60 + 128
+            image = np.clip(base[..., None] + rng.normal(0, 12, (720, 960, 3)), 0, 255).astype(np.uint8)
+            sources.append(image)
+
+    corpus = {}
+    for w, h in sizes:
+        encoded = []
+        for image in sources[:per_size]:
+            ok, buffer = cv2.imencode(".jpg", cv2.resize(image, (w, h)), [cv2.IMWRITE_JPEG_QUALITY, 90])
+            encoded.append(buffer.tobytes())
+        corpus[f"{w}x{h}"] = encoded
+    return corpus
+
+
+# ######################################################################################################################
+
+def bench_application(application, frames: np.ndarray, iterations: int) -> dict:
+    """ Single-frame and pipelined three-plane convolution straight on Application. """
+    from tracing import Trace
+
+    single = []
+    for i in range(iterations):
+        trace = Trace()
+        application.convolve_image(frames[i % len(frames)], trace=trace)
+        trace.add("total", trace.elapsed())
+        single.append(trace)
+
+    stream = []
+    for i in range(iterations):
+        traces = [Trace() for _ in range(3)]
+        start = time.perf_counter()
+        list(application.convolve_stream(frames[:3], traces=traces))
+        elapsed = time.perf_counter() - start
+        merged = Trace()
+        for trace in traces:
+            for stage, seconds in trace.stages.items():
+                merged.add(stage, seconds)
+        merged.add("total", elapsed)
+        stream.append(merged)
+
+    return {
+        "convolve_image": summarize_traces(single),
+        "convolve_stream_3_planes": summarize_traces(stream),
+        "frames_per_second_stream": 3 * iterations / sum(t.stages["total"] for t in stream),
+    }
+
+
+def bench_pipeline(app_module, encoded: List[bytes], concurrency: int, requests: int, warmup: int) -> dict:
+    """ Run `requests` uploads through process_upload with `concurrency` client threads. """
+    from tracing import Trace
+
+    def one(index):
+        trace = Trace(trace_id=str(index))
+        try:
+            result = app_module.process_upload(encoded[index % len(encoded)], trace, fallback_center=True)
+            # The inline data URLs /submit renders by default.
+            with trace.stage("base64"):
+                app_module.preview_sources(result["previews"], "inline")
+            error = None
+        except app_module.PipelineError as e:
+            error = f"{e.status}: {e}"
+        except Exception as e:
+            # Timeouts and other failures are counted like a 500 of /submit, not allowed to end the run.
+            error = f"{type(e).__name__}: {e}"
+        trace.add("total", trace.elapsed())
+        return trace, error
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(warmup)))
+        start = time.perf_counter()
+        outcomes = list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - start
+
+    stats = app_module.get_accelerator().stats()
+    succeeded = [trace for trace, error in outcomes if error is None]
+    errors = [error for _, error in outcomes if error is not None]
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": len(succeeded),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "wall_s": wall,
+        "throughput_rps": len(succeeded) / wall if wall > 0 else 0.0,
+        "latency": summarize([trace.stages["total"] for trace in succeeded]),
+        "stages": summarize_traces(succeeded),
+        "max_rss_kb": max_rss_kb(),
+        "buffer_pool": stats["buffer_pool"],
+        "scheduler": stats["scheduler"],
+    }
+
+
+# ######################################################################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Application and the /submit pipeline.")
+    parser.add_argument("--corpus", help="Directory of images (default: synthetic corpus)")
+    parser.add_argument("--sizes", default="640x480,1280x720,1920x1080", help="Upload sizes, WxH comma separated")
+    parser.add_argument("--concurrency", default="1,2,4", help="Client thread counts, comma separated")
+    parser.add_argument("--requests", type=int, default=30, help="Measured requests per size and concurrency")
+    parser.add_argument("--warmup", type=int, default=3, help="Unmeasured requests before each run")
+    parser.add_argument("--backend", choices=("fpga", "software", "auto"), help="Overrides CNN_BACKEND")
+    parser.add_argument("--cache", action="store_true", help="Keep the upload and result caches on")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.backend:
+        os.environ["CNN_BACKEND"] = args.backend
+    if not args.cache:
+        os.environ["CNN_CACHE_MB"] = "0"
+        os.environ["CNN_UPLOAD_CACHE_MB"] = "0"
+    # Imported here so the backend choice above is seen when app.py creates its Application.
+    import app as app_module
+    from pynq_backend import SIMULATED
+
+    accelerator = app_module.init_accelerator()
+    if not accelerator.wait_warm():
+        raise SystemExit(f"Accelerator warm-up failed: {accelerator.startup_error}")
+    application = accelerator.application
+    corpus = load_corpus(args.corpus, parse_sizes(args.sizes))
+
+    frames = np.random.default_rng(0).integers(0, 256, (3, 480, 480), dtype=np.uint8)
+    # The scheduler worker is idle here, so calling Application directly does not race with it.
+    report = {
+        "config": {
+            "backend": application.backend,
+            "simulated_pynq": SIMULATED,
+            "sizes": list(corpus),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "cache": args.cache,
+        },
+        "application": bench_application(application, frames, max(args.requests, 3)),
+        "pipeline": [],
+    }
+
+    for size, encoded in corpus.items():
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            run = bench_pipeline(app_module, encoded, concurrency, args.requests, args.warmup)
+            run["size"] = size
+            report["pipeline"].append(run)
+            print(f"{size} x{concurrency}: {run['throughput_rps']:.1f} req/s, "
+                  f"p95 {run['latency'].get('p95_ms', float('nan')):.1f} ms", file=sys.stderr)
+
+    report["max_rss_kb"] = max_rss_kb()
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+File: buffer_pool.py
+Authors: B. Ko, C. Okoye, S. Xiao
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+
+# ######################################################################################################################
+
+BufferKey = Tuple[Tuple[int, ...], str]
+
+
+def _buffer_key(shape, dtype) -> BufferKey:
+    if isinstance(shape, int):
+        shape = (shape,)
+    return tuple(int(dim) for dim in shape), np.dtype(dtype).str
+
+
+class BufferPool:
+    """
+    Pool of pre-allocated contiguous (CMA) buffers keyed by shape and dtype.
+
+    Buffers handed out by `acquire` must be given back with `release` (or use `borrow`). Idle buffers are kept
+    for reuse up to `capacity`; past that the least recently released buffer is freed.
+
+    Parameters:
+    - allocator (callable): Called as allocator(shape=..., dtype=...) to create a new buffer
+    - capacity (int): Maximum number of idle buffers retained across all keys
+    """
+
+    def __init__(self, allocator: Callable[..., np.ndarray], capacity: int = 8):
+        self._allocator = allocator
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        # Idle buffers per key, ordered from least to most recently released key.
+        self._idle: "OrderedDict[BufferKey, List[np.ndarray]]" = OrderedDict()
+        self._num_idle = 0
+        # Buffers currently handed out, keyed by id() so ndarray equality is never involved.
+        self._outstanding: Dict[int, BufferKey] = {}
+
+        self.allocations = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.leaks = 0
+
+    def acquire(self, shape, dtype=np.uint32) -> np.ndarray:
+        """ Hand out a buffer of the given shape and dtype, allocating only if none is idle. """
+        key = _buffer_key(shape, dtype)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                buffer = idle.pop()
+                if not idle:
+                    del self._idle[key]
+                self._num_idle -= 1
+                self.hits += 1
+                self._outstanding[id(buffer)] = key
+                return buffer
+            self.misses += 1
+
+        buffer = self._allocator(shape=key[0], dtype=np.dtype(key[1]))
+        with self._lock:
+            self.allocations += 1
+            self._outstanding[id(buffer)] = key
+        return buffer
+
+    def release(self, buffer: np.ndarray):
+        """ Return a buffer obtained from `acquire` to the pool. """
+        with self._lock:
+            key = self._outstanding.pop(id(buffer), None)
+            if key is None:
+                raise ValueError("Buffer was not acquired from this pool")
+            self._idle.setdefault(key, []).append(buffer)
+            self._idle.move_to_end(key)
+            self._num_idle += 1
+            evicted = self._evict_locked(self.capacity)
+        for stale in evicted:
+            stale.freebuffer()
+
+    @contextmanager
+    def borrow(self, shape, dtype=np.uint32):
+        """ Context manager that acquires a buffer and always releases it. """
+        buffer = self.acquire(shape, dtype)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+    def prime(self, shapes, count: int):
+        """
+        Allocate `count` buffers of each (shape, dtype) in `shapes` and leave them idle, with every page touched,
+        so the first frames neither allocate nor fault. Limited by `capacity`.
+        """
+        buffers = []
+        try:
+            for _ in range(count):
+                for shape, dtype in shapes:
+                    buffer = self.acquire(shape, dtype)
+                    buffer.fill(0)
+                    buffers.append(buffer)
+        finally:
+            for buffer in buffers:
+                self.release(buffer)
+
+    def _evict_locked(self, limit: int) -> List[np.ndarray]:
+        evicted = []
+        while self._num_idle > limit:
+            key, idle = next(iter(self._idle.items()))
+            evicted.append(idle.pop(0))
+            if not idle:
+                del self._idle[key]
+            self._num_idle -= 1
+            self.evictions += 1
+        return evicted
+
+    def clear(self):
+        """ Free every idle buffer. Outstanding buffers are counted as leaks. """
+        with self._lock:
+            evicted = self._evict_locked(0)
+            self.leaks += len(self._outstanding)
+            self._outstanding.clear()
+        for stale in evicted:
+            stale.freebuffer()
+
+    def stats(self) -> dict:
+        """ Usage counters for monitoring. """
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "idle": self._num_idle,
+                "outstanding": len(self._outstanding),
+                "allocations": self.allocations,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "leaks": self.leaks,
+            }
@@ -0,0 +1,67 @@
+"""
+File: convolution_result.py
+Authors: B. Ko, C. Okoye, S. Xiao
+"""
+
+from typing import Optional, Tuple
+import numpy as np
+from software_cnn import DATA_WIDTH, Q
+
+# ######################################################################################################################
+
+class ConvolutionResult:
+    """
+    Owned output map of one convolution.
+
+    `words` holds the uint32 words exactly as the accelerator wrote them, reshaped to (rows, cols). The signed
+    Q9.11 decodings are computed lazily, once, with whole-array operations.
+
+    Parameters:
+    - words (np.ndarray): 2-D uint32 array owned by this result
+    - trace_id (str): Optional identifier of the request that produced it
+    """
+
+    __slots__ = ("words", "trace_id", "_raw", "_values")
+
+    # Shift that moves the 20-bit sign bit into the int32 sign bit.
+    _SIGN_SHIFT = 32 - DATA_WIDTH
+
+    def __init__(self, words: np.ndarray, trace_id: Optional[str] = None):
+        self.words = words
+        self.trace_id = trace_id
+        self._raw: Optional[np.ndarray] = None
+        self._values: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_buffer(cls, buffer: np.ndarray, shape: Tuple[int, int], trace_id: Optional[str] = None):
+        """ Copy the first rows*cols words of a DMA buffer into a new owned result. """
+        rows, cols = shape
+        return cls(np.array(buffer[:rows * cols], dtype=np.uint32).reshape(rows, cols), trace_id)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.words.shape
+
+    @property
+    def raw(self) -> np.ndarray:
+        """ Sign-extended 20-bit two's complement values as int32 (fixed point, scaled by 2^Q). """
+        if self._raw is None:
+            raw = np.left_shift(self.words.view(np.int32), self._SIGN_SHIFT)
+            self._raw = np.right_shift(raw, self._SIGN_SHIFT, out=raw)
+        return self._raw
+
+    @property
+    def values(self) -> np.ndarray:
+        """ Real values of the Q9.11 outputs as float32. """
+        if self._values is None:
+            self._values = self.raw.astype(np.float32)
+            self._values *= np.float32(1.0 / (1 << Q))
+        return self._values
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None or np.dtype(dtype) == self.words.dtype:
+            return self.words.copy() if copy else self.words
+        return self.words.astype(dtype)
+
+    def __repr__(self):
+        return f"ConvolutionResult(shape={self.shape}, trace_id={self.trace_id!r})"
@@ -4,33 +4,24 @@ Authors: B. Ko, C. Okoye, S. Xiao
 """
 
 import asyncio
+import hashlib
+import itertools
+import os
+import threading
 import time
+from collections import deque
 from functools import wraps
-from typing import Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
 import numpy as np
-from pynq import Overlay, DefaultIP, allocate
+from pynq_backend import Overlay, DefaultIP, allocate
 from accelerator_driver import AcceleratorDriver
-
-# ######################################################################################################################
-
-def get_layer_input_size(layer_index, n_in, P, K, p):
-    """
-    Calculate the input dimension for a given CNN layer index.
-
-    Parameters:
-    - layer_index (int): Index of the CNN layer (0-based)
-    - n_in (int): Original input size
-    - P (int): Padding per layer
-    - K (int): Kernel size per layer
-    - p (int): Pooling window size per layer
-
-    Returns:
-    - int: Size of the input map to the specified layer
-    """
-    result = n_in
-    for _ in range(layer_index):
-        result = (result + 2 * P - K + 1) // p
-    return result
+from buffer_pool import BufferPool
+from convolution_result import ConvolutionResult
+from result_cache import ResultCache, frame_key
+from result_sink import NullSink, ResultSink
+from tracing import NULL_TRACE, Trace
+from software_cnn import INPUT_SIZE, SoftwareCNN, get_layer_input_size, get_output_size
+from tiling import TilePlan
 
 # ######################################################################################################################
 
@@ -57,6 +48,22 @@ def allocate_coherent(*args, **kwargs):
     return buffer
 
 
+# ######################################################################################################################
+
+class _StagedFrame:
+    """ Pooled input/output buffer pair of one frame, the shape of its output map, its trace and plane number. """
+
+    __slots__ = ("input_buf", "output_buf", "output_shape", "trace", "plane", "launched_at")
+
+    def __init__(self, input_buf, output_buf, output_shape, trace: Trace, plane: int = 0):
+        self.input_buf = input_buf
+        self.output_buf = output_buf
+        self.output_shape = output_shape
+        self.trace = trace
+        self.plane = plane
+        self.launched_at = 0.0
+
+
 # ######################################################################################################################
 
 class Application:
@@ -65,11 +72,158 @@ class Application:
     NUM_ISCALARS = 1
     NUM_OSCALARS = 0
 
-    def __init__(self, bit_file: str):
+    # "fpga" always uses the accelerator, "software" always uses the bit-exact NumPy model, and "auto" uses the
+    # accelerator when it is ready and falls back to the model while it is programming or down.
+    BACKENDS = ("fpga", "software", "auto")
+
+    # Bounds in seconds of the adaptive completion poll used when the DMA interrupts are not wired.
+    POLL_INTERVAL_MIN = 50e-6
+    POLL_INTERVAL_MAX = 5e-3
+
+    def __init__(self, bit_file: str, buffer_pool_capacity: int = 8, backend: str = "fpga",
+                 result_sink: Optional[ResultSink] = None, result_cache: Optional[ResultCache] = None,
+                 kernel_scalar: int = 1):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {self.BACKENDS}")
         self.name = bit_file
+        self.backend = backend
+        self.software = SoftwareCNN()
         self.overlay = None
         self.dma = None
         self.acc: Optional[AcceleratorDriver] = None
+        self.load_error: Optional[Exception] = None
+
+        # DMA buffers are reused across calls so the steady-state path does no CMA allocation.
+        self.buffer_pool = BufferPool(allocate_coherent, capacity=buffer_pool_capacity)
+        # Off (NullSink) when serving; a CaptureSink records every result from a background thread.
+        self.result_sink = result_sink if result_sink is not None else NullSink()
+
+        # Input scalar posted with every frame (e.g. kernel ID). Results are only cached for the current
+        # bitstream and scalar, so use set_kernel_scalar() to change it.
+        self.kernel_scalar = kernel_scalar
+        self._bitstream_digest: Optional[str] = None
+        self.result_cache = result_cache
+        if result_cache is not None:
+            result_cache.bind(self.cache_namespace)
+
+        # Usage counters, read by the metrics endpoint.
+        self.frames_processed = 0
+        self.dma_bytes_sent = 0
+        self.dma_bytes_received = 0
+        self.compute_seconds = 0.0
+
+        # Lifecycle state. The overlay is programmed once per process and the adaptor is only
+        # reconfigured after a fault or an explicit reset.
+        self._lock = threading.RLock()
+        self._ready = threading.Event()
+        self._adaptor_configured = False
+        self._faulted = False
+        self._loader: Optional[threading.Thread] = None
+        # Serializes coroutines sharing the accelerator; created lazily on the running loop.
+        self._async_lock: Optional[asyncio.Lock] = None
+        self._async_lock_loop = None
+
+    @property
+    def is_ready(self) -> bool:
+        """ True once the overlay is programmed and the adaptor core is configured. Never blocks. """
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """ Block until the accelerator is ready or the timeout expires. Returns the readiness. """
+        return self._ready.wait(timeout)
+
+    @property
+    def is_faulted(self) -> bool:
+        """ True from a failed transfer until the adaptor is reconfigured, by the next call or recover(). """
+        return self._faulted
+
+    def start(self) -> threading.Thread:
+        """
+        Program the overlay and configure the adaptor on a background thread so callers can poll
+        `is_ready` instead of waiting on bitstream programming.
+        """
+        with self._lock:
+            if self._loader is None or not self._loader.is_alive():
+                self._loader = threading.Thread(target=self._load, name="overlay-loader", daemon=True)
+                self._loader.start()
+            return self._loader
+
+    def _load(self):
+        try:
+            self.ensure_ready()
+        except Exception as e:
+            print(f"Accelerator failed to become ready: {e}")
+
+    def ensure_ready(self):
+        """ Program the overlay (first use only) and configure the adaptor core if needed. """
+        if self._ready.is_set():
+            return
+        if self.backend == "software":
+            self._ready.set()
+            return
+        with self._lock:
+            if self.overlay is None:
+                self.create_overlay()
+                if self.overlay is None:
+                    raise RuntimeError(f"Overlay {self.name} could not be loaded: {self.load_error}")
+            if not self._adaptor_configured:
+                self.setup_accelerator_adaptor_core()
+            self._faulted = False
+            self._ready.set()
+
+    def warm_up(self, trace: Trace = NULL_TRACE, buffer_sets: int = 2, dummy_frame: bool = True):
+        """
+        Do the one-time work of the first request before traffic arrives, each step timed as a stage of `trace`:
+        program the PL and configure the adaptor (program_pl), allocate and touch `buffer_sets` input/output DMA
+        buffer sets (prime_buffers) and, with `dummy_frame`, convolve one blank frame past the result cache
+        (dummy_frame). The blank frame counts in the usage counters and is recorded by a capture sink like any other
+        frame.
+
+        With `dummy_frame` it must not run concurrently with other calls; LocalAccelerator runs it before starting
+        its scheduler.
+        """
+        with trace.stage("program_pl"):
+            self.ensure_ready()
+        if not self._use_software():
+            with trace.stage("prime_buffers"):
+                output_size = get_output_size(INPUT_SIZE)
+                self.buffer_pool.prime((((1 + INPUT_SIZE * INPUT_SIZE,), np.uint32),
+                                        ((output_size * output_size,), np.uint32)), buffer_sets)
+        if dummy_frame:
+            with trace.stage("dummy_frame"):
+                self._convolve_image(np.zeros((INPUT_SIZE, INPUT_SIZE), dtype=np.uint8), NULL_TRACE)
+
+    def mark_faulted(self):
+        """
+        Flag the adaptor as needing reconfiguration. The bitstream itself is left loaded; the next frame (or
+        recover()) reconfigures the adaptor before it is launched.
+        """
+        with self._lock:
+            self._adaptor_configured = False
+            self._faulted = True
+            self._ready.clear()
+
+    def recover(self) -> bool:
+        """ Reconfigure a faulted adaptor now instead of on the next frame. Returns the readiness. """
+        if not self._faulted:
+            return self.is_ready
+        try:
+            self.ensure_ready()
+        except Exception as e:
+            print(f"Accelerator recovery failed: {e}")
+        return self.is_ready
+
+    def reset(self):
+        """ Explicitly soft-reset and reconfigure the adaptor core. """
+        self.mark_faulted()
+        self.ensure_ready()
+
+    def close(self):
+        """ Flush the result sink and the result cache's disk writes, and free the pooled DMA buffers. """
+        self.result_sink.close()
+        if self.result_cache is not None:
+            self.result_cache.close()
+        self.buffer_pool.clear()
 
     def create_overlay(self):
         try:
@@ -80,132 +234,399 @@ class Application:
                 loop = asyncio.new_event_loop()
                 asyncio.set_event_loop(loop)
 
-            self.overlay = Overlay(self.name)
+            # Skip the download when the PL already holds this bitstream.
+            overlay = Overlay(self.name, download=False)
+            if not overlay.is_loaded():
+                print(f"Downloading {self.name} to the PL.")
+                overlay.download()
+
+            self.overlay = overlay
             self.dma = self.overlay.axi_dma_0
             self.acc = self.overlay.axis_accelerator_ada_0
+            self.load_error = None
+
+            # The bitstream file may have been replaced since the cache was bound.
+            self._bitstream_digest = None
+            if self.result_cache is not None:
+                self.result_cache.bind(self.cache_namespace)
         except Exception as e:
+            self.load_error = e
             print(f"Error during overlay creation: {e}")
 
     def setup_accelerator_adaptor_core(self):
-        # Do a soft reset.
-        self.acc.soft_reset()
-
-        # Configure the input argument request enable register for 1 input argument.
-        self.acc.iarg_rqt_en_reg = (1 << self.NUM_IARGS) - 1
-
-        # Configure the output argument request enable register for 1 output argument.
-        self.acc.oarg_rqt_en_reg = (1 << self.NUM_OARGS) - 1
-
-        # Configure the input scalar request enable register for 1 input scalar.
-        self.acc.iscalar_rqt_en_reg = (1 << self.NUM_ISCALARS) - 1
-
-        # Configure the output scalar request enable register for 1 output scalar.
-        self.acc.oscalar_rqt_en_reg = (1 << self.NUM_OSCALARS) - 1
+        acc = self.acc
 
-        # Set the output argument length mode to Hardware.
-        self.acc.oarg_length_mode_reg = self.acc.OutputArgumentLengthModeEnum.Hardware
-
-        # Move the output buffer to the next position on every data output on the stream channel.
-        self.acc.cmd_reg = 0x00010001
+        # Do a soft reset.
+        acc.soft_reset()
+
+        # The whole configuration goes out as one sequence; registers already holding their value are skipped.
+        acc.apply_config((
+            # Configure the input argument request enable register for 1 input argument.
+            (acc.IARG_RQT_EN_REG_ADDR, (1 << self.NUM_IARGS) - 1),
+            # Configure the output argument request enable register for 1 output argument.
+            (acc.OARG_RQT_EN_REG_ADDR, (1 << self.NUM_OARGS) - 1),
+            # Configure the input scalar request enable register for 1 input scalar.
+            (acc.ISCALAR_RQT_EN_REG_ADDR, (1 << self.NUM_ISCALARS) - 1),
+            # Configure the output scalar request enable register for 1 output scalar.
+            (acc.OSCALAR_RQT_EN_REG_ADDR, (1 << self.NUM_OSCALARS) - 1),
+            # Set the output argument length mode to Hardware.
+            (acc.OARG_LENGTH_MODE_REG_ADDR, acc.OutputArgumentLengthModeEnum.Hardware),
+            # Move the output buffer to the next position on every data output on the stream channel.
+            (acc.CMD_REG_ADDR, 0x00010001),
+            # Move the input buffer to the next position on every data input on the stream channel.
+            (acc.CMD_REG_ADDR, 0x00000101),
+        ))
+
+        self._adaptor_configured = True
+
+    @property
+    def cache_namespace(self) -> str:
+        """ Identifies the weights results are computed with: a digest of the bitstream plus the kernel scalar. """
+        if self._bitstream_digest is None:
+            digest = hashlib.blake2b(digest_size=8)
+            try:
+                with open(self.name, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(chunk)
+            except OSError:
+                digest.update(os.path.basename(self.name).encode())
+            self._bitstream_digest = digest.hexdigest()
+        return f"{self._bitstream_digest}-k{self.kernel_scalar}"
+
+    def set_kernel_scalar(self, value: int):
+        """ Change the input scalar posted with each frame; cached results of the previous value stop matching. """
+        self.kernel_scalar = value
+        if self.result_cache is not None:
+            self.result_cache.bind(self.cache_namespace)
+
+    def lookup_cached(self, input_array: np.ndarray, trace: Trace = NULL_TRACE, plane: int = 0):
+        """
+        Look a frame up in the result cache. A hit goes to the result sink as plane `plane`, like a convolved frame,
+        so a capture records every result whether or not it was computed.
+
+        Returns:
+        - tuple: (key, ConvolutionResult or None). The key, for store_cached, pairs the cache namespace of this
+          lookup with the frame's digest; it is None when caching is off.
+        """
+        if self.result_cache is None:
+            return None, None
+        with trace.stage("cache_lookup"):
+            namespace = self.result_cache.namespace
+            key = frame_key(input_array)
+            words = self.result_cache.get(key)
+        if words is None:
+            return (namespace, key), None
+        result = ConvolutionResult(words.copy(), trace.trace_id)
+        self.result_sink.write(result, trace.trace_id, plane)
+        return (namespace, key), result
+
+    def store_cached(self, key: Optional[Tuple[str, str]], result: ConvolutionResult):
+        """ Cache a result under the key of its lookup_cached; dropped if the weights changed in between. """
+        if key is not None and self.result_cache is not None:
+            namespace, digest = key
+            self.result_cache.put(digest, result.words.copy(), namespace)
+
+    def _use_software(self) -> bool:
+        """
+        Whether the next frame goes to the software model. The auto backend uses it while the PL is first being
+        programmed (or could not be), and after a fault only if reconfiguring the adaptor fails.
+        """
+        if self.backend != "auto" or self.is_ready:
+            return self.backend == "software"
+        return not (self._faulted and self.recover())
+
+    def _emit(self, result: ConvolutionResult, plane: int = 0) -> ConvolutionResult:
+        """ Count a convolved frame and hand it to the result sink as plane `plane` of its request. """
+        self.frames_processed += 1
+        self.result_sink.write(result, result.trace_id, plane)
+        return result
+
+    def counters(self) -> dict:
+        """ Usage counters since startup. compute_seconds runs from launch to receive completion. """
+        return {
+            "frames_processed": self.frames_processed,
+            "dma_bytes_sent": self.dma_bytes_sent,
+            "dma_bytes_received": self.dma_bytes_received,
+            "compute_seconds": self.compute_seconds,
+        }
+
+    def convolve_batch(self, images: np.ndarray) -> List[ConvolutionResult]:
+        """
+        Convolve a (batch, h, w) stack of 8-bit images.
+
+        Returns:
+        - list of ConvolutionResult: One output map per image
+        """
+        images = np.asarray(images)
+        if self._use_software():
+            return [self._emit(ConvolutionResult(words), plane) for plane, words in enumerate(self.software(images))]
+        return list(self.convolve_stream(images))
+
+    def _convolve_software(self, input_array: np.ndarray, trace: Trace, plane: int = 0) -> ConvolutionResult:
+        start = time.perf_counter()
+        words = self.software(input_array)
+        elapsed = time.perf_counter() - start
+        trace.add("compute", elapsed)
+        self.compute_seconds += elapsed
+        return self._emit(ConvolutionResult(words, trace.trace_id), plane)
+
+    def _stage_frame(self, input_array: np.ndarray, trace: Trace = NULL_TRACE, plane: int = 0) -> _StagedFrame:
+        """ Take a buffer set from the pool and pack the frame into the input buffer. """
+        start = time.perf_counter()
+        h, w = input_array.shape
+        # There are 3 layers, so the output map has the input size of (0-based) layer index 3.
+        output_shape = (get_output_size(h), get_output_size(w))
+        input_buf = self.buffer_pool.acquire((1 + h * w,), np.uint32)
+        # One 32-bit word per output value.
+        output_buf = self.buffer_pool.acquire((output_shape[0] * output_shape[1],), np.uint32)
+
+        # Widen the (possibly strided) uint8 frame straight into the DMA buffer in one pass, no temporaries.
+        input_buf[0] = (h * w) << 2  # input length in bytes
+        np.copyto(input_buf[1:].reshape(h, w), input_array, casting="unsafe")
+        trace.add("stage", time.perf_counter() - start)
+        return _StagedFrame(input_buf, output_buf, output_shape, trace, plane)
+
+    def _release_frame(self, buffers: _StagedFrame):
+        self.buffer_pool.release(buffers.input_buf)
+        self.buffer_pool.release(buffers.output_buf)
+
+    def _launch(self, buffers: _StagedFrame) -> _StagedFrame:
+        """ Start the DMA transfers and the accelerator for a staged buffer set. """
+        try:
+            self.acc.set_iscalar_data(0, self.kernel_scalar)
+            self.dma.sendchannel.transfer(buffers.input_buf)
+            self.dma.recvchannel.transfer(buffers.output_buf)
+            self.acc.execute_step()
+            buffers.launched_at = time.perf_counter()
+        except Exception:
+            # The adaptor is in an unknown state; reconfigure it before the next call.
+            self.mark_faulted()
+            self._release_frame(buffers)
+            raise
+        return buffers
+
+    def _collect(self, buffers: _StagedFrame) -> ConvolutionResult:
+        """
+        Wait for a launched buffer set, copy the output out and return the buffers to the pool.
+
+        Traced stages: dma_send (launch until the send channel is observed idle), compute (until the receive
+        channel is observed idle) and dma_recv (copying the output out of the DMA buffer).
+        """
+        trace = buffers.trace
+        try:
+            self.dma.sendchannel.wait()
+            sent = time.perf_counter()
+            trace.add("dma_send", sent - buffers.launched_at)
+            self.dma.recvchannel.wait()
+            received = time.perf_counter()
+            trace.add("compute", received - sent)
+            self.compute_seconds += received - buffers.launched_at
+            self.dma_bytes_sent += buffers.input_buf.nbytes
+            self.dma_bytes_received += buffers.output_buf.nbytes
+            # The output buffer goes back to the pool, so the caller gets its own (single) copy.
+            result = ConvolutionResult.from_buffer(buffers.output_buf, buffers.output_shape, trace.trace_id)
+            trace.add("dma_recv", time.perf_counter() - received)
+            return self._emit(result, buffers.plane)
+        except Exception:
+            self.mark_faulted()
+            raise
+        finally:
+            self._release_frame(buffers)
+
+    def convolve_stream(self, frames: Iterable[np.ndarray], depth: int = 2,
+                        traces: Optional[Iterable[Trace]] = None,
+                        planes: Optional[Iterable[int]] = None) -> Iterator[ConvolutionResult]:
+        """
+        Convolve a sequence of frames (e.g. the R, G and B planes of an image) with pipelined DMA.
+
+        Up to `depth` buffer sets rotate through the pool, so packing frame N+1 on the ARM core overlaps the DMA
+        transfer and computation of frame N. Results are yielded in input order.
+
+        Parameters:
+        - frames (iterable of np.ndarray): 2-D 8-bit frames
+        - depth (int): Number of buffer sets in flight (2 for ping-pong)
+        - traces (iterable of Trace): Optional trace for each frame, consumed in step with `frames`
+        - planes (iterable of int): Plane number of each frame within its request, as recorded by the result sink,
+          consumed in step with `frames`; 0, 1, 2, ... by default
+        """
+        if depth < 2:
+            raise ValueError("depth must be at least 2")
+        traces = iter(traces) if traces is not None else itertools.repeat(NULL_TRACE)
+        planes = iter(planes) if planes is not None else itertools.count()
+        if self._use_software():
+            for frame in frames:
+                yield self._convolve_software(frame, next(traces), next(planes))
+            return
+
+        self.ensure_ready()
+        staged = deque()
+        running = None
+        try:
+            for frame in frames:
+                staged.append(self._stage_frame(frame, next(traces), next(planes)))
+                if running is None:
+                    running = self._launch(staged.popleft())
+                elif len(staged) >= depth - 1:
+                    finished, running = running, None
+                    result = self._collect(finished)
+                    running = self._launch(staged.popleft())
+                    yield result
+
+            while running is not None:
+                finished, running = running, None
+                result = self._collect(finished)
+                if staged:
+                    running = self._launch(staged.popleft())
+                yield result
+        finally:
+            # Reached when the consumer stops early or a transfer fails: drain and give everything back.
+            if running is not None:
+                try:
+                    self._collect(running)
+                except Exception:
+                    pass
+            while staged:
+                self._release_frame(staged.popleft())
+
+    def convolve_tiled(self, image: np.ndarray, trace: Trace = NULL_TRACE, depth: int = 2) -> ConvolutionResult:
+        """
+        Convolve an image larger than a frame, or non-square, as overlapping INPUT_SIZE tiles streamed back to back
+        and stitched into one map (see tiling.py). Bit-exact with the software model on the whole image; along a
+        dimension that is not a multiple of 8 the last output row or column comes from the software model.
+
+        Parameters:
+        - image (np.ndarray): 2-D 8-bit image, at least INPUT_SIZE in both dimensions
+        - trace (Trace): Per-stage timing record; the stages of all tiles accumulate
+        - depth (int): See convolve_stream
+
+        Returns:
+        - ConvolutionResult: Map of (height // 8, width // 8) outputs
+        """
+        plan = TilePlan(*image.shape)
+        tiles = self.convolve_stream(plan.tiles(image), depth, itertools.repeat(trace))
+        words = [result.words for result in tiles]
+        with trace.stage("stitch"):
+            stitched = plan.stitch(words)
+        with trace.stage("edges"):
+            plan.patch_edges(stitched, image, self.software)
+        return ConvolutionResult(stitched, trace.trace_id)
+
+    def _get_async_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._async_lock is None or self._async_lock_loop is not loop:
+            self._async_lock = asyncio.Lock()
+            self._async_lock_loop = loop
+        return self._async_lock
+
+    async def _wait_async(self):
+        """ Wait for the launched transfer without blocking the event loop. """
+        channels = (self.dma.sendchannel, self.dma.recvchannel)
+        if all(getattr(channel, "_interrupt", None) is not None for channel in channels):
+            for channel in channels:
+                await channel.wait_async()
+            return
+
+        # No interrupts: poll the adaptor status and the channels, backing off while the fabric is busy.
+        delay = self.POLL_INTERVAL_MIN
+        while not (self.acc.is_done_or_idle() and all(channel.idle for channel in channels)):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.POLL_INTERVAL_MAX)
+
+    def _abort(self, buffers: _StagedFrame):
+        """ Stop the DMA channels, release the buffers and soft-reset the adaptor after a hung transfer. """
+        print("Accelerator transfer did not complete, recovering with a soft reset.")
+        for channel in (self.dma.sendchannel, self.dma.recvchannel):
+            if hasattr(channel, "stop"):
+                channel.stop()
+                channel.start()
+        self._release_frame(buffers)
+        self.mark_faulted()
+        self.recover()
+
+    async def convolve_image_async(self, input_array: np.ndarray, timeout: Optional[float] = None,
+                                   trace: Trace = NULL_TRACE) -> ConvolutionResult:
+        """
+        Convolve one frame without blocking the event loop.
+
+        Completion is awaited on the DMA interrupts when the overlay exposes them, otherwise by an adaptive poll of
+        the adaptor STATUS register and the channel idle bits. Concurrent calls are queued on the accelerator.
+
+        Parameters:
+        - input_array (np.ndarray): 2-D 8-bit frame
+        - timeout (float): Seconds to wait for the hardware before aborting with a soft reset and raising
+          asyncio.TimeoutError
+        - trace (Trace): Optional per-stage timing record
+        """
+        loop = asyncio.get_running_loop()
+        if self._use_software():
+            return await loop.run_in_executor(None, self._convolve_software, input_array, trace)
+        if not self.is_ready:
+            await loop.run_in_executor(None, self.ensure_ready)
+
+        async with self._get_async_lock():
+            buffers = self._launch(self._stage_frame(input_array, trace))
+            try:
+                await asyncio.wait_for(self._wait_async(), timeout)
+            except BaseException:
+                # Timed out or cancelled with the transfer still in flight.
+                self._abort(buffers)
+                raise
+            return self._collect(buffers)
+
+    def convolve_image(self, input_array: np.ndarray, trace: Trace = NULL_TRACE) -> ConvolutionResult:
+        key, cached = self.lookup_cached(input_array, trace)
+        if cached is not None:
+            return cached
+        convolved = self._convolve_image(input_array, trace)
+        self.store_cached(key, convolved)
+        return convolved
 
-        # Move the input buffer to the next position on every data input on the stream channel.
-        self.acc.cmd_reg = 0x00000101
+    def _convolve_image(self, input_array: np.ndarray, trace: Trace) -> ConvolutionResult:
+        if self._use_software():
+            return self._convolve_software(input_array, trace)
 
-    def convolve_image(self, input_array: np.ndarray) -> np.ndarray:
         print("Entered convolve_image().")
-        h, w = input_array.shape
-        flat_input = input_array.flatten().astype(np.uint32)
-        input_len_bytes = flat_input.size << 2  # input length in bytes
-
+        self.ensure_ready()
         print(f"The input {input_array}")
 
-        # There are 3 layers, so the output dimension of the 3rd layer is the input dimension of the 4th
-        output_layer_index = 4
-        padding = 1
-        kernel_dim = 3
-        pooler_dim = 2
-
-        output_dim = get_layer_input_size(output_layer_index, h, padding, kernel_dim,
-                                          pooler_dim)
-
-        output_len_bytes = (output_dim * output_dim) << 2
-
-        # Allocate buffers
-        input_buf = allocate_coherent(shape=(1 + flat_input.size,), dtype=np.uint32)
-        output_buf = allocate_coherent(shape=(output_len_bytes,), dtype=np.uint32)
-
-        input_buf[0] = input_len_bytes
-        input_buf[1:] = flat_input
-
-        self.acc.set_iscalar_data(0, 1)  # Example scalar (e.g., kernel ID)
-
-        print("Starting DMA send/recv transfers.")
-        self.dma.sendchannel.transfer(input_buf)
-        self.dma.recvchannel.transfer(output_buf)
-
-        print("Accelerator adaptor: execute step.")
-        self.acc.execute_step()
-
-        print("Waiting on DMA send channel.")
-        self.dma.sendchannel.wait()
-        print("Waiting on DMA recv channel.")
-        self.dma.recvchannel.wait()
-        print("DMA controller transaction complete.")
-
-        convolved = output_buf
-
-        with open("CNN_output_hex.txt", "w") as f:
-            f.writelines(f"{val:x}\n" for val in output_buf)
+        buffers = self._stage_frame(input_array, trace)
 
-        with open("CNN_output_bin.txt", "w") as f:
-            f.writelines(f"{val:032b}\n" for val in output_buf)
+        print("Starting DMA send/recv transfers, accelerator adaptor: execute step.")
+        self._launch(buffers)
 
-        print("Wrote output to CNN_output_hex.txt, CNN_output_bin.txt!")
-
-        # Free buffers
-        input_buf.freebuffer()
-        output_buf.freebuffer()
-        print("Buffers freed. Returning to main...")
+        print("Waiting on DMA send/recv channels.")
+        convolved = self._collect(buffers)
+        print("DMA controller transaction complete. Buffers released.")
 
         return convolved
 
-    def convolve_image_timed(self, input_array: np.ndarray) -> np.ndarray:
-        h, w = input_array.shape
-        flat_input = input_array.flatten().astype(np.uint32)
-        input_len_bytes = flat_input.size << 2  # input length in bytes
-
-        output_layer_index = 4
-        padding_add = 1
-        kernel_dim = 3
-        pooler_dim = 2
-
-        output_dim = get_layer_input_size(output_layer_index, h, padding_add, kernel_dim,
-                                          pooler_dim)
-
-        output_len_bytes = (output_dim * output_dim) << 2
-
-        # Allocate buffers
-        input_buf = allocate_coherent(shape=(1 + flat_input.size,), dtype=np.uint32)
-        output_buf = allocate_coherent(shape=(output_len_bytes,), dtype=np.uint32)
-
-        input_buf[0] = input_len_bytes
-        input_buf[1:] = flat_input
-
-        input_buf.flush()
+    def convolve_image_timed(self, input_array: np.ndarray) -> ConvolutionResult:
+        self.ensure_ready()
+        buffers = self._stage_frame(input_array)
+        buffers.input_buf.flush()
 
-        self.acc.set_iscalar_data(0, 1)
+        self.acc.set_iscalar_data(0, self.kernel_scalar)
 
-        self.dma.sendchannel.transfer(input_buf)
-        self.dma.recvchannel.transfer(output_buf)
+        try:
+            self.dma.sendchannel.transfer(buffers.input_buf)
+            self.dma.recvchannel.transfer(buffers.output_buf)
+        except Exception:
+            self.mark_faulted()
+            self._release_frame(buffers)
+            raise
 
         # Time only the computation.
-        with Timer("execution_time.txt"):
-            self.acc.execute_step()
-            self.dma.sendchannel.wait()
-            self.dma.recvchannel.wait()
-
-        # Free buffers
-        input_buf.freebuffer()
-        output_buf.freebuffer()
+        try:
+            with Timer("execution_time.txt"):
+                self.acc.execute_step()
+                self.dma.sendchannel.wait()
+                self.dma.recvchannel.wait()
+        except Exception:
+            self.mark_faulted()
+            self._release_frame(buffers)
+            raise
+
+        convolved = self._emit(ConvolutionResult.from_buffer(buffers.output_buf, buffers.output_shape))
+        self._release_frame(buffers)
 
-        return output_buf
\ No newline at end of file
+        return convolved
@@ -0,0 +1,55 @@
+"""
+File: export_capture.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Offline conversion of a capture written by result_sink.CaptureSink to the hex/binary text dumps that
+convolve_image used to write on every call.
+
+Usage:
+    python export_capture.py CAPTURE_PATH [--record N | --all] [--prefix CNN_output]
+"""
+
+import argparse
+import numpy as np
+from result_sink import load_capture
+
+# ######################################################################################################################
+
+def write_text_dumps(words: np.ndarray, prefix: str):
+    """ Write <prefix>_hex.txt and <prefix>_bin.txt with one output word per line. """
+    flat = np.asarray(words, dtype=np.uint32).ravel()
+    np.savetxt(f"{prefix}_hex.txt", flat, fmt="%x")
+
+    # Unpack the big-endian bytes of each word into 32 '0'/'1' characters per line.
+    bits = np.unpackbits(flat.astype(">u4").view(np.uint8).reshape(-1, 4), axis=1)
+    lines = (bits + ord("0")).astype(np.uint8)
+    with open(f"{prefix}_bin.txt", "wb") as f:
+        f.write(np.hstack((lines, np.full((len(lines), 1), ord("\n"), dtype=np.uint8))).tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export captured CNN outputs as hex/binary text.")
+    parser.add_argument("capture", help="Capture path prefix given to CaptureSink")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--record", type=int, default=-1, help="Index of the record to export (default: last)")
+    group.add_argument("--all", action="store_true",
+                       help="Export every record, suffixed with its record and plane numbers")
+    parser.add_argument("--prefix", default="CNN_output", help="Output file prefix")
+    args = parser.parse_args()
+
+    index, records = load_capture(args.capture)
+    if not records:
+        parser.error(f"{args.capture} has no records")
+
+    if args.all:
+        # Request ids come from clients and are shared by the planes of a request, so they never name files.
+        for position, (entry, words) in enumerate(zip(index, records)):
+            write_text_dumps(words, f"{args.prefix}_{entry.get('record', position)}_{entry.get('plane', 0)}")
+        print(f"Wrote {len(records)} records.")
+    else:
+        write_text_dumps(records[args.record], args.prefix)
+        print(f"Wrote output to {args.prefix}_hex.txt, {args.prefix}_bin.txt!")
+
+
+if __name__ == "__main__":
+    main()
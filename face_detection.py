@@ -0,0 +1,124 @@
+"""
+File: face_detection.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Haar cascade face detection as a pipeline stage of its own.
+
+Each worker thread loads the cascade once and keeps it, since CascadeClassifier objects must not be shared between
+threads. Detection runs on a downscaled grayscale copy of the upload and the boxes are mapped back to the original
+image, which cuts the cascade's work roughly by the square of the scale. The thread pool bounds how many
+detections run at once, and because it is separate from the accelerator scheduler, detection of the next request
+overlaps the accelerator work of the current one.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# ######################################################################################################################
+
+CASCADE_NAME = "haarcascade_frontalface_default.xml"
+DEFAULT_CASCADE_PATH = os.path.join("/usr/share/opencv4/haarcascades", CASCADE_NAME)
+
+
+def default_cascade_path() -> str:
+    """ The system cascade used on the board, or the copy bundled with the opencv-python wheel if it is missing. """
+    if not os.path.exists(DEFAULT_CASCADE_PATH) and hasattr(cv2, "data"):
+        return os.path.join(cv2.data.haarcascades, CASCADE_NAME)
+    return DEFAULT_CASCADE_PATH
+
+
+class FaceDetector:
+    """
+    Thread pool of Haar cascade face detectors.
+
+    Parameters:
+    - cascade_path (str): Cascade XML file
+    - workers (int): Detection threads, i.e. how many detections may run at once
+    - max_side (int): Longest side of the copy detection runs on; 0 detects at full resolution
+    - scale_factor (float): Cascade pyramid step; larger is faster but may miss faces between scales
+    - min_neighbors (int): Overlapping detections needed to keep a face
+    - min_face (int): Smallest face side searched for, in original-image pixels; 0 uses the cascade window
+    """
+
+    def __init__(self, cascade_path: str = None, workers: int = 2, max_side: int = 640, scale_factor: float = 1.3,
+                 min_neighbors: int = 5, min_face: int = 0):
+        self.cascade_path = cascade_path or default_cascade_path()
+        self.max_side = max_side
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_face = min_face
+        self.workers = workers
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="face-detect")
+
+    @classmethod
+    def from_env(cls):
+        return cls(cascade_path=os.environ.get("CNN_CASCADE_PATH"),
+                   workers=int(os.environ.get("CNN_DETECT_WORKERS", 2)),
+                   max_side=int(os.environ.get("CNN_DETECT_MAX_SIDE", 640)),
+                   scale_factor=float(os.environ.get("CNN_DETECT_SCALE_FACTOR", 1.3)),
+                   min_neighbors=int(os.environ.get("CNN_DETECT_MIN_NEIGHBORS", 5)),
+                   min_face=int(os.environ.get("CNN_DETECT_MIN_FACE", 0)))
+
+    def _cascade(self):
+        """ This thread's classifier, loaded on first use. """
+        cascade = getattr(self._local, "cascade", None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(self.cascade_path)
+            if cascade.empty():
+                raise RuntimeError(f"Could not load the face cascade from {self.cascade_path}")
+            self._local.cascade = cascade
+        return cascade
+
+    def detect(self, bgr_img: np.ndarray) -> np.ndarray:
+        """
+        Detect faces in the calling thread.
+
+        Parameters:
+        - bgr_img (np.ndarray): Image as decoded by OpenCV
+
+        Returns:
+        - np.ndarray: (n, 4) int32 array of (x, y, w, h) boxes in original-image coordinates, in cascade order
+        """
+        h, w = bgr_img.shape[:2]
+        gray = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2GRAY)
+        scale = min(1.0, self.max_side / max(h, w)) if self.max_side else 1.0
+        if scale < 1.0:
+            gray = cv2.resize(gray, (max(1, round(w * scale)), max(1, round(h * scale))),
+                              interpolation=cv2.INTER_AREA)
+
+        min_side = round(self.min_face * scale)
+        faces = self._cascade().detectMultiScale(gray, self.scale_factor, self.min_neighbors,
+                                                 minSize=(min_side, min_side))
+        if len(faces) == 0:
+            return np.empty((0, 4), dtype=np.int32)
+
+        boxes = np.rint(np.asarray(faces, dtype=np.float64) / scale).astype(np.int32)
+        # Rounding may push a box past the image edge; keep every box inside so crops are never short.
+        np.clip(boxes[:, 0], 0, w - 1, out=boxes[:, 0])
+        np.clip(boxes[:, 1], 0, h - 1, out=boxes[:, 1])
+        boxes[:, 2] = np.minimum(boxes[:, 2], w - boxes[:, 0])
+        boxes[:, 3] = np.minimum(boxes[:, 3], h - boxes[:, 1])
+        return boxes
+
+    def warm_up(self, timeout: float = 30.0):
+        """ Load the cascade in every worker thread now instead of on each thread's first request. """
+        # All tasks wait for each other, so each runs on a thread of its own.
+        barrier = threading.Barrier(self.workers, timeout=timeout)
+
+        def load():
+            self._cascade()
+            barrier.wait()
+
+        for future in [self._executor.submit(load) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, bgr_img: np.ndarray) -> Future:
+        """ Queue detection on the pool. The future resolves to the boxes returned by detect(). """
+        return self._executor.submit(self.detect, bgr_img)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
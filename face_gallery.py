@@ -0,0 +1,271 @@
+"""
+File: face_gallery.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Identification on top of the CNN: a gallery of enrolled faces and top-k nearest-neighbour queries against it.
+
+A face is represented by an embedding of its red, green and blue 60x60 output maps: each map average-pooled over
+pool x pool blocks (675 values for the default pool of 4), concatenated, shifted to zero mean and scaled to unit
+length. The dot product of two embeddings is then their correlation, in [-1, 1].
+
+The embeddings of all enrolled faces are the rows of one contiguous matrix in a memory-mapped .npy file, stored as
+float32, float16 or int8 (symmetric, one scale per row). A query is a batched matrix product over the rows in
+chunks, followed by a partial sort for the top k; there is no per-identity Python loop. Rows are appended in place
+(the file doubles in capacity when full) and removal fills the holes from the end, so the matrix stays dense.
+
+Several processes (serve.py web workers) may open the same gallery: writers hold an exclusive flock on
+gallery.lock, readers a shared one, and each process reloads gallery.json whenever it changed on disk.
+
+float32 is the fastest to query; float16 and int8 halve and quarter the file and page cache footprint at the cost of
+converting each chunk to float32 during a query.
+
+On disk, in the gallery directory:
+- vectors.npy: (capacity, dim) matrix, only the first `count` rows are used
+- scales.npy: (capacity,) float32 row scales, int8 galleries only
+- gallery.json: dim, dtype, count and the label of each row, written after the rows it describes
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+# ######################################################################################################################
+
+DTYPES = ("float32", "float16", "int8")
+
+# Rows converted to float32 at once by queries on float16 and int8 galleries.
+QUERY_CHUNK_ROWS = 8192
+
+
+def embed(outputs: Sequence, pool: int = 4) -> np.ndarray:
+    """
+    Embedding of the output maps of one face.
+
+    Parameters:
+    - outputs (sequence): The R, G and B output maps, as arrays of real values or ConvolutionResults
+    - pool (int): Side of the average-pooling blocks
+
+    Returns:
+    - np.ndarray: float32 vector with zero mean and unit length
+    """
+    maps = np.stack([np.asarray(getattr(output, "values", output), dtype=np.float32) for output in outputs])
+    channels, rows, cols = maps.shape
+    rows, cols = rows - rows % pool, cols - cols % pool
+    pooled = maps[:, :rows, :cols].reshape(channels, rows // pool, pool, cols // pool, pool).mean(axis=(2, 4))
+    vector = pooled.ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class FaceGallery:
+    """
+    Persistent matrix of enrolled embeddings with labels. Thread-safe.
+
+    Parameters:
+    - directory (str): Gallery directory, created if missing; an existing gallery is opened
+    - dtype (str): Storage type, one of DTYPES; None opens an existing gallery as stored, or creates a float32 one
+    - initial_capacity (int): Rows allocated when the gallery is created
+    """
+
+    def __init__(self, directory: str, dtype: Optional[str] = None, initial_capacity: int = 1024):
+        if dtype is not None and dtype not in DTYPES:
+            raise ValueError(f"Unknown gallery dtype {dtype!r}, expected one of {DTYPES}")
+        self.directory = directory
+        self.dtype = dtype or "float32"
+        self.initial_capacity = initial_capacity
+        self.dim: Optional[int] = None
+        self.count = 0
+        self._labels: List[str] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._lock = threading.RLock()
+        self._stamp = None
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(self._path("gallery.lock"), "a")
+
+        with self._locked(fcntl.LOCK_SH):
+            if dtype is not None and self.count and self.dtype != dtype:
+                raise ValueError(f"Gallery {directory} stores {self.dtype}, not {dtype}")
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self, mode: int):
+        """ Hold the thread lock and the file lock (LOCK_SH or LOCK_EX), with the metadata up to date. """
+        with self._lock:
+            fcntl.flock(self._lock_file, mode)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """ Reload gallery.json and remap the files if another process changed them. """
+        try:
+            status = os.stat(self._path("gallery.json"))
+        except FileNotFoundError:
+            return
+        stamp = (status.st_mtime_ns, status.st_size)
+        if stamp == self._stamp:
+            return
+        with open(self._path("gallery.json")) as f:
+            meta = json.load(f)
+        self.dtype, self.dim, self.count = meta["dtype"], meta["dim"], meta["count"]
+        self._labels = meta["labels"][:self.count]
+        self._vectors = np.load(self._path("vectors.npy"), mmap_mode="r+")
+        if self.dtype == "int8":
+            self._scales = np.load(self._path("scales.npy"), mmap_mode="r+")
+        self._stamp = stamp
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self._vectors is None else self._vectors.shape[0]
+
+    def _reserve(self, rows: int):
+        """ Grow the files to hold at least `rows` rows, doubling the capacity. """
+        if rows <= self.capacity:
+            return
+        capacity = max(self.initial_capacity, self.capacity)
+        while capacity < rows:
+            capacity *= 2
+        vectors = self._grow("vectors.npy", (capacity, self.dim), self.dtype, self._vectors)
+        if self.dtype == "int8":
+            self._scales = self._grow("scales.npy", (capacity,), "float32", self._scales)
+        self._vectors = vectors
+
+    def _grow(self, name: str, shape, dtype: str, current: Optional[np.ndarray]) -> np.ndarray:
+        # Copy into a new file and rename it over the old one, so a crash leaves either the old or the new file.
+        partial = self._path(f"{name}.{os.getpid()}.tmp")
+        grown = np.lib.format.open_memmap(partial, mode="w+", dtype=dtype, shape=shape)
+        if current is not None:
+            grown[:self.count] = current[:self.count]
+        grown.flush()
+        del grown
+        os.replace(partial, self._path(name))
+        return np.load(self._path(name), mmap_mode="r+")
+
+    def _encode(self, embeddings: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if self.dtype == "float32":
+            return embeddings, None
+        if self.dtype == "float16":
+            return embeddings.astype(np.float16), None
+        scales = np.abs(embeddings).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.rint(embeddings / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _save_meta(self):
+        self._vectors.flush()
+        if self._scales is not None:
+            self._scales.flush()
+        meta = {"dim": self.dim, "dtype": self.dtype, "count": self.count, "labels": self._labels}
+        partial = self._path(f"gallery.json.{os.getpid()}.tmp")
+        with open(partial, "w") as f:
+            json.dump(meta, f)
+        os.replace(partial, self._path("gallery.json"))
+        status = os.stat(self._path("gallery.json"))
+        self._stamp = (status.st_mtime_ns, status.st_size)
+
+    def add(self, label: str, embeddings: np.ndarray) -> int:
+        """
+        Enroll one or more embeddings (rows of a 2D array, or a single vector) under `label`.
+
+        Returns:
+        - int: Number of rows in the gallery afterwards
+        """
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        with self._locked(fcntl.LOCK_EX):
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"Embeddings have {embeddings.shape[1]} values, the gallery stores {self.dim}")
+            start = self.count
+            self._reserve(start + len(embeddings))
+            rows, scales = self._encode(embeddings)
+            self._vectors[start:start + len(rows)] = rows
+            if scales is not None:
+                self._scales[start:start + len(rows)] = scales
+            self.count += len(rows)
+            self._labels.extend([label] * len(rows))
+            self._save_meta()
+            return self.count
+
+    def remove(self, label: str) -> int:
+        """
+        Remove every row enrolled under `label`. Rows from the end of the matrix move into the holes.
+
+        Returns:
+        - int: Number of rows removed
+        """
+        with self._locked(fcntl.LOCK_EX):
+            labels = np.array(self._labels, dtype=object)
+            removed = np.flatnonzero(labels == label)
+            if removed.size == 0:
+                return 0
+            count = self.count - removed.size
+            holes = removed[removed < count]
+            movers = np.setdiff1d(np.arange(count, self.count), removed)
+            self._vectors[holes] = self._vectors[movers]
+            if self._scales is not None:
+                self._scales[holes] = self._scales[movers]
+            labels[holes] = labels[movers]
+            self._labels = labels[:count].tolist()
+            self.count = count
+            self._save_meta()
+            return int(removed.size)
+
+    def labels(self) -> List[str]:
+        """ Distinct enrolled labels. """
+        with self._locked(fcntl.LOCK_SH):
+            return sorted(set(self._labels))
+
+    def search(self, queries: np.ndarray, k: int = 5) -> List[List[Tuple[str, float]]]:
+        """
+        Top-k rows by dot product for each query embedding.
+
+        Parameters:
+        - queries (np.ndarray): One embedding, or a batch as the rows of a 2D array
+        - k (int): Matches per query
+
+        Returns:
+        - list: Per query, up to k (label, score) pairs, best first
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        with self._locked(fcntl.LOCK_SH):
+            if self.count == 0:
+                return [[] for _ in queries]
+            if queries.shape[1] != self.dim:
+                raise ValueError(f"Queries have {queries.shape[1]} values, the gallery stores {self.dim}")
+            vectors = self._vectors[:self.count]
+            if self.dtype == "float32":
+                scores = queries @ vectors.T
+            else:
+                scores = np.empty((len(queries), self.count), dtype=np.float32)
+                for start in range(0, self.count, QUERY_CHUNK_ROWS):
+                    end = min(start + QUERY_CHUNK_ROWS, self.count)
+                    np.matmul(queries, vectors[start:end].astype(np.float32).T, out=scores[:, start:end])
+                if self._scales is not None:
+                    scores *= self._scales[:self.count]
+            labels = self._labels
+
+            k = min(k, self.count)
+            top = np.argpartition(scores, self.count - k, axis=1)[:, self.count - k:]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+            return [[(labels[row], float(score)) for row, score in zip(rows, row_scores)]
+                    for rows, row_scores in zip(top, top_scores)]
+
+    def stats(self) -> dict:
+        with self._locked(fcntl.LOCK_SH):
+            return {"entries": self.count, "labels": len(set(self._labels)), "capacity": self.capacity,
+                    "dim": self.dim, "dtype": self.dtype}
@@ -0,0 +1,56 @@
+"""
+File: ingest.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+In-memory decoding of uploads and preparation of the planes handed to the accelerator.
+"""
+
+import io
+from typing import Optional, Tuple
+import cv2
+import numpy as np
+
+# ######################################################################################################################
+
+def upload_bytes(file) -> memoryview:
+    """
+    Bytes of an uploaded file without copying when the upload is held in a BytesIO (see InMemoryRequest in app.py).
+    Falls back to reading the stream for any other file-like object.
+    """
+    stream = getattr(file, "stream", file)
+    if isinstance(stream, io.BytesIO):
+        return stream.getbuffer()
+    return memoryview(stream.read())
+
+
+def decode_image(data) -> Optional[np.ndarray]:
+    """
+    Decode an encoded image held in memory (bytes, memoryview or ndarray) into a BGR array.
+
+    Returns:
+    - np.ndarray or None: The decoded image, or None if the data is empty or not an image
+    """
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    if encoded.size == 0:
+        return None
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+
+def crop_and_resize(bgr_img: np.ndarray, box, size: Tuple[int, int], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Resize the (x, y, w, h) box of an image to `size`. The crop is a view, so the resize is the only pass over the
+    pixels; pass `out` to resize into an existing (size[1], size[0], 3) uint8 array.
+    """
+    x, y, w, h = box
+    cropped = bgr_img[y:y + h, x:x + w]
+    if out is None:
+        return cv2.resize(cropped, size)
+    return cv2.resize(cropped, size, dst=out)
+
+
+def split_planes(bgr_img: np.ndarray):
+    """
+    R, G and B planes of a BGR image as strided views (no copies). Application stages each view straight into its
+    DMA input buffer, widening to uint32 in the same pass.
+    """
+    return bgr_img[:, :, 2], bgr_img[:, :, 1], bgr_img[:, :, 0]
@@ -0,0 +1,264 @@
+"""
+File: metrics.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Low-overhead in-process metrics rendered in the Prometheus text exposition format.
+
+Request-path metrics (Counter, Histogram) are updated as events happen. Everything that already keeps its own
+counters (Application, BufferPool, AcceleratorScheduler) is read by collector callbacks only when /metrics is
+scraped, so it costs nothing on the request path.
+"""
+
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# ######################################################################################################################
+
+LabelSet = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_set(labels: Dict[str, str]) -> LabelSet:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    items = labels.items() if isinstance(labels, dict) else labels
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """ Monotonically increasing value per label set. """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[LabelSet, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_set(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(key), value
+
+
+class Histogram:
+    """ Cumulative-bucket histogram per label set, as Prometheus expects. """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # Per label set: [per-bucket counts (last is +Inf), sum]
+        self._values: Dict[LabelSet, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_set(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", dict(labels, le=_format_value(float(bound))), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    """
+    Set of metrics plus collectors. A collector is a callable returning (name, kind, help, samples) tuples, where
+    samples is a list of (labels dict, value); it is called on every scrape.
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[tuple]]] = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[tuple]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ######################################################################################################################
+
+class AcceleratorMonitor:
+    """
+    Samples the adaptor STATUS register on a background thread and accumulates time spent busy and idle.
+
+    Only the read-only STATUS register is touched, so sampling never interferes with the thread driving the
+    accelerator. The split is statistical: each sample is credited with the interval since the previous one.
+
+    Parameters:
+    - application (Application): Accelerator front end to sample
+    - interval (float): Seconds between samples
+    """
+
+    def __init__(self, application, interval: float = 0.02):
+        self.application = application
+        self.interval = interval
+        self.busy_seconds = 0.0
+        self.idle_seconds = 0.0
+        self.last_status: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="accelerator-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        from accelerator_driver import AcceleratorDriver
+
+        previous = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            acc = self.application.acc
+            if acc is None or not self.application.is_ready:
+                previous = now
+                continue
+            try:
+                status = acc.status_reg
+            except Exception:
+                previous = now
+                continue
+            self.last_status = status
+            if status & AcceleratorDriver.STATUS_IDLE:
+                self.idle_seconds += now - previous
+            else:
+                self.busy_seconds += now - previous
+            previous = now
+
+    def stats(self) -> dict:
+        return {"busy_seconds": self.busy_seconds, "idle_seconds": self.idle_seconds, "last_status": self.last_status}
+
+
+def accelerator_families(stats: dict):
+    """ Metric families, in collector form, of a LocalAccelerator.stats() snapshot (possibly from another process). """
+    counters = stats["application"]
+    yield ("cnn_frames_processed_total", "counter", "Frames convolved.", [({}, counters["frames_processed"])])
+    yield ("cnn_dma_bytes_total", "counter", "Bytes moved by the DMA engine.",
+           [({"direction": "send"}, counters["dma_bytes_sent"]),
+            ({"direction": "recv"}, counters["dma_bytes_received"])])
+    yield ("cnn_compute_seconds_total", "counter", "Time from accelerator launch to receive completion.",
+           [({}, counters["compute_seconds"])])
+    yield ("cnn_accelerator_ready", "gauge", "1 once the overlay is programmed and configured.",
+           [({}, int(stats["ready"]))])
+    yield ("cnn_accelerator_simulated", "gauge", "1 when the overlay is pynq_sim rather than the PL (PYNQ_SIM=1).",
+           [({}, int(stats["simulated"]))])
+
+    pool = stats["buffer_pool"]
+    yield ("cnn_buffer_pool_buffers", "gauge", "DMA buffers in the pool by state.",
+           [({"state": "idle"}, pool["idle"]), ({"state": "outstanding"}, pool["outstanding"])])
+    yield ("cnn_buffer_pool_events_total", "counter", "Buffer pool events.",
+           [({"event": event}, pool[event]) for event in ("allocations", "hits", "misses", "evictions", "leaks")])
+
+    if stats["mmio"] is not None:
+        yield ("cnn_mmio_accesses_total", "counter", "Adaptor register accesses on the control path.",
+               [({"kind": kind}, value) for kind, value in stats["mmio"].items()])
+
+    # The result cache is reported by cache_families(), together with the caches of the web process.
+    cache = stats["result_cache"]
+    if cache is not None:
+        yield ("cnn_result_cache_disk_hits_total", "counter", "Result cache hits served from the disk tier.",
+               [({}, cache["disk_hits"])])
+        yield ("cnn_result_cache_disk_dropped_total", "counter",
+               "Result cache disk writes dropped because the background writer was behind.",
+               [({}, cache["disk_dropped"])])
+
+    queue_stats = stats["scheduler"]
+    yield ("cnn_queue_depth", "gauge", "Frames waiting for the accelerator.", [({}, queue_stats["queue_depth"])])
+    yield ("cnn_queue_capacity", "gauge", "Maximum frames that may wait for the accelerator.",
+           [({}, queue_stats["max_queue"])])
+    yield ("cnn_queue_frames_total", "counter", "Frames by scheduler outcome.",
+           [({"outcome": outcome}, queue_stats[outcome])
+            for outcome in ("completed", "failed", "rejected", "cache_hits")])
+
+    monitor = stats["monitor"]
+    yield ("cnn_accelerator_busy_seconds_total", "counter",
+           "Time the adaptor STATUS register reported the accelerator as not idle (sampled).",
+           [({}, monitor["busy_seconds"])])
+    yield ("cnn_accelerator_idle_seconds_total", "counter",
+           "Time the adaptor STATUS register reported the accelerator as idle (sampled).",
+           [({}, monitor["idle_seconds"])])
+    if monitor["last_status"] is not None:
+        yield ("cnn_accelerator_status_register", "gauge", "Last sampled value of the adaptor STATUS register.",
+               [({}, monitor["last_status"])])
+
+
+def cache_families(caches: dict):
+    """ Metric families of LRUCache.stats() dicts keyed by cache name. """
+    yield ("cnn_cache_lookups_total", "counter", "Cache lookups by cache and outcome (memory tier).",
+           [({"cache": name, "result": result}, stats[key])
+            for name, stats in caches.items() for result, key in (("hit", "hits"), ("miss", "misses"))])
+    yield ("cnn_cache_evictions_total", "counter", "Entries evicted from the in-memory tier.",
+           [({"cache": name}, stats["evictions"]) for name, stats in caches.items()])
+    yield ("cnn_cache_bytes", "gauge", "Bytes held by the in-memory tier.",
+           [({"cache": name}, stats["bytes"]) for name, stats in caches.items()])
@@ -0,0 +1,195 @@
+"""
+File: preview.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Encoding of the red, green and blue channel previews shown after an upload.
+
+The previews used to be three RGB images, two thirds zeros, each colour converted and PNG encoded. The page can do
+the tinting itself (number.html multiplies each image with the channel colour), so the server has three layouts:
+- "combined": the cropped face encoded once; the page shows it three times, tinted red, green and blue
+- "planes": the three single-channel planes encoded as grayscale, tinted by the page
+- "channels": the original three colourised images, tinted with white (i.e. shown as is)
+
+Each layout can use PNG (quality = compression level 0-9), JPEG or WebP (quality 1-100). Layouts with more than one
+image encode them in parallel; OpenCV releases the GIL while encoding.
+
+PreviewDirectory keeps encoded previews for delivery by URL in a directory, so any of several web worker processes
+can answer the follow-up request for a preview another one encoded.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import cv2
+import numpy as np
+
+# ######################################################################################################################
+
+# codec: (file extension, MIME type, OpenCV quality flag, default quality)
+CODECS = {
+    "png": (".png", "image/png", cv2.IMWRITE_PNG_COMPRESSION, 1),
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY, 90),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY, 90),
+}
+QUALITY_RANGES = {"png": (0, 9), "jpeg": (0, 100), "webp": (1, 100)}
+MODES = ("combined", "planes", "channels")
+
+# (label, CSS tint, index of the channel in a BGR image)
+CHANNELS = (("Red", "#ff0000", 2), ("Green", "#00ff00", 1), ("Blue", "#0000ff", 0))
+
+
+class Preview:
+    """ One encoded preview as the page shows it. Previews of the "combined" layout share the same `data`. """
+
+    __slots__ = ("name", "label", "tint", "mime", "data")
+
+    def __init__(self, name: str, label: str, tint: str, mime: str, data: np.ndarray):
+        self.name = name
+        self.label = label
+        self.tint = tint
+        self.mime = mime
+        self.data = data
+
+
+class PreviewEncoder:
+    """
+    Encodes the channel previews of a cropped face.
+
+    Parameters:
+    - mode (str): Default layout, one of MODES
+    - codec (str): Default codec, one of CODECS
+    - quality (int): Default quality for the codec; None uses the codec's default
+    - workers (int): Encoding threads shared by all requests
+    """
+
+    def __init__(self, mode: str = "combined", codec: str = "png", quality: Optional[int] = None, workers: int = 3):
+        self.mode, self.codec, self.quality = self.validate(mode, codec, quality)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preview-encode")
+
+    @staticmethod
+    def validate(mode: str, codec: str, quality: Optional[int]):
+        """ Check a layout/codec/quality choice, raising ValueError with a client-presentable message. """
+        if mode not in MODES:
+            raise ValueError(f"Unknown preview mode {mode!r}, expected one of {MODES}")
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r}, expected one of {tuple(CODECS)}")
+        if quality is not None:
+            low, high = QUALITY_RANGES[codec]
+            if not low <= quality <= high:
+                raise ValueError(f"Quality for {codec} must be between {low} and {high}")
+        return mode, codec, quality
+
+    def _encode(self, image: np.ndarray, codec: str, quality: Optional[int]) -> np.ndarray:
+        extension, _, flag, default = CODECS[codec]
+        ok, buffer = cv2.imencode(extension, image, [flag, default if quality is None else quality])
+        if not ok:
+            raise RuntimeError(f"Could not encode preview as {codec}")
+        return buffer
+
+    def encode(self, bgr_img: np.ndarray, mode: Optional[str] = None, codec: Optional[str] = None,
+               quality: Optional[int] = None) -> List[Preview]:
+        """
+        Encode the previews of a BGR image. Arguments left as None use the encoder's defaults.
+
+        Returns:
+        - list of Preview: Red, green and blue previews, in that order
+        """
+        mode = mode or self.mode
+        codec = codec or self.codec
+        quality = self.quality if quality is None and codec == self.codec else quality
+        mime = CODECS[codec][1]
+
+        if mode == "combined":
+            data = self._encode(bgr_img, codec, quality)
+            return [Preview("image", label, tint, mime, data) for label, tint, _ in CHANNELS]
+
+        if mode == "planes":
+            images = [bgr_img[:, :, index] for _, _, index in CHANNELS]
+        else:
+            images = []
+            for _, _, index in CHANNELS:
+                image = np.zeros_like(bgr_img)
+                image[:, :, index] = bgr_img[:, :, index]
+                images.append(image)
+        encoded = self._executor.map(lambda image: self._encode(image, codec, quality), images)
+        tint = "#ffffff" if mode == "channels" else None
+        return [Preview(label.lower(), label, tint or channel_tint, mime, data)
+                for (label, channel_tint, _), data in zip(CHANNELS, encoded)]
+
+
+# ######################################################################################################################
+
+class PreviewDirectory:
+    """
+    Encoded previews as files in a directory shared by processes, with the get/put interface of an LRUCache holding
+    (data, mime) tuples. Keys are "<preview id>/<name>" of letters and digits. Each process prunes the directory
+    every `prune_every` puts: files older than `max_age` go first, then the oldest until `max_bytes` is met.
+
+    Parameters:
+    - directory (str): Directory, created if missing
+    - max_bytes (int): Size budget of the directory
+    - max_age (float): Seconds a preview is kept at most
+    - prune_every (int): Puts between prunes
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_age: float = 300.0, prune_every: int = 32):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self._puts = 0
+
+    def _path(self, key: str) -> Optional[str]:
+        preview_id, _, name = key.partition("/")
+        if not (preview_id.isalnum() and name.isalnum()):
+            return None
+        return os.path.join(self.directory, f"{preview_id}-{name}")
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, str]]:
+        path = self._path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                mime = f.readline().decode("ascii").rstrip("\n")
+                return np.frombuffer(f.read(), dtype=np.uint8), mime
+        except OSError:
+            return None
+
+    def put(self, key: str, value: Tuple[np.ndarray, str]):
+        path = self._path(key)
+        if path is None:
+            raise ValueError(f"Invalid preview key {key!r}")
+        data, mime = value
+        # Write under a private name and rename, so other processes never read a partial file.
+        partial = f"{path}.{os.getpid()}.tmp"
+        with open(partial, "wb") as f:
+            f.write(mime.encode("ascii") + b"\n")
+            f.write(np.ascontiguousarray(data).data)
+        os.replace(partial, path)
+        self._puts += 1
+        if self._puts % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        """ Remove expired previews, then the oldest ones beyond the size budget. """
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                status = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((status.st_mtime, status.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        expired = time.time() - self.max_age
+        for mtime, size, path in entries:
+            if mtime >= expired and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
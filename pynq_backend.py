@@ -0,0 +1,40 @@
+"""
+File: pynq_backend.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Single import point for pynq. Uses the real library unless PYNQ_SIM=1 selects pynq_sim, the simulated overlay.
+
+The simulator is never chosen implicitly: when pynq cannot be imported (not installed, or a broken install on the
+board) a warning is printed and Overlay, DefaultIP and allocate raise that ImportError when used, so the fpga
+backend fails to become ready instead of serving simulated results. The software backend does not touch them.
+SIMULATED is reported by the accelerator's stats, /readyz and /metrics.
+"""
+
+import os
+
+IMPORT_ERROR = None
+
+if os.environ.get("PYNQ_SIM") == "1":
+    SIMULATED = True
+    from pynq_sim import Overlay, DefaultIP, PL, allocate
+else:
+    SIMULATED = False
+    try:
+        from pynq import Overlay, DefaultIP, PL, allocate
+    except ImportError as e:
+        IMPORT_ERROR = e
+        print(f"WARNING: pynq could not be imported ({e}); the accelerator is unavailable. "
+              f"Set PYNQ_SIM=1 to run on the simulator.")
+
+        def _unavailable(*args, **kwargs):
+            raise ImportError(f"pynq is unavailable: {IMPORT_ERROR}") from IMPORT_ERROR
+
+        class Overlay:
+            __init__ = _unavailable
+
+        class DefaultIP:
+            __init__ = _unavailable
+
+        allocate = _unavailable
+
+        PL = None
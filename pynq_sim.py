@@ -0,0 +1,335 @@
+"""
+File: pynq_sim.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Hardware-free stand-in for the parts of pynq used by this project, for local benchmarking and CI.
+
+It provides `Overlay`, `DefaultIP`, `allocate` and `PL` with the same surface as pynq. The overlay exposes
+`axi_dma_0` (send/recv channels) and `axis_accelerator_ada_0` (an AcceleratorDriver over a memory-backed register
+file). Executing a step on the adaptor runs the bit-exact SoftwareCNN on the posted input buffer, and the result
+lands in the receive buffer after a latency/bandwidth timing model has elapsed.
+
+The timing model is configured with environment variables or by assigning `pynq_sim.timing`:
+- PYNQ_SIM_LATENCY_US: fixed setup latency per step (default 50)
+- PYNQ_SIM_BANDWIDTH_MBPS: DMA bandwidth per direction (default 400)
+- PYNQ_SIM_CLOCK_MHZ: fabric clock, one input pixel per cycle (default 100)
+- PYNQ_SIM_PROGRAM_S: time to program the bitstream (default 0.5)
+- PYNQ_SIM_COMPUTE: 0 to skip the CNN math and return zeros, when only timing matters (default 1)
+
+The CNN math runs on a background thread; a transfer completes when both the modelled time has elapsed and the
+math has finished, so on a slow host the simulator is never faster than the modelled hardware nor hides host cost.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+import numpy as np
+from software_cnn import INPUT_SIZE, SoftwareCNN, get_output_size
+
+# ######################################################################################################################
+
+class TimingModel:
+    """ Latency and bandwidth model of the DMA engine and the streaming convolver. """
+
+    def __init__(self, latency_s: float = 50e-6, bandwidth_bps: float = 400e6, clock_hz: float = 100e6,
+                 program_s: float = 0.5, compute_outputs: bool = True, hang_timeout_s: float = 5.0):
+        self.latency_s = latency_s
+        self.bandwidth_bps = bandwidth_bps
+        self.clock_hz = clock_hz
+        self.program_s = program_s
+        self.compute_outputs = compute_outputs
+        # A real channel wait() spins forever on a transfer that never completes; the simulator gives up.
+        self.hang_timeout_s = hang_timeout_s
+
+    @classmethod
+    def from_env(cls):
+        return cls(latency_s=float(os.environ.get("PYNQ_SIM_LATENCY_US", 50)) * 1e-6,
+                   bandwidth_bps=float(os.environ.get("PYNQ_SIM_BANDWIDTH_MBPS", 400)) * 1e6,
+                   clock_hz=float(os.environ.get("PYNQ_SIM_CLOCK_MHZ", 100)) * 1e6,
+                   program_s=float(os.environ.get("PYNQ_SIM_PROGRAM_S", 0.5)),
+                   compute_outputs=os.environ.get("PYNQ_SIM_COMPUTE", "1") != "0")
+
+    def step_times(self, input_bytes: int, output_bytes: int, pixels: int):
+        """ Seconds from execute until the send channel and the receive channel complete. """
+        send = input_bytes / self.bandwidth_bps
+        # The convolver consumes the stream as it arrives, so the slower of the two bounds the input phase.
+        compute = max(send, pixels / self.clock_hz)
+        return self.latency_s + send, self.latency_s + compute + output_bytes / self.bandwidth_bps
+
+
+timing = TimingModel.from_env()
+
+# ######################################################################################################################
+
+class SimBuffer(np.ndarray):
+    """ ndarray with the pynq buffer methods. Memory is ordinary host memory. """
+
+    def __array_finalize__(self, obj):
+        self.coherent = getattr(obj, "coherent", False)
+        self.freed = getattr(obj, "freed", False)
+
+    @property
+    def physical_address(self):
+        return self.__array_interface__["data"][0]
+
+    def freebuffer(self):
+        self.freed = True
+
+    def close(self):
+        self.freebuffer()
+
+    def flush(self):
+        pass
+
+    def invalidate(self):
+        pass
+
+
+def allocate(shape, dtype="u4", target=None, **kwargs):
+    return np.zeros(shape, dtype=dtype).view(SimBuffer)
+
+
+class PL:
+    """ What the simulated programmable logic currently holds. """
+    bitfile_name: Optional[str] = None
+
+
+# ######################################################################################################################
+
+class SimMMIO:
+    """
+    Register file backed by a uint32 array, with the pynq MMIO read/write/array surface.
+
+    Parameters:
+    - length (int): Size of the register file in bytes
+    - on_access (callable): Called before every access, so the fabric model can update status registers
+    """
+
+    def __init__(self, length: int, on_access=None):
+        self.length = length
+        self._array = np.zeros(length >> 2, dtype=np.uint32)
+        self._on_access = on_access
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._on_access is not None:
+            self._on_access()
+        return self._array
+
+    def read(self, offset: int = 0, length: int = 4):
+        return int(self.array[offset >> 2])
+
+    def write(self, offset: int, data: int):
+        self._array[offset >> 2] = data & 0xFFFFFFFF
+
+
+class DefaultIP:
+    """ pynq DefaultIP over a SimMMIO. Register writes are forwarded to the owning fabric model, if any. """
+
+    def __init__(self, description):
+        self._description = description
+        self._fabric = description.get("fabric")
+        self.mmio = SimMMIO(description.get("addr_range", 0x10000),
+                            self._fabric.poll if self._fabric is not None else None)
+
+    def read(self, offset: int = 0):
+        return self.mmio.read(offset)
+
+    def write(self, offset: int, value: int):
+        self.mmio.write(offset, value)
+        if self._fabric is not None:
+            self._fabric.on_register_write(self, offset, value)
+
+
+# ######################################################################################################################
+
+class SimDMAChannel:
+    """ One direction of the simulated AXI DMA. """
+
+    def __init__(self, fabric: "SimFabric", direction: str):
+        self._fabric = fabric
+        self._direction = direction
+        self._interrupt = None  # No interrupts, callers poll like on the current bitstream.
+        self.buffer: Optional[np.ndarray] = None
+        self.done_at: Optional[float] = None
+        self.running = True
+
+    @property
+    def idle(self) -> bool:
+        self._fabric.poll()
+        return self.buffer is None
+
+    def transfer(self, array, start=0, nbytes=0):
+        if not self.running:
+            raise RuntimeError("DMA channel not started")
+        if not self.idle:
+            raise RuntimeError("DMA channel not idle")
+        with self._fabric.lock:
+            self.buffer = array
+            self.done_at = None
+            self._fabric.try_start()
+
+    def wait(self):
+        deadline = time.monotonic() + timing.hang_timeout_s
+        while not self.idle:
+            done_at = self.done_at
+            now = time.monotonic()
+            if now > deadline:
+                raise RuntimeError(f"Simulated DMA {self._direction} transfer never completed")
+            if done_at is not None and now >= done_at:
+                # Modelled time is up; the host is still doing the math.
+                self._fabric.wait_output(deadline - now)
+            else:
+                time.sleep(max(0.0, min(done_at - now, 1e-3)) if done_at is not None else 1e-4)
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        with self._fabric.lock:
+            self.running = False
+            self.buffer = None
+            self.done_at = None
+            self._fabric.abort()
+
+
+class SimDMA:
+    def __init__(self, fabric: "SimFabric"):
+        self.sendchannel = SimDMAChannel(fabric, "send")
+        self.recvchannel = SimDMAChannel(fabric, "recv")
+
+
+class SimFabric:
+    """
+    Timing-accurate model of the adaptor, DMA and multilayer_cnn. A step starts once both channels have a buffer
+    posted and the adaptor has been told to execute; its output is written when the receive channel completes.
+    """
+
+    def __init__(self, n: int = INPUT_SIZE):
+        self.n = n
+        self.lock = threading.RLock()
+        self.engine = SoftwareCNN()
+        self.dma = SimDMA(self)
+        self.adaptor = None
+        self._execute_pending = False
+        self._output: Optional[Future] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pynq-sim-fabric")
+
+        self.steps = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _set_status(self, busy: bool):
+        if self.adaptor is not None:
+            from accelerator_driver import AcceleratorDriver
+            status = AcceleratorDriver.STATUS_START if busy else AcceleratorDriver.STATUS_IDLE
+            if not busy and self.steps:
+                status |= AcceleratorDriver.STATUS_DONE
+            self.adaptor.mmio.write(AcceleratorDriver.STATUS_REG_ADDR, status)
+
+    def on_register_write(self, ip, offset: int, value: int):
+        from accelerator_driver import AcceleratorDriver
+        with self.lock:
+            if offset == AcceleratorDriver.CMD_REG_ADDR and (value >> 16) & 0xF == 0b010:
+                self._execute_pending = True
+                self.try_start()
+            elif offset == AcceleratorDriver.CTRL_REG_ADDR and value & 0x1:
+                self.abort()
+
+    def try_start(self):
+        with self.lock:
+            send, recv = self.dma.sendchannel, self.dma.recvchannel
+            if not (self._execute_pending and send.buffer is not None and recv.buffer is not None):
+                return
+            self._execute_pending = False
+
+            pixels = send.buffer[1:1 + (int(send.buffer[0]) >> 2)]
+            if pixels.size != self.n * self.n:
+                # The fabric is synthesized for n x n frames; anything else never produces a full output.
+                print(f"pynq_sim: {pixels.size} input pixels but the fabric expects {self.n * self.n}.")
+                send.done_at = time.monotonic()
+                return
+
+            self._output = self._executor.submit(self._compute, pixels.reshape(self.n, self.n))
+            output_bytes = min(recv.buffer.nbytes, (get_output_size(self.n) ** 2) << 2)
+            send_s, recv_s = timing.step_times(send.buffer.nbytes, output_bytes, pixels.size)
+            now = time.monotonic()
+            send.done_at = now + send_s
+            recv.done_at = now + recv_s
+            self._set_status(busy=True)
+
+    def _compute(self, pixels: np.ndarray) -> np.ndarray:
+        if not timing.compute_outputs:
+            return np.zeros(get_output_size(self.n) ** 2, dtype=np.uint32)
+        return self.engine(pixels.astype(np.uint8)).ravel()
+
+    def wait_output(self, timeout: float):
+        output = self._output
+        if output is not None:
+            try:
+                output.result(max(timeout, 0.0))
+            except Exception:
+                pass
+
+    def poll(self):
+        """ Complete every transfer whose simulated time has elapsed. """
+        with self.lock:
+            now = time.monotonic()
+            send, recv = self.dma.sendchannel, self.dma.recvchannel
+            if send.buffer is not None and send.done_at is not None and now >= send.done_at:
+                self.bytes_sent += send.buffer.nbytes
+                send.buffer = None
+                send.done_at = None
+            if (recv.buffer is not None and recv.done_at is not None and now >= recv.done_at
+                    and self._output is not None and self._output.done()):
+                output = self._output.result()
+                words = min(recv.buffer.size, output.size)
+                recv.buffer[:words] = output[:words]
+                self.bytes_received += words << 2
+                recv.buffer = None
+                recv.done_at = None
+                self._output = None
+                self.steps += 1
+                self._set_status(busy=False)
+
+    def abort(self):
+        with self.lock:
+            self._execute_pending = False
+            self._output = None
+            for channel in (self.dma.sendchannel, self.dma.recvchannel):
+                channel.buffer = None
+                channel.done_at = None
+            self._set_status(busy=False)
+
+
+# ######################################################################################################################
+
+class Overlay:
+    """
+    Simulated overlay of full_cnn.bit. Only the IP used by this project is present.
+
+    Parameters:
+    - bitfile_name (str): Name of the bitstream, recorded in PL when downloaded
+    - download (bool): Program the simulated PL immediately
+    """
+
+    def __init__(self, bitfile_name: str, download: bool = True, **kwargs):
+        from accelerator_driver import AcceleratorDriver
+
+        self.bitfile_name = os.path.abspath(bitfile_name)
+        self.fabric = SimFabric()
+        self.axi_dma_0 = self.fabric.dma
+        self.axis_accelerator_ada_0 = AcceleratorDriver({"fabric": self.fabric, "addr_range": 0x10000})
+        self.fabric.adaptor = self.axis_accelerator_ada_0
+        self.fabric.abort()
+        if download:
+            self.download()
+
+    def is_loaded(self) -> bool:
+        return PL.bitfile_name == self.bitfile_name
+
+    def download(self):
+        time.sleep(timing.program_s)
+        PL.bitfile_name = self.bitfile_name
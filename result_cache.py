@@ -0,0 +1,241 @@
+"""
+File: result_cache.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Content-addressed caches for repeated uploads and repeated accelerator frames.
+
+ResultCache maps the hash of the exact frame sent to the accelerator to its output words. It has a size-bounded
+in-memory LRU tier and an optional on-disk tier of .npy files that are memory-mapped when read back. Entries
+belong to a namespace naming the loaded bitstream and kernel scalar (see Application.cache_namespace), so a result
+computed with one set of weights is never returned after the weights change. Disk writes are queued to a background
+writer thread, so a miss on the accelerator worker only pays for the in-memory put.
+
+LRUCache is the plain in-memory tier on its own, used for the decoded and cropped uploads keyed on the raw upload
+bytes.
+
+Keys are 128-bit xxh3 digests when the optional xxhash package is installed, and blake2b digests otherwise.
+"""
+
+import hashlib
+import os
+import queue
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# ######################################################################################################################
+
+def content_key(data) -> str:
+    """ Hex digest of a bytes-like object. """
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def frame_key(frame: np.ndarray) -> str:
+    """ Hex digest of an array's shape, dtype and bytes. Strided views (e.g. one colour plane) are packed first. """
+    frame = np.ascontiguousarray(frame)
+    header = f"{frame.shape}{frame.dtype.str}".encode()
+    if xxhash is not None:
+        digest = xxhash.xxh3_128(header)
+        digest.update(frame.data)
+        return digest.hexdigest()
+    digest = hashlib.blake2b(header, digest_size=16)
+    digest.update(frame.data)
+    return digest.hexdigest()
+
+
+# ######################################################################################################################
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache of arrays (or tuples of arrays), bounded by their total size in bytes.
+
+    Parameters:
+    - max_bytes (int): Size budget; the least recently used entries are evicted beyond it
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(value) -> int:
+        if isinstance(value, tuple):
+            return sum(getattr(item, "nbytes", 0) for item in value)
+        return getattr(value, "nbytes", 0)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value):
+        size = self._size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# ######################################################################################################################
+
+class ResultCache:
+    """
+    Two-tier cache of accelerator output words keyed by frame_key() of the input frame.
+
+    Cached arrays are shared, so callers copy them before handing them out (see Application.lookup_cached).
+
+    Parameters:
+    - max_bytes (int): Size budget of the in-memory tier
+    - disk_dir (str): Directory of the on-disk tier, one subdirectory per namespace; None for memory only
+    - max_pending_writes (int): Disk writes that may wait for the writer before new ones are dropped
+    """
+
+    def __init__(self, max_bytes: int = 64 << 20, disk_dir: Optional[str] = None, max_pending_writes: int = 256):
+        self.memory = LRUCache(max_bytes)
+        self.disk_dir = disk_dir
+        self.namespace = ""
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.disk_writes = 0
+        self.disk_dropped = 0
+        self.invalidations = 0
+        self._writes: "queue.Queue" = queue.Queue(maxsize=max_pending_writes)
+        self._writer: Optional[threading.Thread] = None
+        if disk_dir is not None:
+            self._writer = threading.Thread(target=self._run_writer, name="result-cache-writer", daemon=True)
+            self._writer.start()
+
+    def bind(self, namespace: str):
+        """
+        Switch to `namespace`. If it differs from the current one the memory tier is dropped; the disk tier simply
+        looks in another subdirectory, so results of a previous bitstream are kept for when it comes back.
+        """
+        with self._lock:
+            if namespace == self.namespace:
+                return
+            if self.namespace:
+                self.invalidations += 1
+            self.namespace = namespace
+            self.memory.clear()
+
+    def _path(self, namespace: str, key: str) -> str:
+        return os.path.join(self.disk_dir, namespace, key[:2], f"{key}.npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        words = self.memory.get(key)
+        if words is not None or self.disk_dir is None:
+            return words
+        namespace = self.namespace
+        try:
+            mapped = np.load(self._path(namespace, key), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        words = np.array(mapped)
+        with self._lock:
+            self.disk_hits += 1
+            if namespace != self.namespace:
+                return None
+        self.memory.put(key, words)
+        return words
+
+    def put(self, key: str, words: np.ndarray, namespace: Optional[str] = None):
+        """
+        Store in the memory tier and queue the disk write; never waits on the filesystem. `namespace` is the one
+        current when the frame was looked up (default: the current one). If the cache was rebound since, the words
+        may have been computed with the previous weights and are dropped.
+        """
+        with self._lock:
+            if namespace is None:
+                namespace = self.namespace
+            elif namespace != self.namespace:
+                return
+            self.memory.put(key, words)
+        if self._writer is None:
+            return
+        try:
+            self._writes.put_nowait((namespace, key, words))
+        except queue.Full:
+            # The disk tier is an optimization; losing an entry only costs a recomputation later.
+            self.disk_dropped += 1
+
+    def close(self):
+        """ Finish the queued disk writes and stop the writer. """
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def _run_writer(self):
+        while True:
+            item = self._writes.get()
+            if item is None:
+                return
+            self._write(*item)
+
+    def _write(self, namespace: str, key: str, words: np.ndarray):
+        path = self._path(namespace, key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a private name and rename, so readers in other processes never see a partial file.
+        partial = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(partial, "wb") as f:
+                np.save(f, words)
+            os.replace(partial, path)
+            self.disk_writes += 1
+        except OSError as e:
+            print(f"Result cache could not write {path}: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def stats(self) -> dict:
+        stats = self.memory.stats()
+        stats.update(namespace=self.namespace, disk_hits=self.disk_hits, disk_writes=self.disk_writes,
+                     disk_dropped=self.disk_dropped, invalidations=self.invalidations)
+        return stats
@@ -0,0 +1,120 @@
+"""
+File: result_sink.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Optional capture of accelerator outputs off the request path.
+
+A capture is two files: `<path>.bin`, the raw output words of every record appended back to back, and
+`<path>.idx.jsonl`, one JSON line per record with its record number, request id, plane, byte offset, shape, dtype
+and timestamp. The data file can be memory-mapped with `load_capture`.
+
+Record numbers count up across every run appending to the same capture. The request id (a trace id, possibly sent by
+a client) is shared by all frames of a request but need not be unique across requests; `plane` is the position of
+the frame within its request (0, 1 and 2 for the R, G and B planes of an upload), passed along with the frame.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from typing import List, Optional, Tuple
+import numpy as np
+
+# ######################################################################################################################
+
+class ResultSink:
+    """ Destination for convolution results. The base class discards everything (serving mode). """
+
+    def write(self, result, request_id: Optional[str] = None, plane: int = 0):
+        pass
+
+    def close(self):
+        pass
+
+
+NullSink = ResultSink
+
+
+class CaptureSink(ResultSink):
+    """
+    Appends results to a capture file pair from a background writer thread.
+
+    `write` only enqueues a reference to the (owned) result, so the caller never waits on disk. When the queue is
+    full the record is dropped and counted rather than stalling the request.
+
+    Parameters:
+    - path (str): Capture path prefix; `.bin` and `.idx.jsonl` are appended
+    - max_pending (int): Records that may wait for the writer before new ones are dropped
+    """
+
+    def __init__(self, path: str, max_pending: int = 256):
+        self.data_path = path + ".bin"
+        self.index_path = path + ".idx.jsonl"
+        self.dropped = 0
+        self.written = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._run, name="result-sink-writer", daemon=True)
+        self._writer.start()
+
+    def write(self, result, request_id: Optional[str] = None, plane: int = 0):
+        try:
+            self._queue.put_nowait((result, request_id, plane, time.time()))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """ Write everything queued so far and stop the writer. """
+        self._queue.put(None)
+        self._writer.join()
+
+    def _run(self):
+        with open(self.data_path, "ab") as data, open(self.index_path, "a+") as index:
+            offset = data.seek(0, os.SEEK_END)
+            # Continue the record numbers of earlier runs.
+            index.seek(0)
+            record = sum(1 for line in index if line.strip())
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                result, request_id, plane, timestamp = item
+                words = np.ascontiguousarray(getattr(result, "words", result))
+                data.write(words.data)
+                index.write(json.dumps({
+                    "record": record,
+                    "request_id": request_id,
+                    "plane": plane,
+                    "offset": offset,
+                    "shape": list(words.shape),
+                    "dtype": words.dtype.str,
+                    "timestamp": timestamp,
+                }) + "\n")
+                offset += words.nbytes
+                record += 1
+                self.written += 1
+                # Let readers see complete records once the writer is idle.
+                if self._queue.empty():
+                    data.flush()
+                    index.flush()
+
+
+# ######################################################################################################################
+
+def load_capture(path: str) -> Tuple[List[dict], List[np.ndarray]]:
+    """
+    Open a capture written by CaptureSink.
+
+    Returns:
+    - (list of dict, list of np.ndarray): The index records and a read-only memory-mapped array for each record
+    """
+    with open(path + ".idx.jsonl") as f:
+        index = [json.loads(line) for line in f if line.strip()]
+    if not index:
+        return index, []
+    data = np.memmap(path + ".bin", dtype=np.uint8, mode="r")
+    records = [
+        np.ndarray(tuple(entry["shape"]), dtype=np.dtype(entry["dtype"]), buffer=data, offset=entry["offset"])
+        for entry in index
+    ]
+    return index, records
@@ -0,0 +1,328 @@
+"""
+File: serve.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Production serving: N web worker processes for the CPU-bound stages (decode, face detection, preview encoding) and
+exactly one accelerator-owner process that programs the PL and is the only user of the DMA engine and adaptor.
+
+Frames and results cross between the processes through a ring of slots in one multiprocessing.shared_memory block,
+so only small control messages are pickled. A worker takes a free slot, copies the three 480x480 planes into it and
+sends (slot, request id) to the owner. The owner submits views of the slot to its AcceleratorScheduler (staging
+copies them straight into the DMA buffers), writes the output maps back into the same slot and replies. The worker
+copies the outputs out and returns the slot. With no free slot the request is rejected with 503, like a full
+accelerator queue.
+
+The workers share one listening socket, so consecutive requests of a client may reach different workers. Each keeps
+its own request metrics; accelerator metrics come from the owner. Previews delivered by URL are files in a temporary
+directory shared by the workers (CNN_PREVIEW_DIR, see app.py), removed on shutdown unless it was given.
+
+Usage:
+    python serve.py [--workers N] [--host 0.0.0.0] [--port 5000] [--slots 8]
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from typing import Optional
+import numpy as np
+from accelerator_scheduler import QueueFullError
+from convolution_result import ConvolutionResult
+from software_cnn import INPUT_SIZE, get_output_size
+from tracing import NULL_TRACE, Trace
+
+# ######################################################################################################################
+
+FRAMES_PER_SLOT = 3  # The R, G and B planes of one upload.
+
+# Seconds a worker waits for a free slot before rejecting a request, and the Retry-After it suggests then.
+SLOT_WAIT_SECONDS = 1.0
+SLOT_RETRY_AFTER = 1
+
+# Seconds a worker waits for the owner to answer a stats request.
+STATS_TIMEOUT_SECONDS = 2.0
+
+
+class FrameRing:
+    """
+    Slots in one shared memory block. Slot i holds FRAMES_PER_SLOT input frames (uint8) and their output maps
+    (uint32). Created before the processes fork, so every process inherits the same mapping.
+
+    Parameters:
+    - slots (int): Number of slots, i.e. uploads that can be in flight at once
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        side = get_output_size(INPUT_SIZE)
+        self.output_shape = (side, side)
+        input_bytes = slots * FRAMES_PER_SLOT * INPUT_SIZE * INPUT_SIZE
+        output_bytes = slots * FRAMES_PER_SLOT * side * side * 4
+        self.shm = shared_memory.SharedMemory(create=True, size=input_bytes + output_bytes)
+        self._inputs = np.ndarray((slots, FRAMES_PER_SLOT, INPUT_SIZE, INPUT_SIZE), dtype=np.uint8,
+                                  buffer=self.shm.buf)
+        self._outputs = np.ndarray((slots, FRAMES_PER_SLOT, side * side), dtype=np.uint32,
+                                   buffer=self.shm.buf, offset=input_bytes)
+
+    def inputs(self, slot: int) -> np.ndarray:
+        return self._inputs[slot]
+
+    def outputs(self, slot: int) -> np.ndarray:
+        return self._outputs[slot]
+
+    def destroy(self):
+        """ Release the block. Called once, by the parent, after the other processes have exited. """
+        self._inputs = self._outputs = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+# ######################################################################################################################
+
+def run_owner(ring: FrameRing, requests, replies, ready):
+    """
+    Accelerator-owner process: serves ("convolve", worker, request id, slot, count, priority, trace id) and
+    ("stats", worker, request id) messages until it receives None.
+    """
+    from accelerator_service import LocalAccelerator
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    accelerator = LocalAccelerator.from_env().start()
+
+    def watch_ready():
+        if accelerator.wait_warm():
+            ready.set()
+
+    completions = queue.Queue()
+    threading.Thread(target=watch_ready, name="ready-watch", daemon=True).start()
+    threading.Thread(target=_complete, args=(ring, completions, replies), name="slot-completer", daemon=True).start()
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        kind, worker, request_id = message[:3]
+        if kind == "stats":
+            replies[worker].put((request_id, True, accelerator.stats()))
+            continue
+
+        slot, count, priority, trace_id = message[3:]
+        trace = Trace(trace_id)
+        try:
+            futures = accelerator.submit_many(list(ring.inputs(slot)[:count]), priority, trace)
+        except QueueFullError as e:
+            replies[worker].put((request_id, False, ("busy", e.retry_after)))
+            continue
+        except Exception as e:
+            replies[worker].put((request_id, False, ("error", f"{type(e).__name__}: {e}")))
+            continue
+        completions.put((worker, request_id, slot, futures, trace))
+
+    accelerator.close()
+
+
+def _complete(ring: FrameRing, completions: queue.Queue, replies):
+    """ Write finished results into their slots and notify the workers, in submission order. """
+    while True:
+        worker, request_id, slot, futures, trace = completions.get()
+        outputs = ring.outputs(slot)
+        try:
+            shapes = []
+            for i, future in enumerate(futures):
+                result = future.result()
+                outputs[i, :result.words.size] = result.words.ravel()
+                shapes.append(result.shape)
+            reply = (request_id, True, (shapes, trace.stages))
+        except Exception as e:
+            reply = (request_id, False, ("error", f"{type(e).__name__}: {e}"))
+        replies[worker].put(reply)
+
+
+# ######################################################################################################################
+
+class RemoteAccelerator:
+    """
+    A web worker's handle on the owner process, with the interface of accelerator_service.LocalAccelerator.
+
+    Parameters:
+    - ring (FrameRing): Shared slots
+    - free_slots (multiprocessing.Queue): Indices of unused slots, shared by all workers
+    - requests (multiprocessing.Queue): Messages to the owner
+    - replies (multiprocessing.Queue): Messages from the owner to this worker
+    - worker (int): Index of this worker, selecting its reply queue in the owner
+    - ready (multiprocessing.Event): Set by the owner once the accelerator is warmed up
+    - backend (str): Backend the owner was configured with
+    """
+
+    def __init__(self, ring: FrameRing, free_slots, requests, replies, worker: int, ready, backend: str):
+        self._ring = ring
+        self._free_slots = free_slots
+        self._requests = requests
+        self._replies = replies
+        self._worker = worker
+        self._ready = ready
+        self.backend = backend
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = {}
+        threading.Thread(target=self._dispatch, name="owner-replies", daemon=True).start()
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    # The owner only reports readiness after its warm-up, so ready and warm coincide here.
+    is_warm = is_ready
+    wait_warm = wait_ready
+
+    def submit_many(self, frames, priority: int = 0, trace: Trace = NULL_TRACE):
+        """ Hand up to FRAMES_PER_SLOT 480x480 frames to the owner. Raises QueueFullError if no slot frees up. """
+        frames = list(frames)
+        if len(frames) > FRAMES_PER_SLOT or any(frame.shape != (INPUT_SIZE, INPUT_SIZE) for frame in frames):
+            raise ValueError(f"At most {FRAMES_PER_SLOT} frames of {INPUT_SIZE}x{INPUT_SIZE} per request")
+        try:
+            slot = self._free_slots.get(timeout=SLOT_WAIT_SECONDS)
+        except queue.Empty:
+            raise QueueFullError(SLOT_RETRY_AFTER)
+
+        with trace.stage("handoff"):
+            inputs = self._ring.inputs(slot)
+            for i, frame in enumerate(frames):
+                np.copyto(inputs[i], frame)
+        futures = [Future() for _ in frames]
+        request_id = next(self._ids)
+        with self._lock:
+            self._pending[request_id] = (futures, slot, trace)
+        self._requests.put(("convolve", self._worker, request_id, slot, len(frames), priority, trace.trace_id))
+        return futures
+
+    def stats(self) -> dict:
+        """ LocalAccelerator.stats() of the owner. """
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            self._pending[request_id] = future
+        self._requests.put(("stats", self._worker, request_id))
+        try:
+            return future.result(STATS_TIMEOUT_SECONDS)
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def _dispatch(self):
+        while True:
+            request_id, ok, payload = self._replies.get()
+            with self._lock:
+                entry = self._pending.pop(request_id, None)
+            if entry is None:
+                continue
+            if isinstance(entry, Future):
+                entry.set_result(payload)
+                continue
+
+            futures, slot, trace = entry
+            try:
+                if ok:
+                    shapes, stages = payload
+                    for stage, seconds in stages.items():
+                        trace.add(stage, seconds)
+                    outputs = self._ring.outputs(slot)
+                    for i, (future, shape) in enumerate(zip(futures, shapes)):
+                        future.set_result(ConvolutionResult.from_buffer(outputs[i], shape, trace.trace_id))
+                else:
+                    kind, detail = payload
+                    error = QueueFullError(detail) if kind == "busy" else RuntimeError(detail)
+                    for future in futures:
+                        future.set_exception(error)
+            finally:
+                # Results are copied out above, so the slot can be reused.
+                self._free_slots.put(slot)
+
+
+def run_worker(worker: int, listener: socket.socket, ring: FrameRing, free_slots, requests, replies, ready,
+               backend: str):
+    """ Web worker process: the Flask app served from the shared listening socket. """
+    from werkzeug.serving import make_server
+    import app as web
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    web.use_accelerator(RemoteAccelerator(ring, free_slots, requests, replies, worker, ready, backend))
+    web.start_warm_up()
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, web.app, threaded=True, fd=listener.fileno())
+    print(f"Web worker {worker} (pid {os.getpid()}) serving on {host}:{port}")
+    server.serve_forever()
+
+
+# ######################################################################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app with several web workers and one accelerator owner.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Web worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--slots", type=int, default=8, help="Shared-memory slots, i.e. uploads in flight")
+    args = parser.parse_args()
+
+    # fork: the children inherit the shared memory mapping and the listening socket.
+    context = multiprocessing.get_context("fork")
+    ring = FrameRing(args.slots)
+    free_slots = context.Queue()
+    for slot in range(args.slots):
+        free_slots.put(slot)
+    requests = context.Queue()
+    replies = [context.Queue() for _ in range(args.workers)]
+    ready = context.Event()
+    backend = os.environ.get("CNN_BACKEND", "fpga")
+    # Before the fork, so every worker's app.py picks the same directory.
+    preview_dir = None
+    if not os.environ.get("CNN_PREVIEW_DIR"):
+        preview_dir = os.environ["CNN_PREVIEW_DIR"] = tempfile.mkdtemp(prefix="cnn-previews-")
+
+    listener = socket.create_server((args.host, args.port), backlog=128)
+    owner = context.Process(target=run_owner, args=(ring, requests, replies, ready), name="accelerator-owner")
+    owner.start()
+    workers = [context.Process(target=run_worker, name=f"web-worker-{i}",
+                               args=(i, listener, ring, free_slots, requests, replies[i], ready, backend))
+               for i in range(args.workers)]
+    for process in workers:
+        process.start()
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    try:
+        # Any child exiting brings the whole server down, so a supervisor can restart it cleanly.
+        while not stopping.wait(1.0):
+            if not owner.is_alive() or not all(process.is_alive() for process in workers):
+                print("A serving process exited, shutting down.")
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join(5)
+        requests.put(None)
+        owner.join(10)
+        if owner.is_alive():
+            owner.terminate()
+        listener.close()
+        ring.destroy()
+        if preview_dir is not None:
+            shutil.rmtree(preview_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+File: software_cnn.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Bit-exact NumPy model of SystemVerilog/multilayer_CNN.sv, used as a CPU backend when the FPGA is unavailable.
+"""
+
+from typing import Sequence
+import numpy as np
+
+# ######################################################################################################################
+
+# Synthesis parameters of multilayer_cnn.
+NUM_LAYERS = 3
+DATA_WIDTH = 20
+Q = 11
+INPUT_SIZE = 480
+PADDING = 1
+KERNEL_DIM = 3
+POOLER_DIM = 2
+
+Q_MAX = (1 << (DATA_WIDTH - 1)) - 1
+Q_MIN = -(1 << (DATA_WIDTH - 1))
+
+# kernel_input from multilayer_CNN.sv, first line is the most significant (layer 2), last line is layer 0.
+KERNEL_INPUT = (
+    "FFFAF_FFF12_FFDFE_00136_00097_FFFDA_00294_0019A_000BE",
+    "FFFAF_FFEF2_FFD99_0011F_00070_FFF43_0027B_0017B_0002E",
+    "FFFE5_FFF50_FFE41_00117_00090_FFFB3_00250_00170_0007B",
+)
+
+# ######################################################################################################################
+
+def get_layer_input_size(layer_index, n_in, P, K, p):
+    """
+    Calculate the input dimension for a given CNN layer index.
+
+    Parameters:
+    - layer_index (int): Index of the CNN layer (0-based)
+    - n_in (int): Original input size
+    - P (int): Padding per layer
+    - K (int): Kernel size per layer
+    - p (int): Pooling window size per layer
+
+    Returns:
+    - int: Size of the input map to the specified layer
+    """
+    result = n_in
+    for _ in range(layer_index):
+        result = (result + 2 * P - K + 1) // p
+    return result
+
+
+def get_output_size(n_in: int) -> int:
+    """ Dimension of the final pooled map for an n_in input, i.e. the input size of layer NUM_LAYERS. """
+    return get_layer_input_size(NUM_LAYERS, n_in, PADDING, KERNEL_DIM, POOLER_DIM)
+
+
+def to_signed(words: np.ndarray, width: int = DATA_WIDTH) -> np.ndarray:
+    """ Interpret the low `width` bits of each word as two's complement. """
+    words = np.asarray(words).astype(np.int64) & ((1 << width) - 1)
+    return words - ((words >> (width - 1)) << width)
+
+
+def unpack_kernel_weights(kernel_input: Sequence[str] = KERNEL_INPUT) -> np.ndarray:
+    """
+    Unpack the kernel_input parameter into signed weights of shape (NUM_LAYERS, K, K).
+
+    The convolver assigns weight[j] = kernel_input[20*j +: 20], so the last hex group of a line is weight 0, and
+    weight[r*K + c] multiplies window row r, column c (the top-left tap sees the oldest pixel of the stream).
+    """
+    layers = []
+    for line in reversed(kernel_input):
+        groups = [int(group, 16) for group in line.split("_")]
+        layers.append(to_signed(np.array(groups[::-1], dtype=np.int64)).reshape(KERNEL_DIM, KERNEL_DIM))
+    return np.stack(layers)
+
+
+KERNEL_WEIGHTS = unpack_kernel_weights()
+
+# ######################################################################################################################
+
+def int_to_q(pixels: np.ndarray) -> np.ndarray:
+    """ intToQ: {1'b0, a[7:0], Q'b0}. """
+    return (np.asarray(pixels).astype(np.int64) & 0xFF) << Q
+
+
+def qmult(a: np.ndarray, b) -> np.ndarray:
+    """ qmult: full-precision product, saturated on the same bit test as the RTL, else bits [Q+N-1:Q]. """
+    full = a * b
+    result = to_signed(full >> Q)
+    # The RTL only inspects bits [2N-2:N+Q], so |full| must reach 2^(N+Q) before it saturates.
+    limit = 1 << (DATA_WIDTH + Q)
+    result = np.where(full >= limit, Q_MAX, result)
+    return np.where(full < -limit, Q_MIN, result)
+
+
+def qadd(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    qadd: two's complement add that wraps on signed overflow. The RTL's saturation test never fires: sum_ext is
+    computed at N+1 bits from sign-extended operands, so its top bit always matches the operands' common sign.
+    """
+    return to_signed(a + b)
+
+
+def zero_pad(maps: np.ndarray, P: int = PADDING) -> np.ndarray:
+    """ zero_padder: P zeros on every side of each map. """
+    return np.pad(maps, ((0, 0), (P, P), (P, P)))
+
+
+def convolve(padded: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    convolver: valid KxK correlation of padded (batch, n', n') maps.
+
+    Each tap is applied to the whole batch at once, in the order of the MAC chain, so the wrapping partial sums
+    match the hardware pipeline.
+    """
+    K = weights.shape[0]
+    out_h = padded.shape[1] - K + 1
+    out_w = padded.shape[2] - K + 1
+    acc = np.zeros((padded.shape[0], out_h, out_w), dtype=np.int64)
+    for r in range(K):
+        for c in range(K):
+            acc = qadd(qmult(padded[:, r:r + out_h, c:c + out_w], int(weights[r, c])), acc)
+    return acc
+
+
+def relu(maps: np.ndarray) -> np.ndarray:
+    return np.maximum(maps, 0)
+
+
+def pool(maps: np.ndarray, p: int = POOLER_DIM) -> np.ndarray:
+    """ pooler: non-overlapping pxp max, trailing rows/columns that do not fill a window are dropped. """
+    batch, h, w = maps.shape
+    h, w = h // p, w // p
+    windows = maps[:, :h * p, :w * p].reshape(batch, h, p, w, p)
+    return windows.max(axis=(2, 4))
+
+# ######################################################################################################################
+
+class SoftwareCNN:
+    """
+    CPU implementation of multilayer_cnn that produces the same 20-bit output words as the accelerator.
+
+    Parameters:
+    - kernel_weights (np.ndarray): Signed weights of shape (layers, K, K); defaults to the synthesized kernel_input
+    """
+
+    def __init__(self, kernel_weights: np.ndarray = KERNEL_WEIGHTS):
+        self.kernel_weights = np.asarray(kernel_weights, dtype=np.int64)
+
+    def forward(self, images: np.ndarray) -> np.ndarray:
+        """
+        Run all layers on one (h, w) image or a (batch, h, w) stack of 8-bit images.
+
+        Returns:
+        - np.ndarray: Signed Q9.11 values (int64) with the same leading shape as the input
+        """
+        images = np.asarray(images)
+        single = images.ndim == 2
+        maps = int_to_q(images[np.newaxis] if single else images)
+        for weights in self.kernel_weights:
+            maps = pool(relu(convolve(zero_pad(maps), weights)))
+        return maps[0] if single else maps
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        """ Same as forward(), packed into uint32 words the way the DMA delivers them. """
+        return (self.forward(images) & ((1 << DATA_WIDTH) - 1)).astype(np.uint32)
@@ -0,0 +1,13 @@
+"""
+File: tests/conftest.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+The tests import the flat modules of the repository root and run the accelerator paths on pynq_sim.
+"""
+
+import os
+import sys
+
+os.environ.setdefault("PYNQ_SIM", "1")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
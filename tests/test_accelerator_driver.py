@@ -0,0 +1,33 @@
+"""
+File: tests/test_accelerator_driver.py
+Authors: B. Ko, C. Okoye, S. Xiao
+"""
+
+import os
+from conftest import ROOT
+from accelerator_driver import AcceleratorDriver
+from convolver_dma import Application
+
+# ######################################################################################################################
+
+def test_config_blocks_cover_every_config_register():
+    covered = {(first + i) << 2 for first, count in AcceleratorDriver.CONFIG_REGISTER_BLOCKS for i in range(count)}
+    assert AcceleratorDriver.CONFIG_REG_ADDRS <= covered
+
+
+def test_reconfiguring_with_the_same_config_writes_no_config_registers():
+    application = Application(os.path.join(ROOT, "full_cnn.bit"))
+    try:
+        application.ensure_ready()
+        acc = application.acc
+        config = [(offset, acc.read(offset)) for offset in sorted(AcceleratorDriver.CONFIG_REG_ADDRS)]
+        assert acc.apply_config(config) == 0
+
+        # Reconfiguration after a fault: the soft reset and the commands are issued, the unchanged config is not.
+        before = acc.mmio_stats()
+        application.reset()
+        after = acc.mmio_stats()
+        assert after["writes"] - before["writes"] == 4  # CTRL set and clear, two CMD writes
+        assert after["skipped_writes"] - before["skipped_writes"] == 5
+    finally:
+        application.close()
@@ -0,0 +1,30 @@
+"""
+File: tests/test_app.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Readiness of the Flask app when it is hosted without `python app.py` or serve.py (flask run, gunicorn, ...).
+"""
+
+import time
+import pytest
+
+# ######################################################################################################################
+
+@pytest.fixture
+def web(monkeypatch):
+    monkeypatch.setenv("CNN_BACKEND", "software")
+    import app
+    yield app
+    if app.accelerator is not None:
+        app.accelerator.close()
+
+
+def test_readyz_becomes_ready_without_an_explicit_warm_up(web):
+    client = web.app.test_client()
+    deadline = time.monotonic() + 30
+    status = client.get("/readyz").status_code
+    while status != 200 and time.monotonic() < deadline:
+        time.sleep(0.05)
+        status = client.get("/readyz").status_code
+    assert status == 200
+    assert web.accelerator.is_warm
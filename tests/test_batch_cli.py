@@ -0,0 +1,52 @@
+"""
+File: tests/test_batch_cli.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Failure handling and resuming of batch_cli.run.
+"""
+
+import os
+import cv2
+import numpy as np
+from conftest import ROOT
+import batch_cli
+from batch_cli import BatchOutput, run
+from convolver_dma import Application
+
+# ######################################################################################################################
+
+def _die_on_second(row, path, fallback_center):
+    """ Worker task that kills its process on row 1, like an out-of-memory kill. """
+    if row == 1:
+        os._exit(1)
+    return batch_cli.prepare(row, path, fallback_center)
+
+
+def _images(directory, count):
+    paths = []
+    for index in range(count):
+        path = os.path.join(str(directory), f"{index}.png")
+        cv2.imwrite(path, np.random.default_rng(index).integers(0, 256, (64, 80, 3), dtype=np.uint8))
+        paths.append(path)
+    return paths
+
+
+def test_broken_pool_fails_the_rest_and_resume_retries_them(tmp_path, monkeypatch):
+    paths = _images(tmp_path, 6)
+    application = Application(os.path.join(ROOT, "full_cnn.bit"), backend="software")
+    try:
+        monkeypatch.setattr(batch_cli, "prepare", _die_on_second)
+        output = BatchOutput(str(tmp_path / "out"), paths)
+        summary = run(application, output, workers=1, queue_size=2, fallback_center=True)
+        assert summary["images"] == 6
+        assert summary["error"] >= 1
+
+        monkeypatch.undo()
+        output = BatchOutput(str(tmp_path / "out"), paths)
+        assert len(output.done) == 6 - summary["error"]
+        summary = run(application, output, workers=1, queue_size=2, fallback_center=True)
+        assert summary["error"] == 0
+    finally:
+        application.close()
+
+    assert len(BatchOutput(str(tmp_path / "out"), paths).done) == 6
@@ -0,0 +1,40 @@
+"""
+File: tests/test_preview.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+PreviewDirectory as shared by serve.py's web workers.
+"""
+
+import os
+import numpy as np
+from preview import PreviewDirectory
+
+
+def test_previews_are_shared_between_instances(tmp_path):
+    writer = PreviewDirectory(str(tmp_path), 1 << 20)
+    reader = PreviewDirectory(str(tmp_path), 1 << 20)
+    data = np.frombuffer(b"\x89PNG preview bytes", dtype=np.uint8)
+    writer.put("0123abcd/combined", (data, "image/png"))
+    stored, mime = reader.get("0123abcd/combined")
+    assert mime == "image/png"
+    assert stored.tobytes() == data.tobytes()
+    assert reader.get("0123abcd/red") is None
+
+
+def test_invalid_keys_never_leave_the_directory(tmp_path):
+    store = PreviewDirectory(str(tmp_path / "previews"), 1 << 20)
+    (tmp_path / "secret").write_bytes(b"text/plain\nsecret")
+    assert store.get("../secret") is None
+    assert store.get("a/../../secret") is None
+
+
+def test_prune_keeps_the_size_budget(tmp_path):
+    store = PreviewDirectory(str(tmp_path), 250, prune_every=1000)
+    data = np.zeros(100, dtype=np.uint8)
+    for index in range(5):
+        store.put(f"id{index}/image", (data, "image/png"))
+        path = os.path.join(str(tmp_path), f"id{index}-image")
+        os.utime(path, (index + 1e9, index + 1e9))
+    store.max_age = float("inf")
+    store.prune()
+    assert sorted(os.listdir(str(tmp_path))) == ["id3-image", "id4-image"]
@@ -0,0 +1,47 @@
+"""
+File: tests/test_result_cache.py
+Authors: B. Ko, C. Okoye, S. Xiao
+"""
+
+import os
+import threading
+import numpy as np
+from conftest import ROOT
+from convolver_dma import Application
+from result_cache import ResultCache
+
+# ######################################################################################################################
+
+def test_disk_writes_happen_off_the_calling_thread(tmp_path, monkeypatch):
+    writers = []
+    cache = ResultCache(1 << 20, str(tmp_path))
+    original = cache._write
+    monkeypatch.setattr(cache, "_write", lambda *args: (writers.append(threading.current_thread()), original(*args)))
+    cache.bind("weights")
+    words = np.arange(3600, dtype=np.uint32).reshape(60, 60)
+    cache.put("ab" * 16, words)
+    cache.close()
+
+    assert writers and threading.current_thread() not in writers
+    reopened = ResultCache(1 << 20, str(tmp_path))
+    reopened.bind("weights")
+    np.testing.assert_array_equal(reopened.get("ab" * 16), words)
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+
+
+def test_results_looked_up_before_a_weight_change_are_not_cached(tmp_path):
+    application = Application(os.path.join(ROOT, "full_cnn.bit"), backend="software",
+                              result_cache=ResultCache(1 << 20, str(tmp_path)))
+    try:
+        frame = np.random.default_rng(3).integers(0, 256, (16, 16), dtype=np.uint8)
+        key, cached = application.lookup_cached(frame)
+        assert cached is None
+        result = application.convolve_batch(frame[np.newaxis])[0]
+        # The weights change while the frame is in the accelerator.
+        application.set_kernel_scalar(application.kernel_scalar + 1)
+        application.store_cached(key, result)
+        assert application.lookup_cached(frame)[1] is None
+    finally:
+        application.close()
+    assert os.listdir(str(tmp_path)) == []
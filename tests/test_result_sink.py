@@ -0,0 +1,71 @@
+"""
+File: tests/test_result_sink.py
+Authors: B. Ko, C. Okoye, S. Xiao
+"""
+
+import os
+import numpy as np
+from conftest import ROOT
+from accelerator_scheduler import AcceleratorScheduler
+from convolver_dma import Application
+from result_cache import ResultCache
+from result_sink import CaptureSink, load_capture
+from tracing import Trace
+
+# ######################################################################################################################
+
+def test_records_are_numbered_across_runs_and_planes_within_a_request(tmp_path):
+    path = str(tmp_path / "capture")
+    for run in range(2):
+        sink = CaptureSink(path)
+        for plane in range(3):
+            sink.write(np.full((2, 2), 10 * run + plane, dtype=np.uint32), "client/trace", plane)
+        sink.close()
+
+    index, records = load_capture(path)
+    assert [entry["record"] for entry in index] == list(range(6))
+    assert [entry["plane"] for entry in index] == [0, 1, 2, 0, 1, 2]
+    assert [int(words[0, 0]) for words in records] == [0, 1, 2, 10, 11, 12]
+
+
+def test_planes_of_requests_sharing_an_id_start_at_zero(tmp_path):
+    path = str(tmp_path / "capture")
+    application = Application(os.path.join(ROOT, "full_cnn.bit"), backend="software", result_sink=CaptureSink(path))
+    scheduler = AcceleratorScheduler(application)
+    scheduler.start()
+    rng = np.random.default_rng(9)
+    try:
+        for _ in range(2):
+            planes = rng.integers(0, 256, (3, 16, 16), dtype=np.uint8)
+            for future in scheduler.submit_many(list(planes), trace=Trace("0")):
+                future.result(10)
+    finally:
+        scheduler.stop(timeout=5)
+        application.close()
+
+    index, _ = load_capture(path)
+    assert [entry["request_id"] for entry in index] == ["0"] * 6
+    assert [entry["plane"] for entry in index] == [0, 1, 2, 0, 1, 2]
+
+
+def test_result_cache_hits_are_captured(tmp_path):
+    path = str(tmp_path / "capture")
+    application = Application(os.path.join(ROOT, "full_cnn.bit"), backend="software", result_sink=CaptureSink(path),
+                              result_cache=ResultCache(1 << 20))
+    scheduler = AcceleratorScheduler(application)
+    scheduler.start()
+    planes = list(np.random.default_rng(10).integers(0, 256, (3, 16, 16), dtype=np.uint8))
+    try:
+        for request in ("first", "repeat"):
+            for future in scheduler.submit_many(planes, trace=Trace(request)):
+                future.result(10)
+    finally:
+        scheduler.stop(timeout=5)
+        application.close()
+
+    assert scheduler.stats()["cache_hits"] == 3
+    index, records = load_capture(path)
+    assert [(entry["request_id"], entry["plane"]) for entry in index] == [
+        ("first", 0), ("first", 1), ("first", 2), ("repeat", 0), ("repeat", 1), ("repeat", 2)]
+    for plane in range(3):
+        np.testing.assert_array_equal(records[plane], records[3 + plane])
@@ -0,0 +1,111 @@
+"""
+File: tests/test_software_cnn.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+SoftwareCNN against a per-pixel transcription of the RTL (qmult.sv, qadd.sv, intToQ.sv, the convolver MAC chain,
+relu.sv and pooler.sv) on small images, and against the accelerator path on the simulated overlay on a full frame.
+"""
+
+import os
+import numpy as np
+import pytest
+from conftest import ROOT
+from software_cnn import DATA_WIDTH as N, INPUT_SIZE, KERNEL_WEIGHTS, Q, Q_MAX, Q_MIN, SoftwareCNN, qadd
+
+# ######################################################################################################################
+
+def _bits(value: int, hi: int, lo: int) -> int:
+    return (value >> lo) & ((1 << (hi - lo + 1)) - 1)
+
+
+def _signed(value: int, width: int) -> int:
+    value &= (1 << width) - 1
+    return value - (1 << width) if value >> (width - 1) else value
+
+
+def _qmult(a: int, b: int) -> int:
+    full = (a * b) & ((1 << 2 * N) - 1)
+    if _bits(full, 2 * N - 1, 2 * N - 1) == 0 and _bits(full, 2 * N - 2, N + Q) != 0:
+        return (1 << (N - 1)) - 1
+    if _bits(full, 2 * N - 1, 2 * N - 1) == 1 and _bits(full, 2 * N - 2, N + Q) != (1 << (N - Q - 1)) - 1:
+        return -(1 << (N - 1))
+    return _signed(_bits(full, Q + N - 1, Q), N)
+
+
+def _qadd(a: int, b: int) -> int:
+    sum_ext = (a + b) & ((1 << (N + 1)) - 1)
+    if (a < 0) == (b < 0) and _bits(sum_ext, N, N) != (a < 0):
+        return -(1 << (N - 1)) if a < 0 else (1 << (N - 1)) - 1
+    return _signed(sum_ext, N)
+
+
+def _layer(maps: list, weights: np.ndarray) -> list:
+    """ zero_padder, convolver (MAC i adds weight[i] times window row i // 3, column i % 3), relu and pooler. """
+    h, w = len(maps), len(maps[0])
+    padded = [[0] * (w + 2)] + [[0] + row + [0] for row in maps] + [[0] * (w + 2)]
+    conv = [[0] * w for _ in range(h)]
+    for y in range(h):
+        for x in range(w):
+            acc = 0
+            for i in range(9):
+                acc = _qadd(_qmult(padded[y + i // 3][x + i % 3], int(weights[i // 3, i % 3])), acc)
+            conv[y][x] = max(acc, 0)
+    return [[max(conv[2 * y + dy][2 * x + dx] for dy in (0, 1) for dx in (0, 1)) for x in range(w // 2)]
+            for y in range(h // 2)]
+
+
+def reference(image: np.ndarray, kernel_weights: np.ndarray = KERNEL_WEIGHTS) -> np.ndarray:
+    maps = [[int(pixel) << Q for pixel in row] for row in image]
+    for weights in kernel_weights:
+        maps = _layer(maps, weights)
+    return np.array(maps, dtype=np.int64)
+
+
+# ######################################################################################################################
+
+def _images():
+    rng = np.random.default_rng(462)
+    yield "random", rng.integers(0, 256, (24, 24), dtype=np.uint8)
+    yield "saturated", np.full((24, 24), 255, dtype=np.uint8)
+    yield "checkerboard", (np.indices((24, 24)).sum(axis=0) % 2 * 255).astype(np.uint8)
+    yield "odd_size", rng.integers(0, 256, (21, 30), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("name,image", list(_images()))
+def test_matches_rtl_reference(name, image):
+    np.testing.assert_array_equal(SoftwareCNN().forward(image), reference(image))
+
+
+def test_qadd_wraps_like_the_rtl():
+    a = np.array([Q_MAX, Q_MIN, Q_MAX, -5])
+    b = np.array([1, -1, Q_MAX, 3])
+    expected = [_qadd(int(x), int(y)) for x, y in zip(a, b)]
+    assert expected == [Q_MIN, Q_MAX, -2, -2]
+    np.testing.assert_array_equal(qadd(a, b), expected)
+
+
+def test_matches_rtl_reference_when_the_accumulator_overflows():
+    # Nine taps of weight 1.0 on bright pixels sum past Q_MAX in the first layer.
+    weights = np.array(KERNEL_WEIGHTS)
+    weights[0] = 1 << Q
+    image = np.full((8, 8), 250, dtype=np.uint8)
+    image[::3] = 40
+    np.testing.assert_array_equal(SoftwareCNN(weights).forward(image), reference(image, weights))
+
+
+def test_batch_matches_single_images():
+    images = np.random.default_rng(1).integers(0, 256, (3, 32, 32), dtype=np.uint8)
+    model = SoftwareCNN()
+    np.testing.assert_array_equal(model(images), np.stack([model(image) for image in images]))
+
+
+def test_matches_simulated_accelerator():
+    from convolver_dma import Application
+
+    image = np.random.default_rng(2025).integers(0, 256, (INPUT_SIZE, INPUT_SIZE), dtype=np.uint8)
+    application = Application(os.path.join(ROOT, "full_cnn.bit"), backend="fpga")
+    try:
+        result = application.convolve_image(image)
+    finally:
+        application.close()
+    np.testing.assert_array_equal(result.words, SoftwareCNN()(image))
@@ -0,0 +1,53 @@
+"""
+File: tests/test_tiling.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Tiled convolution against SoftwareCNN on the whole image, on sizes that are and are not multiples of the stride.
+"""
+
+import os
+import numpy as np
+import pytest
+from conftest import ROOT
+from software_cnn import SoftwareCNN
+from tiling import STRIDE, TilePlan
+
+# ######################################################################################################################
+
+SIZES = [(480, 480), (968, 520), (481, 480), (480, 487), (500, 500), (700, 1000), (487, 1231)]
+
+
+def _image(height, width):
+    return np.random.default_rng(height * width).integers(0, 256, (height, width), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("height, width", SIZES)
+def test_tiles_match_whole_image(height, width):
+    model = SoftwareCNN()
+    image = _image(height, width)
+    plan = TilePlan(height, width)
+    stitched = plan.patch_edges(plan.stitch([model(tile) for tile in plan.tiles(image)]), image, model)
+    expected = model(image)
+    assert stitched.shape == expected.shape == (height // STRIDE, width // STRIDE)
+    np.testing.assert_array_equal(stitched, expected)
+
+
+def test_tiles_alone_miss_only_the_ragged_edges():
+    model = SoftwareCNN()
+    image = _image(500, 700)
+    plan = TilePlan(*image.shape)
+    stitched = plan.stitch([model(tile) for tile in plan.tiles(image)])
+    expected = model(image)
+    np.testing.assert_array_equal(stitched[:-1, :-1], expected[:-1, :-1])
+    assert (stitched[-1] != expected[-1]).any() and (stitched[:, -1] != expected[:, -1]).any()
+
+
+def test_convolve_tiled_on_simulator():
+    from convolver_dma import Application
+    image = _image(500, 700)
+    application = Application(os.path.join(ROOT, "full_cnn.bit"), backend="fpga")
+    try:
+        result = application.convolve_tiled(image)
+    finally:
+        application.close()
+    np.testing.assert_array_equal(result.words, SoftwareCNN()(image))
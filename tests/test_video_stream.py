@@ -0,0 +1,53 @@
+"""
+File: tests/test_video_stream.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+How often FaceTracker runs the cascade.
+"""
+
+import numpy as np
+from video_stream import FaceTracker
+
+
+class _Detector:
+    def __init__(self, faces):
+        self.faces = faces
+        self.calls = 0
+
+    def detect(self, bgr_img):
+        self.calls += 1
+        return self.faces
+
+
+def _frames(count):
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    return [frame] * count
+
+
+def test_no_face_is_detected_only_every_k_frames():
+    detector = _Detector([])
+    tracker = FaceTracker(detector, detect_every=5)
+    sources = [tracker.update(frame)[1] for frame in _frames(20)]
+    assert detector.calls == 4
+    assert sources[:6] == ["detect", "skip", "skip", "skip", "skip", "detect"]
+    assert tracker.detect_ratio == 0.2
+
+
+def test_visible_face_is_tracked_between_detections():
+    detector = _Detector([(40, 30, 50, 50)])
+    tracker = FaceTracker(detector, detect_every=5)
+    results = [tracker.update(frame) for frame in _frames(10)]
+    assert detector.calls == 2
+    assert [how for _, how in results[:5]] == ["detect", "track", "track", "track", "track"]
+    assert all(box == (40, 30, 50, 50) for box, _ in results)
+    assert tracker.detect_ratio == 0.2
+
+
+def test_detect_every_one_detects_every_frame():
+    detector = _Detector([])
+    tracker = FaceTracker(detector, detect_every=1)
+    for frame in _frames(6):
+        tracker.update(frame)
+    assert detector.calls == 6
+    assert tracker.detect_ratio == 1.0
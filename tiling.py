@@ -0,0 +1,164 @@
+"""
+File: tiling.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Convolution of images larger than the synthesized INPUT_SIZE x INPUT_SIZE frame, and of non-square ones, as a
+grid of overlapping tiles whose output maps are stitched into one map.
+
+Every layer zero-pads its input, so an output near a tile edge sees zeros where the whole image has pixels. Those
+outputs are discarded on interior edges: the halo is the number of outputs whose receptive field, traced back
+through each layer's map size (get_layer_input_size), leaves the tile. For three 3x3 conv / 2x2 pool layers on 480
+tiles that is 1 output (8 input pixels) per interior edge, so tiles start every 464 pixels and keep 58 of their 60
+outputs per dimension. Tile offsets are multiples of the total pooling stride, so the pooling windows of every tile
+line up with those of the whole image.
+
+When a dimension is a multiple of the stride, the last tile ends on the image edge and the stitched map is bit-exact
+with SoftwareCNN on the whole image. Otherwise the last tile ends at the last multiple of the stride, and the
+trailing outputs along that dimension (the trailing halo) depend on the remaining rows or columns, which no aligned
+tile can contain. patch_edges() recomputes them with the software model on a strip along that edge, a few strides
+deep and as long as the image, whose far edges are the image's own. Images smaller than a tile in either dimension
+are rejected; resize them to a tile instead.
+
+Usage:
+    plan = TilePlan(*image.shape)
+    outputs = application.convolve_stream(plan.tiles(image))
+    words = plan.patch_edges(plan.stitch([result.words for result in outputs]), image, SoftwareCNN())
+"""
+
+from typing import List, Sequence, Tuple
+import numpy as np
+from software_cnn import INPUT_SIZE, KERNEL_DIM, NUM_LAYERS, PADDING, POOLER_DIM, SoftwareCNN, get_layer_input_size
+
+# ######################################################################################################################
+
+STRIDE = POOLER_DIM ** NUM_LAYERS  # Input pixels per output value.
+
+
+def receptive_range(lo: int, hi: int, layer_index: int) -> Tuple[int, int]:
+    """
+    Range of positions in the input map of layer `layer_index` that the outputs lo..hi (inclusive) of the last
+    layer depend on. A conv layer widens the range by its padding on each side, a pooling layer scales it.
+    """
+    for _ in range(NUM_LAYERS - layer_index):
+        lo, hi = lo * POOLER_DIM, hi * POOLER_DIM + POOLER_DIM - 1
+        lo, hi = lo - PADDING, hi + KERNEL_DIM - 1 - PADDING
+    return lo, hi
+
+
+def halo(tile_size: int = INPUT_SIZE) -> Tuple[int, int]:
+    """
+    Outputs to discard at an interior leading and trailing edge of a tile: those depending on a position outside
+    the tile's map (i.e. on the tile's zero padding) at some layer.
+
+    Returns:
+    - tuple: (leading, trailing) output counts
+    """
+    out_size = get_layer_input_size(NUM_LAYERS, tile_size, PADDING, KERNEL_DIM, POOLER_DIM)
+    sizes = [get_layer_input_size(layer, tile_size, PADDING, KERNEL_DIM, POOLER_DIM) for layer in range(NUM_LAYERS)]
+
+    def exact(j):
+        ranges = [receptive_range(j, j, layer) for layer in range(NUM_LAYERS)]
+        return all(lo >= 0 and hi < size for (lo, hi), size in zip(ranges, sizes))
+
+    leading = next(j for j in range(out_size) if exact(j))
+    trailing = next(k for k in range(out_size) if exact(out_size - 1 - k))
+    return leading, trailing
+
+
+def _axis_plan(length: int, tile_size: int, lead: int, trail: int):
+    """
+    Tile offsets along one axis, and for every output position of the whole map the tile and the tile-local
+    output it is taken from.
+    """
+    tile_out = tile_size // STRIDE
+    out_length = length // STRIDE
+    step = (tile_out - lead - trail) * STRIDE
+    last = out_length * STRIDE - tile_size
+    starts = list(range(0, last, step)) + [last]
+
+    tile_index = np.empty(out_length, dtype=np.intp)
+    local = np.empty(out_length, dtype=np.intp)
+    covered = 0
+    for i, start in enumerate(starts):
+        offset = start // STRIDE
+        first = 0 if start == 0 else lead
+        end = tile_out if start == last else tile_out - trail
+        # Overlap with the previous tile (only the last tile, which is aligned to the end) keeps the earlier values.
+        begin = max(offset + first, covered)
+        tile_index[begin:offset + end] = i
+        local[begin:offset + end] = np.arange(begin - offset, end)
+        covered = offset + end
+    return starts, tile_index, local
+
+
+class TilePlan:
+    """
+    Tiling of an (height, width) image into tile_size x tile_size frames.
+
+    Parameters:
+    - height (int): Image height in pixels, at least tile_size
+    - width (int): Image width in pixels, at least tile_size
+    - tile_size (int): Frame size the fabric was synthesized for
+    """
+
+    def __init__(self, height: int, width: int, tile_size: int = INPUT_SIZE):
+        if height < tile_size or width < tile_size:
+            raise ValueError(f"A {height}x{width} image is smaller than a {tile_size}x{tile_size} tile")
+        if tile_size % STRIDE:
+            raise ValueError(f"Tile size must be a multiple of {STRIDE}")
+        lead, trail = halo(tile_size)
+        self.tile_size = tile_size
+        self.output_shape = (height // STRIDE, width // STRIDE)
+        # First input row / column of the edge strips recomputed by patch_edges(); None where the tiles are exact.
+        self.trail = trail
+        self.edge_starts = tuple((out_length - lead - trail) * STRIDE if length % STRIDE else None
+                                 for length, out_length in zip((height, width), self.output_shape))
+        self.row_starts, row_tile, row_local = _axis_plan(height, tile_size, lead, trail)
+        self.col_starts, col_tile, col_local = _axis_plan(width, tile_size, lead, trail)
+        # Gather indices of the stitched map into the (rows, cols, tile_out, tile_out) stack of tile outputs.
+        cols = len(self.col_starts)
+        self._tile = (row_tile[:, None] * cols + col_tile[None, :])
+        self._local_row = row_local[:, None]
+        self._local_col = col_local[None, :]
+
+    def __len__(self) -> int:
+        return len(self.row_starts) * len(self.col_starts)
+
+    def tiles(self, image: np.ndarray) -> List[np.ndarray]:
+        """ Tile views of a 2D image (no copies), row by row. """
+        size = self.tile_size
+        return [image[y:y + size, x:x + size] for y in self.row_starts for x in self.col_starts]
+
+    def stitch(self, outputs: Sequence[np.ndarray]) -> np.ndarray:
+        """
+        Stitch the output maps of tiles() into the map of the whole image with one gather.
+
+        Parameters:
+        - outputs (sequence of np.ndarray): Per-tile output maps, in the order of tiles()
+
+        Returns:
+        - np.ndarray: Map of output_shape, of the dtype of the tile outputs
+        """
+        stack = np.stack([np.asarray(output) for output in outputs])
+        return stack[self._tile, self._local_row, self._local_col]
+
+    def patch_edges(self, stitched: np.ndarray, image: np.ndarray, model: SoftwareCNN) -> np.ndarray:
+        """
+        Replace the trailing outputs of stitch() that the tiles cannot compute exactly, along each dimension that is
+        not a multiple of STRIDE, with the outputs of `model` on a strip of the image along that edge.
+
+        Parameters:
+        - stitched (np.ndarray): Map returned by stitch(); modified in place
+        - image (np.ndarray): The tiled image
+        - model (SoftwareCNN): Bit-exact model of the tile convolution
+
+        Returns:
+        - np.ndarray: `stitched`
+        """
+        row_start, col_start = self.edge_starts
+        trail = self.trail
+        if row_start is not None:
+            stitched[-trail:, :] = model(image[row_start:, :])[-trail:, :]
+        if col_start is not None:
+            stitched[:, -trail:] = model(image[:, col_start:])[:, -trail:]
+        return stitched
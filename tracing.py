@@ -0,0 +1,55 @@
+"""
+File: tracing.py
+Authors: B. Ko, C. Okoye, S. Xiao
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# ######################################################################################################################
+
+class Trace:
+    """
+    Per-request record of how long each pipeline stage took.
+
+    Durations of a stage that runs more than once (e.g. once per colour plane) are summed.
+
+    Parameters:
+    - trace_id (str): Optional identifier carried through the pipeline
+    """
+
+    __slots__ = ("trace_id", "stages", "start")
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.stages: Dict[str, float] = {}
+        self.start = time.perf_counter()
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        """ Time the body of a with-block as stage `name`. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def elapsed(self) -> float:
+        """ Seconds since the trace was created. """
+        return time.perf_counter() - self.start
+
+
+class _NullTrace(Trace):
+    """ Trace that records nothing, used when the caller did not ask for one. """
+
+    __slots__ = ()
+
+    def add(self, stage: str, seconds: float):
+        pass
+
+
+NULL_TRACE = _NullTrace()
@@ -0,0 +1,295 @@
+"""
+File: video_stream.py
+Authors: B. Ko, C. Okoye, S. Xiao
+
+Continuous input (camera, MJPEG/RTSP URL or video file) through the face-crop and accelerator pipeline.
+
+- FrameSource reads the capture on its own thread and keeps only the newest frame, so when the accelerator falls
+  behind, stale frames are dropped at the source instead of queueing without limit.
+- FaceTracker runs the Haar cascade every `detect_every` frames and follows the face box in between by template
+  matching in a window around its last position, re-detecting as soon as the match gets weak. While no face is in
+  view the cascade still runs only every `detect_every` frames; the frames in between are skipped.
+- VideoPipeline is a generator of per-frame events with at most `max_in_flight` frames in the accelerator, so
+  cropping frame N+1 overlaps the convolution of frame N.
+- StreamStats reports sustained FPS and capture-to-result latency over a sliding window.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Iterator, Optional, Tuple
+import cv2
+import numpy as np
+from accelerator_scheduler import QueueFullError
+from ingest import crop_and_resize, split_planes
+from software_cnn import INPUT_SIZE
+from tracing import Trace
+
+# ######################################################################################################################
+
+class FrameSource:
+    """
+    Newest-frame-wins reader of a cv2.VideoCapture.
+
+    Parameters:
+    - spec (int or str): Camera index, video file path or stream URL
+    - realtime (bool): Pace a video file at its own frame rate like a live source; None paces files only
+    """
+
+    def __init__(self, spec, realtime: Optional[bool] = None):
+        self.spec = spec
+        self.realtime = realtime if realtime is not None else isinstance(spec, str) and "://" not in spec
+        self.captured = 0
+        self.dropped = 0
+        self.finished = False
+        self.error: Optional[str] = None
+        self._latest: Optional[Tuple[int, float, np.ndarray]] = None
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._read, name="frame-source", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+
+    def _read(self):
+        capture = cv2.VideoCapture(self.spec)
+        try:
+            if not capture.isOpened():
+                self.error = f"Could not open video source {self.spec!r}"
+                return
+            fps = capture.get(cv2.CAP_PROP_FPS) or 0
+            interval = 1.0 / fps if self.realtime and fps > 0 else 0.0
+            next_at = time.monotonic()
+            while not self._stop.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                if interval:
+                    next_at += interval
+                    delay = next_at - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                with self._condition:
+                    if self._latest is not None:
+                        self.dropped += 1
+                    self._latest = (self.captured, time.monotonic(), frame)
+                    self.captured += 1
+                    self._condition.notify()
+        finally:
+            capture.release()
+            with self._condition:
+                self.finished = True
+                self._condition.notify_all()
+
+    def latest(self, timeout: float = 1.0) -> Optional[Tuple[int, float, np.ndarray]]:
+        """ Take the newest unseen frame as (index, capture time, BGR frame); None on timeout or end of input. """
+        with self._condition:
+            if self._latest is None and not self.finished:
+                self._condition.wait(timeout)
+            item, self._latest = self._latest, None
+            return item
+
+
+# ######################################################################################################################
+
+class FaceTracker:
+    """
+    Face box for each frame of a sequence, with a cascade detection only every `detect_every` frames, whether or not
+    the last one found a face.
+
+    Parameters:
+    - detector (FaceDetector): Used for the periodic detections, in the calling thread
+    - detect_every (int): Frames per detection; 1 detects on every frame
+    - search_margin (float): Tracking search window around the last box, as a fraction of the box size
+    - min_score (float): Normalised correlation below which tracking gives up and the face is re-detected
+    """
+
+    def __init__(self, detector, detect_every: int = 5, search_margin: float = 0.5, min_score: float = 0.5):
+        self.detector = detector
+        self.detect_every = max(1, detect_every)
+        self.search_margin = search_margin
+        self.min_score = min_score
+        self.detections = 0
+        self.tracked = 0
+        self.skipped = 0
+        self._box: Optional[Tuple[int, int, int, int]] = None
+        self._template: Optional[np.ndarray] = None
+        # No detection yet, so the first frame runs one.
+        self._since_detection = self.detect_every
+
+    def _detect(self, bgr_img: np.ndarray, gray: np.ndarray):
+        self.detections += 1
+        self._since_detection = 0
+        faces = self.detector.detect(bgr_img)
+        if len(faces) == 0:
+            self._box = self._template = None
+            return None, "detect"
+        x, y, w, h = (int(v) for v in faces[0])
+        self._box = (x, y, w, h)
+        self._template = gray[y:y + h, x:x + w].copy()
+        return self._box, "detect"
+
+    def update(self, bgr_img: np.ndarray):
+        """
+        Returns:
+        - tuple: ((x, y, w, h) or None, "detect", "track" or "skip")
+        """
+        due = self._since_detection + 1 >= self.detect_every
+        if self._box is None and not due:
+            # No face at the last detection; wait for the next one rather than run the cascade on every frame.
+            self.skipped += 1
+            self._since_detection += 1
+            return None, "skip"
+        gray = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2GRAY)
+        if self._box is None or due:
+            return self._detect(bgr_img, gray)
+
+        x, y, w, h = self._box
+        mx, my = int(w * self.search_margin), int(h * self.search_margin)
+        x0, y0 = max(0, x - mx), max(0, y - my)
+        window = gray[y0:y + h + my, x0:x + w + mx]
+        if window.shape[0] < h or window.shape[1] < w:
+            return self._detect(bgr_img, gray)
+
+        scores = cv2.matchTemplate(window, self._template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+        if score < self.min_score:
+            return self._detect(bgr_img, gray)
+
+        self.tracked += 1
+        self._since_detection += 1
+        x, y = x0 + dx, y0 + dy
+        self._box = (x, y, w, h)
+        # Follow gradual changes in pose and lighting.
+        self._template = gray[y:y + h, x:x + w].copy()
+        return self._box, "track"
+
+    @property
+    def detect_ratio(self) -> float:
+        """ Fraction of the frames seen so far that ran the cascade. """
+        frames = self.detections + self.tracked + self.skipped
+        return self.detections / frames if frames else 0.0
+
+
+# ######################################################################################################################
+
+class StreamStats:
+    """
+    Sustained FPS and capture-to-result latency over the last `window` seconds.
+    """
+
+    def __init__(self, window: float = 5.0):
+        self.window = window
+        self.processed = 0
+        self.rejected = 0
+        self.no_face = 0
+        self._completions = deque()
+
+    def record(self, latency: float):
+        now = time.monotonic()
+        self.processed += 1
+        self._completions.append((now, latency))
+        while self._completions and now - self._completions[0][0] > self.window:
+            self._completions.popleft()
+
+    def snapshot(self) -> dict:
+        stats = {"processed": self.processed, "rejected": self.rejected, "no_face": self.no_face}
+        if len(self._completions) >= 2:
+            span = self._completions[-1][0] - self._completions[0][0]
+            stats["fps"] = (len(self._completions) - 1) / span if span > 0 else 0.0
+        if self._completions:
+            latencies = np.fromiter((latency for _, latency in self._completions), dtype=np.float64) * 1e3
+            p50, p95 = np.percentile(latencies, [50, 95])
+            stats.update(latency_p50_ms=float(p50), latency_p95_ms=float(p95))
+        return stats
+
+
+class VideoPipeline:
+    """
+    Parameters:
+    - source (FrameSource): Frames to process; started and stopped by run()
+    - accelerator: LocalAccelerator or serve.RemoteAccelerator
+    - detector (FaceDetector): Cascade detector
+    - detect_every (int): See FaceTracker
+    - max_in_flight (int): Frames in the accelerator at once; newer frames wait at the source and may be dropped
+    - timeout (float): Seconds to wait for one frame's results
+    """
+
+    FIXED_IMAGE_SIZE = (INPUT_SIZE, INPUT_SIZE)
+
+    def __init__(self, source: FrameSource, accelerator, detector, detect_every: int = 5, max_in_flight: int = 2,
+                 timeout: float = 30.0):
+        self.source = source
+        self.accelerator = accelerator
+        self.tracker = FaceTracker(detector, detect_every)
+        self.max_in_flight = max(1, max_in_flight)
+        self.timeout = timeout
+        self.stats = StreamStats()
+
+    def counters(self) -> dict:
+        counters = self.stats.snapshot()
+        counters.update(captured=self.source.captured, dropped=self.source.dropped,
+                        detections=self.tracker.detections, tracked=self.tracker.tracked,
+                        skipped=self.tracker.skipped, detect_ratio=self.tracker.detect_ratio)
+        return counters
+
+    def _finish(self, entry) -> dict:
+        index, captured_at, box, how, futures, trace = entry
+        outputs = [future.result(self.timeout) for future in futures]
+        latency = time.monotonic() - captured_at
+        self.stats.record(latency)
+        return {"frame": index, "box": list(box), "box_source": how, "latency_ms": latency * 1e3,
+                "outputs": outputs, "stages": trace.stages}
+
+    def run(self) -> Iterator[dict]:
+        """
+        Yield one event per processed frame: frame index, face box and whether it was detected or tracked,
+        capture-to-result latency, the ConvolutionResults of the R, G and B planes and the stage timings. Frames
+        without a face yield an event with box None, and box_source "skip" between detections while no face is in
+        view. Ends with the source.
+        """
+        self.source.start()
+        in_flight = deque()
+        try:
+            while True:
+                item = self.source.latest()
+                if item is None:
+                    if self.source.finished:
+                        break
+                    continue
+                index, captured_at, frame = item
+
+                trace = Trace(str(index))
+                with trace.stage("track"):
+                    box, how = self.tracker.update(frame)
+                if box is None:
+                    self.stats.no_face += 1
+                    yield {"frame": index, "box": None, "box_source": how}
+                    continue
+
+                with trace.stage("crop_resize"):
+                    planes = split_planes(crop_and_resize(frame, box, self.FIXED_IMAGE_SIZE))
+                try:
+                    futures = self.accelerator.submit_many(planes, trace=trace)
+                except QueueFullError:
+                    # Shared with /submit traffic; skip this frame rather than wait.
+                    self.stats.rejected += 1
+                    continue
+                in_flight.append((index, captured_at, box, how, futures, trace))
+                while len(in_flight) >= self.max_in_flight:
+                    yield self._finish(in_flight.popleft())
+
+            while in_flight:
+                yield self._finish(in_flight.popleft())
+            if self.source.error is not None:
+                raise RuntimeError(self.source.error)
+        finally:
+            self.source.stop()